@@ -3,31 +3,40 @@ FastAPI 后端服务器
 提供智能体聊天流式接口
 """
 
+import asyncio
 import logging
 import os
 import sys
+import time
 from datetime import datetime
 from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
 from contextlib import asynccontextmanager
 
 import uvicorn
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from langchain.schema import HumanMessage
-from langgraph.checkpoint.memory import MemorySaver
+from langchain_core.messages import ToolMessage
+from langgraph.errors import GraphRecursionError
 
 # 添加项目路径
 sys.path.append(str(Path(__file__).parent))
 
 # 导入后端模块
 from backend.agent import WebAgent
+from backend.checkpointer import BoundedMemorySaver, has_thread_state, rehydrate_messages
 from backend.prompts import get_reasoning_prompt, get_simple_prompt
 from backend.utils import check_api_key
-from backend.llm_config import LLMConfig, LLMProvider
-from backend.session_manager import get_session_manager
+from backend.llm_config import SUMMARY_MAX_OUTPUT_TOKENS, LLMConfig, LLMProvider
+from backend.session_manager import ARCHIVE_AFTER_DAYS, get_session_manager
+from backend.session_writer import SessionWriter
+from backend.metrics import get_metrics
+from backend.prefetch import SPECULATIVE_SEARCH
+from backend.run_budget import fallback_answer, recursion_limit, run_limits
 
 # 加载环境变量
 load_dotenv()
@@ -37,20 +46,86 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(level
 logger = logging.getLogger(__name__)
 
 
+# 后台归档任务的执行间隔（秒）
+ARCHIVE_INTERVAL = int(os.getenv("SESSION_ARCHIVE_INTERVAL", str(6 * 3600)))
+
+# 检查点清理任务的执行间隔（秒）
+CHECKPOINT_PRUNE_INTERVAL = int(os.getenv("CHECKPOINT_PRUNE_INTERVAL", "3600"))
+
+# 智能体事件队列容量（客户端读取较慢时智能体任务在此等待）
+EVENT_QUEUE_SIZE = 256
+
+# 检查客户端是否断开连接的间隔（秒）
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "1"))
+
+
+async def archive_loop():
+    """后台归档任务：定期把长时间未更新的会话移入压缩归档"""
+    metrics = get_metrics()
+    while True:
+        try:
+            stats = await asyncio.to_thread(get_session_manager().archive_sessions)
+            metrics.incr("session_archive.sessions", stats["archived"])
+            metrics.incr("session_archive.bytes_reclaimed", stats["bytes_reclaimed"])
+        except Exception as e:
+            logger.error(f"后台归档失败: {e}", exc_info=True)
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+
+async def checkpoint_prune_loop(checkpointer: BoundedMemorySaver):
+    """后台清理任务：定期删除超过保留期或超出容量的检查点线程"""
+    metrics = get_metrics()
+    while True:
+        await asyncio.sleep(CHECKPOINT_PRUNE_INTERVAL)
+        try:
+            pruned = await checkpointer.aprune()
+            metrics.incr("checkpointer.pruned_threads", pruned)
+            if pruned:
+                logger.info(f"已清理 {pruned} 个过期的检查点线程")
+        except Exception as e:
+            logger.error(f"清理检查点失败: {e}", exc_info=True)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
-    # 启动时初始化
+    # 启动时初始化（检查点只在内存中缓存智能体的工作状态，对话记录以会话存储为准）
     logger.info("正在初始化 Web 智能体...")
-    checkpointer = MemorySaver()
+    checkpointer = BoundedMemorySaver()
     agent = WebAgent(checkpointer=checkpointer)
     app.state.agent = agent
     logger.info("Web 智能体初始化完成")
 
+    # 会话写入后台线程（流式接口结束后异步落盘）
+    session_writer = SessionWriter(get_session_manager())
+    session_writer.start()
+    app.state.session_writer = session_writer
+
+    # 检索索引为空（首次启用）时在后台根据已有会话建立索引
+    session_manager = get_session_manager()
+    reindex_task = None
+    if session_manager.search_index is not None and session_manager.search_index.is_empty():
+        reindex_task = asyncio.create_task(asyncio.to_thread(session_manager.rebuild_search_index))
+
+    # 会话归档后台任务（SESSION_ARCHIVE_DAYS=0 时关闭）
+    archive_task = None
+    if ARCHIVE_AFTER_DAYS > 0:
+        archive_task = asyncio.create_task(archive_loop())
+
+    # 检查点清理后台任务
+    prune_task = asyncio.create_task(checkpoint_prune_loop(checkpointer))
+
     yield
 
     # 关闭时清理
     logger.info("正在关闭应用...")
+    prune_task.cancel()
+    if archive_task is not None:
+        archive_task.cancel()
+    if reindex_task is not None:
+        await reindex_task
+    # 写完队列中剩余的会话
+    await asyncio.to_thread(session_writer.stop)
 
 
 # 创建 FastAPI 应用
@@ -78,6 +153,10 @@ class AgentRequest(BaseModel):
     agent_type: str  # 智能体类型（fast/deep）
     llm_provider: str = LLMProvider.CLAUDE  # LLM 提供商（默认 Claude）
     llm_model: str = "sonnet"  # LLM 模型名称
+    speculative_search: Optional[bool] = None  # 是否预取搜索（默认取 SPECULATIVE_SEARCH）
+    deadline_seconds: Optional[float] = None  # 最长耗时（秒，不超过 AGENT_DEADLINE_SECONDS）
+    max_steps: Optional[int] = None  # 最多工具调用轮数（不超过 AGENT_MAX_STEPS）
+    max_tool_calls: Optional[int] = None  # 最多工具调用次数（不超过 AGENT_MAX_TOOL_CALLS）
 
 
 @app.get("/")
@@ -96,6 +175,12 @@ async def health():
         "status": "healthy"
     }
 
+@app.get("/api/metrics")
+async def metrics():
+    """运行指标接口（计数器、耗时统计、队列深度等）"""
+    return get_metrics().snapshot()
+
+
 @app.post("/stream_agent")
 async def stream_agent(body: AgentRequest, request: Request):
     """
@@ -120,57 +205,6 @@ async def stream_agent(body: AgentRequest, request: Request):
     if not tavily_api_key:
         raise HTTPException(status_code=400, detail="缺少 Tavily API 密钥")
 
-    try:
-        check_api_key(api_key=tavily_api_key)
-    except Exception as e:
-        logger.error(f"Tavily API 密钥验证失败: {e}")
-        raise HTTPException(status_code=401, detail=f"Tavily API 密钥验证失败: {str(e)}")
-
-    # 创建主 LLM（用于智能体推理）
-    try:
-        if body.llm_provider == LLMProvider.CLAUDE:
-            main_llm = LLMConfig.create_claude(
-                model=body.llm_model,
-                api_key=claude_api_key,
-                temperature=0.7,
-                max_tokens=4096,
-                streaming=True
-            )
-        elif body.llm_provider == LLMProvider.OPENAI:
-            main_llm = LLMConfig.create_openai(
-                model=body.llm_model,
-                api_key=openai_api_key,
-                temperature=1,
-                max_tokens=4096,
-                streaming=True
-            )
-        elif body.llm_provider == LLMProvider.GROQ:
-            main_llm = LLMConfig.create_groq(
-                model=body.llm_model,
-                api_key=groq_api_key,
-                temperature=0.7,
-                max_tokens=4096,
-                streaming=True
-            )
-        else:
-            raise ValueError(f"不支持的 LLM 提供商: {body.llm_provider}")
-    except Exception as e:
-        logger.error(f"创建主 LLM 失败: {e}")
-        raise HTTPException(status_code=500, detail=f"创建主 LLM 失败: {str(e)}")
-
-    # 创建摘要 LLM（使用快速模型）
-    try:
-        summary_llm = LLMConfig.create_claude(
-            model="haiku",
-            api_key=claude_api_key,
-            temperature=0.5,
-            max_tokens=1024,
-            streaming=False
-        )
-    except Exception as e:
-        logger.warning(f"创建摘要 LLM 失败，使用主 LLM: {e}")
-        summary_llm = main_llm
-
     # 选择提示词（每次请求时动态获取，确保日期实时更新）
     if body.agent_type == "fast":
         prompt = get_simple_prompt()
@@ -181,16 +215,80 @@ async def stream_agent(body: AgentRequest, request: Request):
     else:
         raise HTTPException(status_code=400, detail="无效的智能体类型，请选择 'fast' 或 'deep'")
 
-    # 构建智能体
-    try:
-        agent_runnable = app.state.agent.build_graph(
+    # 编译后的智能体图按 (提供商, 模型, 模式, 主题, 时间范围, 密钥哈希, 提示词哈希) 缓存，
+    # 未命中时才验证 Tavily 密钥、创建 LLM 并构建图
+    graph_key = WebAgent.graph_key(
+        provider=body.llm_provider,
+        model=body.llm_model,
+        mode=body.agent_type,
+        topic="general",
+        time_range=None,
+        api_keys=(tavily_api_key, claude_api_key, openai_api_key, groq_api_key),
+        prompt=prompt,
+    )
+
+    def build_agent_graph():
+        try:
+            check_api_key(api_key=tavily_api_key)
+        except Exception as e:
+            logger.error(f"Tavily API 密钥验证失败: {e}")
+            raise HTTPException(status_code=401, detail=f"Tavily API 密钥验证失败: {str(e)}")
+
+        # 创建主 LLM（用于智能体推理，输出上限按模型分配）
+        try:
+            if body.llm_provider == LLMProvider.CLAUDE:
+                main_llm = LLMConfig.create_claude(
+                    model=body.llm_model,
+                    api_key=claude_api_key,
+                    temperature=0.7,
+                    streaming=True
+                )
+            elif body.llm_provider == LLMProvider.OPENAI:
+                main_llm = LLMConfig.create_openai(
+                    model=body.llm_model,
+                    api_key=openai_api_key,
+                    temperature=1,
+                    streaming=True
+                )
+            elif body.llm_provider == LLMProvider.GROQ:
+                main_llm = LLMConfig.create_groq(
+                    model=body.llm_model,
+                    api_key=groq_api_key,
+                    temperature=0.7,
+                    streaming=True
+                )
+            else:
+                raise ValueError(f"不支持的 LLM 提供商: {body.llm_provider}")
+        except Exception as e:
+            logger.error(f"创建主 LLM 失败: {e}")
+            raise HTTPException(status_code=500, detail=f"创建主 LLM 失败: {str(e)}")
+
+        # 创建摘要 LLM（使用快速模型）
+        try:
+            summary_llm = LLMConfig.create_claude(
+                model="haiku",
+                api_key=claude_api_key,
+                temperature=0.5,
+                max_tokens=SUMMARY_MAX_OUTPUT_TOKENS,
+                streaming=False
+            )
+        except Exception as e:
+            logger.warning(f"创建摘要 LLM 失败，使用主 LLM: {e}")
+            summary_llm = main_llm
+
+        return app.state.agent.build_graph(
             api_key=tavily_api_key,
             llm=main_llm,
             prompt=prompt,
             summary_llm=summary_llm,
-            user_message=body.input,
             mode=body.agent_type  # 传递智能体模式（fast/deep）
         )
+
+    # 构建智能体
+    try:
+        agent_runnable = await app.state.agent.get_or_build_graph(graph_key, build_agent_graph)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"构建智能体失败: {e}")
         raise HTTPException(status_code=500, detail=f"构建智能体失败: {str(e)}")
@@ -199,7 +297,26 @@ async def stream_agent(body: AgentRequest, request: Request):
     async def event_generator():
         import json
 
-        config = {"configurable": {"thread_id": body.thread_id}}
+        # 推测性搜索预取：请求到达时立即以用户问题发起搜索，与主 LLM 的第一轮调用并行
+        speculative = SPECULATIVE_SEARCH if body.speculative_search is None else body.speculative_search
+        prefetch = app.state.agent.prefetch_search(agent_runnable, body.input) if speculative else None
+
+        # 本次请求的运行预算：截止时间、最多工具调用轮数和次数（见 backend/run_budget.py）
+        limits = run_limits(body.deadline_seconds, body.max_steps, body.max_tool_calls)
+        deadline_at = time.monotonic() + limits["deadline_seconds"]
+
+        # 用户消息、搜索预取和运行预算通过运行配置传给工具（编译后的图在请求之间共享）
+        config = {
+            "configurable": {
+                "thread_id": body.thread_id,
+                "user_message": body.input,
+                "search_prefetch": prefetch,
+                "tool_deadline": limits["tool_deadline"],
+                "max_steps": limits["max_steps"],
+                "max_tool_calls": limits["max_tool_calls"],
+            },
+            "recursion_limit": recursion_limit(limits["max_steps"]),
+        }
         operation_counter = 0
         current_step = 0
         is_final_step = False
@@ -211,14 +328,96 @@ async def stream_agent(body: AgentRequest, request: Request):
         # 用于收集完整的响应以便保存
         full_response = ""
         tool_calls_list = []
+        # 历史压缩节省的 token 数（本次请求内所有模型调用之和）
+        context_tokens_saved = 0
+        # 进行中的工具调用：run_id -> (操作序号, 工具名, 工具类型)
+        # 同一步中的多个工具调用并发执行，结束顺序与开始顺序不同，按 run_id 对应操作序号
+        pending_tools: Dict[str, Tuple[int, str, str]] = {}
+        # 成功返回的工具结果（超出预算且模型未给出答案时用于生成尽力而为的答案）
+        tool_outputs = []
+
+        # 智能体在独立任务中运行，事件经队列转发；到达截止时间时取消该任务，进行中的 LLM 和工具调用随之取消
+        event_queue: asyncio.Queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        agent_task: Optional[asyncio.Task] = None
+        stop_reason: Optional[str] = None  # deadline（超时）、max_steps（超出步数）或 disconnected（客户端断开）
+        aborted = False  # 客户端断开连接，运行被中止
+        completed = False  # 智能体运行正常结束
+
+        async def run_agent(input_messages):
+            try:
+                async for event in agent_runnable.astream_events(
+                    input={"messages": input_messages},
+                    config=config,
+                    version="v2",
+                ):
+                    await event_queue.put(event)
+            except Exception as e:
+                await event_queue.put(e)
+            else:
+                await event_queue.put(None)
+
+        async def agent_events(input_messages):
+            """转发智能体事件，直到运行结束、出错、超出预算或客户端断开连接"""
+            nonlocal agent_task, stop_reason, completed
+            agent_task = asyncio.create_task(run_agent(input_messages))
+            # 模型思考和工具调用期间没有输出，只有写入响应时才能发现连接已断开，因此定期主动检查
+            next_check = time.monotonic() + DISCONNECT_POLL_SECONDS
+            while True:
+                now = time.monotonic()
+                # 每次取事件之前检查截止时间：模型持续输出时队列不会为空，不能只在等待超时时检查
+                if now >= deadline_at:
+                    stop_reason = "deadline"
+                    return
+                if now >= next_check:
+                    if await request.is_disconnected():
+                        stop_reason = "disconnected"
+                        return
+                    next_check = now + DISCONNECT_POLL_SECONDS
+                try:
+                    item = await asyncio.wait_for(event_queue.get(), max(0.0, min(deadline_at, next_check) - now))
+                except asyncio.TimeoutError:
+                    continue
+                if isinstance(item, GraphRecursionError):
+                    stop_reason = "max_steps"
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                if item is None:
+                    completed = True
+                    return
+                yield item
+
+        def tool_end_event(operation_index: int, tool_name: str, tool_type: str, content: Any,
+                           cached: bool = False, status: str = "success") -> str:
+            start = time.thread_time()
+            line = json.dumps({
+                "type": "tool_end",
+                "tool_name": tool_name,
+                "tool_type": tool_type,
+                "operation_index": operation_index,
+                "content": content,
+                "cached": cached,
+                "status": status,
+            }, ensure_ascii=False, default=str) + "\n"
+            get_metrics().observe("stream.tool_end_cpu_seconds", time.thread_time() - start)
+            return line
 
         try:
             logger.info(f"开始流式处理，用户输入: {body.input[:50]}...")
-            async for event in agent_runnable.astream_events(
-                input={"messages": [HumanMessage(content=body.input)]},
-                config=config,
-                version="v2",
-            ):
+
+            # 检查点缓存中没有该线程（进程重启、已被淘汰或上一轮未正常结束）时，从已保存的会话恢复对话上下文
+            input_messages = [HumanMessage(content=body.input)]
+            if not await has_thread_state(app.state.agent.checkpointer, body.thread_id):
+                # 上一轮的消息可能还在写入队列中，先等它写完再读会话
+                await asyncio.to_thread(app.state.session_writer.wait_for_session, body.thread_id)
+                session_data = await asyncio.to_thread(get_session_manager().get_session, body.thread_id)
+                if session_data and session_data["messages"]:
+                    history = rehydrate_messages(session_data["messages"])
+                    input_messages = history + input_messages
+                    get_metrics().incr("checkpointer.rehydrated_threads")
+                    logger.info(f"从会话恢复上下文: {body.thread_id}, {len(history)} 条历史消息")
+
+            async for event in agent_events(input_messages):
                 event_count += 1
                 event_type = event.get("event", "unknown")
                 logger.info(f"收到事件 #{event_count}: {event_type}")
@@ -328,14 +527,6 @@ async def stream_agent(body: AgentRequest, request: Request):
                     tool_name = event.get("name", "unknown_tool")
                     tool_input = event["data"].get("input", {})
 
-                    # 安全序列化工具输入
-                    try:
-                        if isinstance(tool_input, dict):
-                            serializable_input = {k: str(v) for k, v in tool_input.items()}
-                        else:
-                            serializable_input = str(tool_input)
-                    except:
-                        serializable_input = "无法序列化输入"
 
                     # 确定工具类型
                     tool_type = "search"
@@ -344,35 +535,31 @@ async def stream_agent(body: AgentRequest, request: Request):
                     elif tool_name and "crawl" in tool_name.lower():
                         tool_type = "crawl"
 
+                    operation_index = operation_counter
+                    operation_counter += 1
+                    pending_tools[event["run_id"]] = (operation_index, tool_name, tool_type)
+
                     yield (
                         json.dumps({
                             "type": "tool_start",
                             "tool_name": tool_name,
                             "tool_type": tool_type,
-                            "operation_index": operation_counter,
-                            "content": serializable_input,
-                        }, ensure_ascii=False)
+                            "operation_index": operation_index,
+                            # 参数保持原有结构，无法直接序列化的值转为字符串
+                            "content": tool_input,
+                        }, ensure_ascii=False, default=str)
                         + "\n"
                     )
-                    logger.info(f"工具开始: {tool_name} ({tool_type}) - 操作 {operation_counter}")
+                    logger.info(f"工具开始: {tool_name} ({tool_type}) - 操作 {operation_index}")
 
                 # 工具调用结束
                 elif event["event"] == "on_tool_end":
                     tool_name = event.get("name", "unknown_tool")
                     tool_output = event["data"].get("output")
 
-                    # 安全序列化工具输出
-                    try:
-                        if hasattr(tool_output, "content"):
-                            serializable_output = str(tool_output.content)
-                        elif isinstance(tool_output, dict):
-                            serializable_output = {k: str(v) for k, v in tool_output.items()}
-                        elif isinstance(tool_output, list):
-                            serializable_output = [str(item) for item in tool_output]
-                        else:
-                            serializable_output = str(tool_output)
-                    except:
-                        serializable_output = "无法序列化输出"
+                    # ToolMessage 的内容已是工具序列化好的 JSON 字符串，直接转发；
+                    # 其他输出保持原有结构，由 tool_end_event 统一序列化
+                    tool_content = getattr(tool_output, "content", tool_output)
 
                     # 确定工具类型
                     tool_type = "search"
@@ -381,18 +568,98 @@ async def stream_agent(body: AgentRequest, request: Request):
                     elif tool_name and "crawl" in tool_name.lower():
                         tool_type = "crawl"
 
-                    yield (
-                        json.dumps({
-                            "type": "tool_end",
-                            "tool_name": tool_name,
-                            "tool_type": tool_type,
-                            "operation_index": operation_counter,
-                            "content": serializable_output,
-                        }, ensure_ascii=False)
-                        + "\n"
+                    # 工具结果是否来自缓存（见 backend/tool_cache.py）
+                    artifact = getattr(tool_output, "artifact", None)
+                    cached = bool(isinstance(artifact, dict) and artifact.get("cached"))
+
+                    operation_index = pending_tools.pop(event["run_id"], (operation_counter,))[0]
+                    tool_outputs.append(tool_content)
+                    yield tool_end_event(operation_index, tool_name, tool_type, tool_content, cached)
+                    logger.info(
+                        f"工具结束: {tool_name} ({tool_type}) - 操作 {operation_index}"
+                        + ("（缓存命中）" if cached else "")
+                        + ("（使用预取结果）" if isinstance(artifact, dict) and artifact.get("prefetched") else "")
                     )
-                    logger.info(f"工具结束: {tool_name} ({tool_type}) - 操作 {operation_counter}")
-                    operation_counter += 1
+
+                # 工具节点结束：第一轮工具调用之后预取不再有用；
+                # 出错或超时的调用没有 on_tool_end 事件，用节点返回的错误消息补发结束事件
+                elif event["event"] == "on_chain_end" and event.get("name") == "tools":
+                    if prefetch is not None:
+                        prefetch.cancel()
+                    if pending_tools:
+                        output = event["data"].get("output")
+                        messages = output.get("messages", []) if isinstance(output, dict) else output or []
+                        errors = [
+                            message for message in messages
+                            if isinstance(message, ToolMessage) and message.status == "error"
+                        ]
+                        for operation_index, tool_name, tool_type in pending_tools.values():
+                            error = next((message for message in errors if message.name == tool_name), None)
+                            if error is not None:
+                                errors.remove(error)
+                            content = str(error.content) if error is not None else "工具调用失败，未返回结果"
+                            yield tool_end_event(operation_index, tool_name, tool_type, content, status="error")
+                            logger.warning(f"工具失败: {tool_name} ({tool_type}) - 操作 {operation_index}: {content}")
+                        pending_tools.clear()
+
+                # 历史压缩钩子结束（每次调用主 LLM 之前执行）
+                elif event["event"] == "on_chain_end" and event.get("name") == "pre_model_hook":
+                    output = event["data"].get("output")
+                    if isinstance(output, dict):
+                        context_tokens_saved += output.get("context_tokens_saved", 0)
+
+            # 客户端已断开：取消智能体任务，不再输出（已生成的部分答案在 finally 中保存）
+            if stop_reason == "disconnected":
+                agent_task.cancel()
+                aborted = True
+                return
+
+            # 超出预算：取消智能体任务，结束进行中的工具调用，并给出尽力而为的答案
+            if stop_reason:
+                agent_task.cancel()
+                get_metrics().incr(f"agent.{stop_reason}_exceeded")
+                logger.warning(f"请求超出运行预算（{stop_reason}）: {body.thread_id}")
+                for operation_index, tool_name, tool_type in pending_tools.values():
+                    yield tool_end_event(
+                        operation_index, tool_name, tool_type, "已超出本次请求的运行预算，调用已取消", status="error"
+                    )
+                pending_tools.clear()
+
+                # 已开始输出答案时保留已输出的内容；尚在缓冲区中未输出的内容直接输出
+                answered = react_mode is False or is_final_step
+                if react_mode is None and buffer.strip():
+                    yield json.dumps({"type": "chatbot", "content": buffer}, ensure_ascii=False) + "\n"
+                    answered = True
+                if not answered:
+                    full_response = fallback_answer(tool_outputs, stop_reason)
+                    yield json.dumps({"type": "chatbot", "content": full_response}, ensure_ascii=False) + "\n"
+
+                yield (
+                    json.dumps({
+                        "type": "deadline_exceeded",
+                        "reason": stop_reason,
+                        "deadline_seconds": limits["deadline_seconds"],
+                        "max_steps": limits["max_steps"],
+                        "max_tool_calls": limits["max_tool_calls"],
+                    }, ensure_ascii=False)
+                    + "\n"
+                )
+
+            get_metrics().observe("history.tokens_saved_per_request", context_tokens_saved)
+            if context_tokens_saved:
+                logger.info(f"历史压缩节省约 {context_tokens_saved} tokens")
+                yield (
+                    json.dumps({
+                        "type": "context",
+                        "tokens_saved": context_tokens_saved,
+                    }, ensure_ascii=False)
+                    + "\n"
+                )
+
+        except (asyncio.CancelledError, GeneratorExit):
+            # 服务器在写入失败或检测到断开时关闭了生成器
+            aborted = True
+            raise
 
         except Exception as e:
             logger.error(f"流式生成错误: {e}", exc_info=True)
@@ -404,34 +671,36 @@ async def stream_agent(body: AgentRequest, request: Request):
                 + "\n"
             )
 
-        # 流式传输结束后保存会话
+        # 流式传输结束后取消仍在运行的智能体任务和未使用的预取，并保存会话（中止时保存部分答案）
         finally:
+            if agent_task is not None and not agent_task.done():
+                agent_task.cancel()
+            if prefetch is not None:
+                prefetch.cancel()
+            if aborted:
+                get_metrics().incr("agent.aborted_runs")
+                logger.warning(f"客户端已断开连接，中止运行: {body.thread_id}")
+            # 运行未正常结束时检查点停在中途（可能留下没有结果的工具调用），与保存的会话不一致：
+            # 删除该线程的工作状态，下一轮从会话重建上下文
+            if not completed and app.state.agent.checkpointer is not None:
+                try:
+                    if agent_task is not None:
+                        # 等已取消的运行退出，避免它在删除之后又写入检查点
+                        await asyncio.wait([agent_task], timeout=5)
+                    await asyncio.shield(app.state.agent.checkpointer.adelete_thread(body.thread_id))
+                    get_metrics().incr("checkpointer.dropped_threads")
+                except Exception as drop_error:
+                    logger.error(f"删除检查点线程失败: {drop_error}", exc_info=True)
             try:
                 session_manager = get_session_manager()
 
-                # 尝试加载现有会话
-                session_data = session_manager.get_session(body.thread_id)
-
-                # 如果会话不存在，创建新会话
-                if session_data is None:
-                    # 使用第一条消息生成标题
-                    title = session_manager.auto_generate_title(body.input)
-                    session_data = {
-                        "session_id": body.thread_id,
-                        "title": title,
-                        "created_at": datetime.now().isoformat(),
-                        "updated_at": datetime.now().isoformat(),
-                        "messages": []
-                    }
-
-                # 添加用户消息
-                session_data["messages"].append({
+                # 本轮新增的消息：用户消息 + 助手响应（如果有完整响应）
+                new_messages = [{
                     "role": "user",
                     "content": body.input,
                     "timestamp": datetime.now().isoformat()
-                })
+                }]
 
-                # 添加助手响应（如果有完整响应）
                 if full_response:
                     assistant_message = {
                         "role": "assistant",
@@ -443,11 +712,20 @@ async def stream_agent(body: AgentRequest, request: Request):
                     if tool_calls_list:
                         assistant_message["tool_calls"] = tool_calls_list
 
-                    session_data["messages"].append(assistant_message)
+                    # 客户端断开时只生成了部分答案
+                    if aborted:
+                        assistant_message["aborted"] = True
 
-                # 保存会话
-                session_manager.save_session(session_data)
-                logger.info(f"会话已保存: {body.thread_id}, 标题: {session_data['title']}")
+                    new_messages.append(assistant_message)
+
+                # 交给后台写入线程追加到会话（会话不存在时使用第一条消息生成标题）；
+                # 生成器被取消时提交仍会完成
+                await asyncio.shield(app.state.session_writer.submit(
+                    body.thread_id,
+                    new_messages,
+                    title=session_manager.auto_generate_title(body.input)
+                ))
+                logger.info(f"会话已提交保存: {body.thread_id}")
             except Exception as save_error:
                 logger.error(f"保存会话失败: {save_error}", exc_info=True)
                 # 保存失败不应该影响响应，只记录错误
@@ -458,22 +736,59 @@ async def stream_agent(body: AgentRequest, request: Request):
 # ==================== 会话管理 API ====================
 
 @app.get("/api/sessions")
-async def get_sessions():
+async def get_sessions(
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None
+):
     """
-    获取所有会话列表
+    获取会话列表（按更新时间倒序）
+
+    Args:
+        limit: 每页条数（可选，不传则返回全部会话）
+        cursor: 上一页返回的 next_cursor（可选）
 
     Returns:
-        会话列表（仅元数据）
+        会话列表（仅元数据）；分页时附带 next_cursor
     """
     try:
         session_manager = get_session_manager()
-        sessions = session_manager.get_sessions_list()
-        return {"sessions": sessions}
+        if limit is None and cursor is None:
+            sessions = session_manager.get_sessions_list()
+            return {"sessions": sessions}
+        return session_manager.get_sessions_page(limit or 50, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"获取会话列表失败: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"获取会话列表失败: {str(e)}")
 
 
+@app.get("/api/sessions/search")
+async def search_sessions(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100)
+):
+    """
+    全文检索会话消息（需在 /api/sessions/{session_id} 之前注册）
+
+    Args:
+        q: 查询文本
+        limit: 最多返回的会话数
+
+    Returns:
+        按相关度排序的会话，每个会话附带命中消息的 seq 和带 <mark> 高亮的摘要
+    """
+    try:
+        metrics = get_metrics()
+        start = time.perf_counter()
+        results = await asyncio.to_thread(get_session_manager().search_sessions, q, limit)
+        metrics.observe("session_search.seconds", time.perf_counter() - start)
+        return {"query": q, "results": results}
+    except Exception as e:
+        logger.error(f"检索会话失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"检索会话失败: {str(e)}")
+
+
 @app.get("/api/sessions/{session_id}")
 async def get_session(session_id: str):
     """
@@ -500,6 +815,38 @@ async def get_session(session_id: str):
         raise HTTPException(status_code=500, detail=f"获取会话失败: {str(e)}")
 
 
+@app.get("/api/sessions/{session_id}/messages")
+async def get_session_messages(
+    session_id: str,
+    before: Optional[int] = Query(None, ge=0),
+    limit: int = Query(50, ge=1, le=500)
+):
+    """
+    分页获取会话消息（从最新消息向前翻页）
+
+    Args:
+        session_id: 会话ID
+        before: 只返回序号小于该值的消息（可选，不传则返回最新的消息）
+        limit: 每页条数
+
+    Returns:
+        消息列表（每条带 seq 序号）、消息总数和下一页的 before 参数
+    """
+    try:
+        session_manager = get_session_manager()
+        page = session_manager.get_messages_page(session_id, before=before, limit=limit)
+
+        if page is None:
+            raise HTTPException(status_code=404, detail="会话不存在")
+
+        return page
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"获取会话消息失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"获取会话消息失败: {str(e)}")
+
+
 class CreateSessionRequest(BaseModel):
     """创建会话请求模型"""
     session_id: str
@@ -575,6 +922,9 @@ async def delete_session(session_id: str):
     try:
         session_manager = get_session_manager()
         success = session_manager.delete_session(session_id)
+        # 同时删除智能体的工作状态，避免同名会话继承已删除的上下文
+        if app.state.agent.checkpointer is not None:
+            await app.state.agent.checkpointer.adelete_thread(session_id)
         return {"success": success, "message": "删除成功"}
     except Exception as e:
         logger.error(f"删除会话失败: {e}", exc_info=True)
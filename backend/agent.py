@@ -1,94 +1,493 @@
+import asyncio
+import hashlib
 import logging
-from typing import Callable, Any
+import os
+import re
+import threading
+import time
+from typing import Awaitable, Callable, Any, ClassVar, Iterable, List, Literal, Optional, Tuple
 from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import ToolException
 from langchain_tavily import TavilyCrawl, TavilyExtract, TavilySearch
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.graph.state import CompiledStateGraph
 from langgraph.prebuilt import create_react_agent
 import json
 import ast
 
+from backend.cache import LRUCache, TieredCache
+from backend.history import HISTORY_TOKEN_BUDGET, CompactingAgentState, create_history_compactor
+from backend.metrics import get_metrics
+from backend.prefetch import SearchPrefetch, get_search_prefetch
+from backend.preprocess import PREPROCESS_ENABLED, clean_pages, unique_url_indexes
+from backend.ranking import select_passages
+from backend.singleflight import SingleFlight
+from backend.token_budget import estimate_tokens, model_budget, split_tokens, truncate_tokens
+from backend.tool_cache import TOOL_CACHE_TTL_GENERAL, CachedToolMixin, tool_cache_ttl
+from backend.tool_node import ConcurrentToolNode
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 编译后智能体图的缓存容量
+GRAPH_CACHE_SIZE = int(os.getenv("AGENT_GRAPH_CACHE_SIZE", "32"))
+
+# 工具输出摘要的超时时间（秒），超时后回退到截断内容
+SUMMARY_TIMEOUT = float(os.getenv("SUMMARY_TIMEOUT", "20"))
+# 摘要分块大小（token 数），内容不超过一块时只调用一次摘要模型
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "1500"))
+# 单次工具输出最多摘要的分块数
+SUMMARY_MAX_CHUNKS = int(os.getenv("SUMMARY_MAX_CHUNKS", "16"))
+# 分块并发摘要的最大并发数
+SUMMARY_MAX_CONCURRENCY = int(os.getenv("SUMMARY_MAX_CONCURRENCY", "8"))
+# 摘要失败时回退内容的 token 数
+SUMMARY_FALLBACK_TOKENS = 250
+
+# 摘要缓存的内存层条目数（0 表示关闭摘要缓存）
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "512"))
+# 摘要缓存的存活时间（秒）
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", "86400"))
+# 摘要缓存的磁盘层数据库路径（为空时只使用内存层）
+SUMMARY_CACHE_DB_PATH = os.getenv("SUMMARY_CACHE_DB_PATH", "")
+# 摘要缓存的磁盘层条目数
+SUMMARY_CACHE_DISK_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_DISK_MAX_ENTRIES", "10000"))
+
+_summary_cache: Optional[TieredCache] = None
+_summary_cache_lock = threading.Lock()
+
+# 进行中的摘要（按摘要缓存键合并，相同内容和问题的并发摘要只调用一次摘要模型）
+_summary_flight = SingleFlight("summary_cache.singleflight")
+
+
+def get_summary_cache() -> Optional[TieredCache]:
+    """获取进程内共享的摘要缓存（所有用户和线程共用；关闭时返回 None）"""
+    global _summary_cache
+    if SUMMARY_CACHE_MAX_ENTRIES <= 0:
+        return None
+    with _summary_cache_lock:
+        if _summary_cache is None:
+            _summary_cache = TieredCache(
+                "summary_cache",
+                max_entries=SUMMARY_CACHE_MAX_ENTRIES,
+                ttl=SUMMARY_CACHE_TTL,
+                disk_path=SUMMARY_CACHE_DB_PATH or None,
+                disk_max_entries=SUMMARY_CACHE_DISK_MAX_ENTRIES,
+            )
+    return _summary_cache
+
+
+def _summary_cache_key(pages: List[str], user_message: str, summary_llm: BaseChatModel) -> str:
+    """
+    摘要缓存键：规范化内容、问题意图与摘要模型的哈希
+
+    内容只合并空白；问题去掉大小写、标点和多余空白，使措辞上的细微差别命中同一条摘要。
+    """
+    content = " ".join("\n\n".join(pages).split())
+    intent = " ".join(re.sub(r"[\W_]+", " ", user_message.lower()).split())
+    model = getattr(summary_llm, "model_name", None) or getattr(summary_llm, "model", None) \
+        or type(summary_llm).__name__
+    digest = hashlib.sha256()
+    for part in (str(model), intent, content):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _prepare_summary(tool_output: Any, user_message: str = "") -> Tuple[dict, List[str]]:
+    """
+    从工具输出中提取 URL、favicon 和每个页面的原始内容
+
+    工具直接传入 Tavily 返回的字典（或列表），无需解析；字符串输出只作为兼容路径，
+    依次尝试 JSON 和 Python 字面量解析。
+
+    Args:
+        tool_output: 工具原始输出（字典、列表或字符串）
+        user_message: 用户消息（预处理时保留提到问题关键词的行）
+
+    Returns:
+        (结果字典, 页面内容列表)；没有可摘要的内容时列表为空，结果中已包含 summary；
+        favicons 与 urls 按位置对应（缺少 favicon 的位置为 None，所有结果都没有 favicon 时为空列表）
+    """
+    if isinstance(tool_output, (dict, list)):
+        parsed_output = tool_output
+    elif not tool_output or str(tool_output).strip() == "":
+        return {"summary": tool_output, "urls": []}, []
+    else:
+        # 兼容字符串输出：尝试解析 JSON 格式，失败时按 Python 字面量解析
+        try:
+            parsed_output = json.loads(tool_output)
+        except (json.JSONDecodeError, TypeError):
+            try:
+                parsed_output = ast.literal_eval(tool_output)
+            except (ValueError, SyntaxError):
+                return {"summary": tool_output, "urls": []}, []
+
+    # 无法摘要时原样返回（非字符串输出转为字符串，保证结果可以序列化）
+    def fallback() -> Any:
+        return tool_output if isinstance(tool_output, str) else str(tool_output)
+
+    # 提取 URL、favicon 和内容
+    urls = []
+    favicons = []
+    pages = []
+
+    if isinstance(parsed_output, dict) and 'results' in parsed_output:
+        items = parsed_output['results']
+    elif isinstance(parsed_output, list):
+        items = parsed_output
+    else:
+        return {"summary": fallback(), "urls": [], "favicons": []}, []
+
+    # 从结果中提取信息
+    for item in items:
+        if isinstance(item, dict):
+            if 'url' in item:
+                urls.append(item['url'])
+                favicons.append(item.get('favicon'))
+            if item.get('raw_content'):
+                pages.append((item.get('url', ''), item['raw_content']))
+    if not any(favicons):
+        favicons = []
+
+    # 去掉样板内容和重复页面（同一页面的不同 URL 只保留一个，favicon 随 URL 一起去重）
+    if PREPROCESS_ENABLED and pages:
+        cleaned, _ = clean_pages(pages, query=user_message)
+        pages = [content for _, content in cleaned]
+        keep = unique_url_indexes(urls)
+        urls = [urls[index] for index in keep]
+        favicons = [favicons[index] for index in keep] if favicons else []
+    else:
+        pages = [content for _, content in pages]
+
+    if not pages:
+        return {"summary": fallback(), "urls": urls, "favicons": favicons}, []
+    return {"summary": None, "urls": urls, "favicons": favicons}, pages
+
+
+def _prepare_tool_output(tool_output: Any, user_message: str = "") -> Tuple[dict, List[str]]:
+    """调用 _prepare_summary 并记录其 CPU 耗时（summarizer.prepare_cpu_seconds）"""
+    start = time.thread_time()
+    try:
+        return _prepare_summary(tool_output, user_message)
+    finally:
+        get_metrics().observe("summarizer.prepare_cpu_seconds", time.thread_time() - start)
+
+
+def _chunk_pages(pages: List[str], max_chunk_tokens: int) -> List[str]:
+    """
+    将页面内容切分为摘要分块：按 token 数切分拼接后的内容（优先在换行处断开），短页面自然合并到同一块
+
+    分块数超过 SUMMARY_MAX_CHUNKS 时放大分块（最多到 4 倍，且不超过 max_chunk_tokens），
+    仍然放不下的尾部内容被丢弃。
+    """
+    content = "\n\n".join(pages)
+    chunk_tokens = min(
+        max(SUMMARY_CHUNK_TOKENS, -(-estimate_tokens(content) // SUMMARY_MAX_CHUNKS)),
+        SUMMARY_CHUNK_TOKENS * 4,
+        max_chunk_tokens
+    )
+    chunks = split_tokens(content, chunk_tokens)
+
+    if len(chunks) > SUMMARY_MAX_CHUNKS:
+        logger.info(f"内容过长，只摘要前 {SUMMARY_MAX_CHUNKS}/{len(chunks)} 个分块")
+    return chunks[:SUMMARY_MAX_CHUNKS]
+
+
+def _max_chunk_tokens(summary_llm: BaseChatModel) -> int:
+    """摘要分块的 token 上限：摘要模型的输入预算减去提示词模板"""
+    input_budget, _ = model_budget(summary_llm)
+    return max(1, input_budget - estimate_tokens(_summary_prompt("", "")))
+
+
+def _summary_prompt(content: str, user_message: str) -> str:
+    """单块内容的摘要提示词"""
+    return f"""请将以下内容总结为相关格式，以帮助回答用户的问题。
+        重点关注对回答以下问题最有用的关键信息：{user_message}
+        删除冗余信息并突出最重要的发现。
+
+        内容：
+        {content}
+
+        请提供一个清晰、有组织的摘要，捕捉与用户问题相关的基本信息：
+        """
+
+
+def _reduce_prompt(partial_summaries: List[str], user_message: str) -> str:
+    """合并各分块摘要的提示词"""
+    joined = "\n\n".join(f"[{i + 1}] {summary}" for i, summary in enumerate(partial_summaries))
+    return f"""以下是同一批网页内容分块后的摘要，请合并为一份完整的摘要，以帮助回答用户的问题：{user_message}
+        合并重复信息，保留不同来源的关键事实和数据，突出最重要的发现。
+
+        分块摘要：
+        {joined}
+
+        请提供一个清晰、有组织的摘要，捕捉与用户问题相关的基本信息：
+        """
+
 
-def create_output_summarizer(summary_llm: BaseChatModel) -> Callable[[str, str], dict]:
+def create_output_summarizer(
+    summary_llm: BaseChatModel,
+    cache: Optional[TieredCache] = None
+) -> Callable[[Any, str], dict]:
     """
-    创建输出摘要器
+    创建输出摘要器（同步版本，用于工具的 _run）
+
+    摘要前先按用户问题选取最相关的段落装入 token 预算（见 backend/ranking.py）；
+    内容较长时按 map-reduce 处理：各分块通过 batch 并发摘要，再合并为一份摘要。
+    缓存命中时不调用摘要模型；有分块失败（使用了回退内容）的摘要不写入缓存；
+    并发的相同摘要请求只调用一次摘要模型。
 
     Args:
         summary_llm: 用于生成摘要的语言模型
+        cache: 摘要缓存（可选）
 
     Returns:
         摘要函数
     """
-    def summarize_output(tool_output: str, user_message: str = "") -> dict:
+    # 单个分块不超过摘要模型的输入预算
+    max_chunk_tokens = _max_chunk_tokens(summary_llm)
+
+    def generate(pages: List[str], user_message: str, key: str) -> str:
+        """按问题选取相关段落后调用摘要模型生成摘要，失败时回退到截断内容"""
+        chunks = _chunk_pages(select_passages(pages, user_message), max_chunk_tokens)
+        complete = True
+        try:
+            if len(chunks) == 1:
+                summary = summary_llm.invoke(_summary_prompt(chunks[0], user_message)).content
+            else:
+                # map：并发摘要各分块（单块失败时回退到该块的截断内容）
+                responses = summary_llm.batch(
+                    [_summary_prompt(chunk, user_message) for chunk in chunks],
+                    config={"max_concurrency": SUMMARY_MAX_CONCURRENCY},
+                    return_exceptions=True
+                )
+                partial_summaries = [
+                    truncate_tokens(chunk, SUMMARY_FALLBACK_TOKENS) if isinstance(response, Exception)
+                    else response.content
+                    for chunk, response in zip(chunks, responses)
+                ]
+                complete = not any(isinstance(response, Exception) for response in responses)
+
+                # reduce：合并分块摘要
+                summary = summary_llm.invoke(_reduce_prompt(partial_summaries, user_message)).content
+        except Exception as e:
+            logger.error(f"摘要生成失败: {e}")
+            return truncate_tokens(chunks[0], SUMMARY_FALLBACK_TOKENS)  # 回退到截断内容
+
+        if cache is not None and complete:
+            cache.put(key, summary, size=len(str(summary).encode("utf-8")))
+        return summary
+
+    def summarize_output(tool_output: Any, user_message: str = "") -> dict:
         """
         对工具输出进行摘要处理
 
         Args:
-            tool_output: 工具原始输出
+            tool_output: 工具原始输出（Tavily 返回的字典，或兼容的字符串）
             user_message: 用户消息（用于上下文）
 
         Returns:
             包含摘要、URL 和 favicon 的字典
         """
-        if not tool_output or tool_output.strip() == "":
-            return {"summary": tool_output, "urls": []}
+        result, pages = _prepare_tool_output(tool_output, user_message)
+        if not pages:
+            return result
+
+        key = _summary_cache_key(pages, user_message, summary_llm)
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            result["summary"] = cached
+            return result
+
+        result["summary"], _ = _summary_flight.do_sync(key, lambda: generate(pages, user_message, key))
+        return result
+
+    return summarize_output
+
+
+def create_async_output_summarizer(
+    summary_llm: BaseChatModel,
+    timeout: float = SUMMARY_TIMEOUT,
+    cache: Optional[TieredCache] = None
+) -> Callable[[Any, str], Awaitable[dict]]:
+    """
+    创建异步输出摘要器（用于工具的 _arun，不阻塞事件循环）
+
+    摘要前先按用户问题选取最相关的段落装入 token 预算（见 backend/ranking.py）；
+    内容较长时按 map-reduce 处理：各分块在信号量限制下并发摘要，再合并为一份摘要，
+    耗时约为两次摘要调用。每次 LLM 调用超时后回退到截断内容；请求被取消时
+    CancelledError 会向上传播，同时取消进行中的 LLM 调用。
+    缓存命中时不调用摘要模型；使用了回退内容的摘要不写入缓存；并发的相同摘要请求
+    共享同一个进行中的任务。
 
-        # 尝试解析 JSON 格式的工具输出
+    Args:
+        summary_llm: 用于生成摘要的语言模型
+        timeout: 单次摘要调用的超时时间（秒）
+        cache: 摘要缓存（可选）
+
+    Returns:
+        异步摘要函数
+    """
+    metrics = get_metrics()
+    # 单个分块不超过摘要模型的输入预算
+    max_chunk_tokens = _max_chunk_tokens(summary_llm)
+
+    async def summarize(prompt: str) -> Optional[str]:
+        """调用摘要模型，超时或失败时返回 None"""
         try:
-            parsed_output = json.loads(tool_output)
-        except (json.JSONDecodeError, TypeError):
-            try:
-                parsed_output = ast.literal_eval(tool_output)
-            except (ValueError, SyntaxError):
-                return {"summary": tool_output, "urls": []}
+            response = await asyncio.wait_for(summary_llm.ainvoke(prompt), timeout)
+            return response.content
+        except asyncio.TimeoutError:
+            metrics.incr("summarizer.timeouts")
+            logger.warning(f"摘要生成超时（{timeout} 秒），使用截断内容")
+        except Exception as e:
+            logger.error(f"摘要生成失败: {e}")
+        return None
+
+    async def generate(pages: List[str], user_message: str, key: str) -> str:
+        """按问题选取相关段落后调用摘要模型生成摘要，失败时回退到截断内容"""
+        # 排序是纯 CPU 计算，放到线程中执行
+        chunks = _chunk_pages(await asyncio.to_thread(select_passages, pages, user_message), max_chunk_tokens)
+        start = time.perf_counter()
+        try:
+            if len(chunks) == 1:
+                summary = await summarize(_summary_prompt(chunks[0], user_message))
+                complete = summary is not None
+                if not complete:
+                    summary = truncate_tokens(chunks[0], SUMMARY_FALLBACK_TOKENS)
+            else:
+                # map：在信号量限制下并发摘要各分块（单块失败时回退到该块的截断内容）
+                semaphore = asyncio.Semaphore(SUMMARY_MAX_CONCURRENCY)
+
+                async def summarize_chunk(chunk: str) -> Optional[str]:
+                    async with semaphore:
+                        return await summarize(_summary_prompt(chunk, user_message))
+
+                responses = await asyncio.gather(*(summarize_chunk(chunk) for chunk in chunks))
+                partial_summaries = [
+                    truncate_tokens(chunk, SUMMARY_FALLBACK_TOKENS) if response is None else response
+                    for chunk, response in zip(chunks, responses)
+                ]
+
+                # reduce：合并分块摘要（失败时直接拼接分块摘要）
+                summary = await summarize(_reduce_prompt(partial_summaries, user_message))
+                complete = summary is not None and None not in responses
+                if summary is None:
+                    summary = "\n\n".join(partial_summaries)
+                metrics.observe("summarizer.chunks", len(chunks))
+        finally:
+            metrics.observe("summarizer.seconds", time.perf_counter() - start)
+
+        if cache is not None and complete:
+            cache.put(key, summary, size=len(str(summary).encode("utf-8")))
+        return summary
+
+    async def asummarize_output(tool_output: Any, user_message: str = "") -> dict:
+        """
+        对工具输出进行摘要处理
 
-        # 提取 URL、favicon 和内容
-        urls = []
-        favicons = []
-        content = ""
-
-        if isinstance(parsed_output, dict) and 'results' in parsed_output:
-            items = parsed_output['results']
-        elif isinstance(parsed_output, list):
-            items = parsed_output
-        else:
-            return {"summary": tool_output, "urls": [], "favicons": []}
-
-        # 从结果中提取信息
-        for item in items:
-            if isinstance(item, dict):
-                if 'url' in item:
-                    urls.append(item['url'])
-                if 'favicon' in item:
-                    favicons.append(item['favicon'])
-                if 'raw_content' in item:
-                    content += item['raw_content'] + "\n\n"
-
-        # 生成摘要
-        if content:
-            summary_prompt = f"""请将以下内容总结为相关格式，以帮助回答用户的问题。
-            重点关注对回答以下问题最有用的关键信息：{user_message}
-            删除冗余信息并突出最重要的发现。
-
-            内容：
-            {content[:3000]}  # 限制内容长度
-
-            请提供一个清晰、有组织的摘要，捕捉与用户问题相关的基本信息：
-            """
+        Args:
+            tool_output: 工具原始输出（Tavily 返回的字典，或兼容的字符串）
+            user_message: 用户消息（用于上下文）
+
+        Returns:
+            包含摘要、URL 和 favicon 的字典
+        """
+        # 解析和预处理是纯 CPU 计算（大页面可达数十毫秒），放到线程中执行，不阻塞事件循环
+        result, pages = await asyncio.to_thread(_prepare_tool_output, tool_output, user_message)
+        if not pages:
+            return result
+
+        key = _summary_cache_key(pages, user_message, summary_llm)
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            result["summary"] = cached
+            return result
+
+        result["summary"], _ = await _summary_flight.do(key, lambda: generate(pages, user_message, key))
+        return result
+
+    return asummarize_output
+
+
+def _user_message(config: RunnableConfig) -> str:
+    """从运行配置中读取本次请求的用户消息（用于摘要上下文）"""
+    return (config or {}).get("configurable", {}).get("user_message", "")
+
+
+class CachedTavilySearch(CachedToolMixin, TavilySearch):
+    """为 Search 工具添加结果缓存；开启预取时，与预取查询匹配的搜索直接使用预取结果"""
+    response_format: Literal["content", "content_and_artifact"] = "content_and_artifact"
+    cache_ttl: float = TOOL_CACHE_TTL_GENERAL
+    cache_fields: ClassVar[Tuple[str, ...]] = (
+        "max_results", "search_depth", "topic", "time_range", "include_images",
+        "include_domains", "exclude_domains", "include_answer", "include_raw_content",
+        "include_image_descriptions", "include_favicon", "country", "auto_parameters",
+    )
+
+    def _run(self, *args, **kwargs):
+        kwargs.pop('run_manager', None)
+        result, cached = self._fetch(*args, **kwargs)
+        return result, {"cached": cached}
+
+    async def _arun(self, *args, config: RunnableConfig, **kwargs):
+        kwargs.pop('run_manager', None)
+        prefetch = get_search_prefetch(config)
+        options = {name: value for name, value in kwargs.items() if name != "query"}
+        if prefetch is not None and not args and prefetch.matches(kwargs.get("query"), options):
             try:
-                summary = summary_llm.invoke(summary_prompt).content
+                result, cached = await prefetch.take()
+                return result, {"cached": cached, "prefetched": True}
+            except ToolException:
+                raise
             except Exception as e:
-                logger.error(f"摘要生成失败: {e}")
-                summary = content[:500]  # 回退到截断内容
-        else:
-            summary = tool_output
-
-        return {"summary": summary, "urls": urls, "favicons": favicons}
-
-    return summarize_output
+                logger.warning(f"预取的搜索失败，重新搜索: {e}")
+        result, cached = await self._afetch(*args, **kwargs)
+        return result, {"cached": cached}
+
+
+class SummarizingTavilyExtract(CachedToolMixin, TavilyExtract):
+    """为 Extract 工具添加结果缓存和摘要功能"""
+    output_summarizer: Callable[[Any, str], dict]
+    async_output_summarizer: Callable[[Any, str], Awaitable[dict]]
+    response_format: Literal["content", "content_and_artifact"] = "content_and_artifact"
+    cache_ttl: float = TOOL_CACHE_TTL_GENERAL
+    cache_fields: ClassVar[Tuple[str, ...]] = ("extract_depth", "include_images", "include_favicon", "format")
+
+    def _run(self, *args, config: RunnableConfig, **kwargs):
+        kwargs.pop('run_manager', None)
+        result, cached = self._fetch(*args, **kwargs)
+        return self.output_summarizer(result, _user_message(config)), {"cached": cached}
+
+    async def _arun(self, *args, config: RunnableConfig, **kwargs):
+        kwargs.pop('run_manager', None)
+        result, cached = await self._afetch(*args, **kwargs)
+        return await self.async_output_summarizer(result, _user_message(config)), {"cached": cached}
+
+
+class SummarizingTavilyCrawl(CachedToolMixin, TavilyCrawl):
+    """为 Crawl 工具添加结果缓存和摘要功能"""
+    output_summarizer: Callable[[Any, str], dict]
+    async_output_summarizer: Callable[[Any, str], Awaitable[dict]]
+    response_format: Literal["content", "content_and_artifact"] = "content_and_artifact"
+    cache_ttl: float = TOOL_CACHE_TTL_GENERAL
+    cache_fields: ClassVar[Tuple[str, ...]] = (
+        "max_depth", "max_breadth", "limit", "instructions", "select_paths", "select_domains",
+        "exclude_paths", "exclude_domains", "allow_external", "include_images", "categories",
+        "extract_depth", "format", "include_favicon",
+    )
+
+    def _run(self, *args, config: RunnableConfig, **kwargs):
+        kwargs.pop('run_manager', None)
+        result, cached = self._fetch(*args, **kwargs)
+        return self.output_summarizer(result, _user_message(config)), {"cached": cached}
+
+    async def _arun(self, *args, config: RunnableConfig, **kwargs):
+        kwargs.pop('run_manager', None)
+        result, cached = await self._afetch(*args, **kwargs)
+        return await self.async_output_summarizer(result, _user_message(config)), {"cached": cached}
 
 
 class WebAgent:
@@ -96,7 +495,7 @@ class WebAgent:
     Web智能体 类，集成 Tavily 搜索、提取和爬取功能
     """
 
-    def __init__(self, checkpointer: MemorySaver = None):
+    def __init__(self, checkpointer: BaseCheckpointSaver = None):
         """
         初始化 Web 智能体
 
@@ -104,6 +503,89 @@ class WebAgent:
             checkpointer: LangGraph 检查点存储器（用于对话记忆）
         """
         self.checkpointer = checkpointer
+        self._graphs = LRUCache("agent.graphs", max_entries=GRAPH_CACHE_SIZE)
+        self._graph_flight = SingleFlight("agent.graphs.singleflight")
+
+    @staticmethod
+    def graph_key(
+        provider: str,
+        model: str,
+        mode: str,
+        topic: str,
+        time_range: Optional[str],
+        api_keys: Iterable[Optional[str]],
+        prompt: str,
+    ) -> Tuple:
+        """
+        生成智能体图的缓存键
+
+        API 密钥和提示词只以哈希形式出现在键中；提示词包含当天日期，日期变化后自然换用新图。
+
+        Args:
+            provider: LLM 提供商
+            model: LLM 模型名称
+            mode: 智能体模式（fast/deep）
+            topic: 搜索主题
+            time_range: 时间范围过滤
+            api_keys: 构建图所用的全部 API 密钥
+            prompt: 系统提示词
+
+        Returns:
+            缓存键
+        """
+        keys_hash = hashlib.sha256("\0".join(key or "" for key in api_keys).encode("utf-8")).hexdigest()
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return (provider, model, mode, topic, time_range, keys_hash, prompt_hash)
+
+    async def get_or_build_graph(self, key: Tuple, build: Callable[[], CompiledStateGraph]) -> CompiledStateGraph:
+        """
+        从缓存获取编译后的智能体图，未命中时调用 build 构建并缓存
+
+        build 会同步验证 API 密钥并创建模型，因此在线程池中执行，不阻塞事件循环；
+        同一个键的并发未命中合并为一次构建（构建失败时等待中的请求共享同一个异常）。
+
+        Args:
+            key: graph_key 生成的缓存键
+            build: 构建函数（通常调用 build_graph）
+
+        Returns:
+            编译后的 LangGraph 智能体
+        """
+        graph = self._graphs.get(key)
+        if graph is not None:
+            return graph
+
+        async def build_and_cache() -> CompiledStateGraph:
+            # 等待期间其他请求可能已经构建完成
+            graph = self._graphs.get(key)
+            if graph is None:
+                graph = await asyncio.to_thread(build)
+                self._graphs.put(key, graph)
+            return graph
+
+        graph, _ = await self._graph_flight.do(key, build_and_cache)
+        return graph
+
+    @staticmethod
+    def prefetch_search(graph: CompiledStateGraph, query: str) -> Optional[SearchPrefetch]:
+        """
+        以用户问题立即发起推测性搜索（与主 LLM 的第一轮调用并行，需在事件循环中调用）
+
+        返回的预取通过运行配置 configurable.search_prefetch 传给搜索工具；
+        调用方负责在不再需要时调用 cancel()。
+
+        Args:
+            graph: build_graph 编译的智能体图
+            query: 用户问题
+
+        Returns:
+            搜索预取；图中没有带缓存的搜索工具或问题为空时返回 None
+        """
+        tools = getattr(graph.nodes.get("tools"), "bound", None)
+        search = getattr(tools, "tools_by_name", {}).get("tavily_search")
+        if not isinstance(search, CachedTavilySearch) or not query.strip():
+            return None
+        return SearchPrefetch(search, query)
 
     def build_graph(
         self,
@@ -111,7 +593,6 @@ class WebAgent:
         llm: BaseChatModel,
         prompt: str,
         summary_llm: BaseChatModel,
-        user_message: str = "",
         mode: str = "fast",
         topic: str = "general",
         time_range: str = None
@@ -119,12 +600,14 @@ class WebAgent:
         """
         构建并编译 LangGraph 工作流
 
+        编译结果不包含任何请求级数据，可以被多个请求复用（见 get_or_build_graph）；
+        用户消息通过运行配置 configurable.user_message 传给摘要工具。
+
         Args:
             api_key: Tavily API 密钥
             llm: 主要语言模型（用于智能体推理）
             prompt: 系统提示词
             summary_llm: 用于摘要的语言模型
-            user_message: 用户原始消息（用于摘要上下文）
             mode: 搜索模式，"fast"（快速模式）或 "deep"（深度思考模式），默认为 "fast"
             topic: 搜索主题，"general"（通用）、"news"（新闻）或 "finance"（财经），默认为 "general"
             time_range: 时间范围过滤，可选 "day"、"week"、"month"、"year"，默认不限制
@@ -158,8 +641,9 @@ class WebAgent:
         if time_range:
             search_params["time_range"] = time_range
 
-        # 创建 Tavily 工具
-        search = TavilySearch(**search_params)
+        # 创建 Tavily 工具（结果缓存的存活时间取决于主题：新闻、财经较短，通用较长）
+        cache_ttl = tool_cache_ttl(topic)
+        search = CachedTavilySearch(**search_params, cache_ttl=cache_ttl)
 
         extract = TavilyExtract(
             extract_depth=depth,
@@ -174,52 +658,50 @@ class WebAgent:
             limit=crawl_limit
         )
 
-        # 创建输出摘要器
-        output_summarizer = create_output_summarizer(summary_llm)
-
-        # 为 Extract 工具添加摘要功能
-        class SummarizingTavilyExtract(TavilyExtract):
-            def _run(self, *args, **kwargs):
-                kwargs.pop('run_manager', None)
-                result = super()._run(*args, **kwargs)
-                return output_summarizer(str(result), user_message)
-
-            async def _arun(self, *args, **kwargs):
-                kwargs.pop('run_manager', None)
-                result = await super()._arun(*args, **kwargs)
-                return output_summarizer(str(result), user_message)
-
-        # 为 Crawl 工具添加摘要功能
-        class SummarizingTavilyCrawl(TavilyCrawl):
-            def _run(self, *args, **kwargs):
-                kwargs.pop('run_manager', None)
-                result = super()._run(*args, **kwargs)
-                return output_summarizer(str(result), user_message)
-
-            async def _arun(self, *args, **kwargs):
-                kwargs.pop('run_manager', None)
-                result = await super()._arun(*args, **kwargs)
-                return output_summarizer(str(result), user_message)
+        # 创建输出摘要器（同步版本用于 _run，异步版本用于 _arun），共用进程内的摘要缓存
+        summary_cache = get_summary_cache()
+        output_summarizer = create_output_summarizer(summary_llm, cache=summary_cache)
+        async_output_summarizer = create_async_output_summarizer(summary_llm, cache=summary_cache)
 
         # 创建带摘要的工具实例
         extract_with_summary = SummarizingTavilyExtract(
             extract_depth=extract.extract_depth,
             tavily_api_key=api_key,
             include_favicon=extract.include_favicon,
-            description=extract.description
+            description=extract.description,
+            cache_ttl=cache_ttl,
+            output_summarizer=output_summarizer,
+            async_output_summarizer=async_output_summarizer
         )
 
         crawl_with_summary = SummarizingTavilyCrawl(
             tavily_api_key=api_key,
             include_favicon=crawl.include_favicon,
             limit=crawl.limit,
-            description=crawl.description
+            description=crawl.description,
+            cache_ttl=cache_ttl,
+            output_summarizer=output_summarizer,
+            async_output_summarizer=async_output_summarizer
         )
 
+        # 长对话的历史压缩（HISTORY_TOKEN_BUDGET=0 时关闭）；历史预算不超过主模型的输入预算减去系统提示词
+        history_compactor = None
+        if HISTORY_TOKEN_BUDGET > 0:
+            input_budget, _ = model_budget(llm)
+            history_budget = max(1, min(HISTORY_TOKEN_BUDGET, input_budget - estimate_tokens(prompt)))
+            history_compactor = create_history_compactor(
+                summary_llm, token_budget=history_budget, summary_timeout=SUMMARY_TIMEOUT
+            )
+
         # 创建 ReAct 智能体
         return create_react_agent(
             prompt=prompt,
             model=llm,
-            tools=[search, extract_with_summary, crawl_with_summary],
+            # 同一步中的多个工具调用并发执行（限制并发数，按工具超时）
+            tools=ConcurrentToolNode([search, extract_with_summary, crawl_with_summary]),
             checkpointer=self.checkpointer,
+            pre_model_hook=history_compactor,
+            state_schema=CompactingAgentState,
+            # v1：一步中的全部工具调用交给同一个 ConcurrentToolNode，由它控制并发和超时
+            version="v1",
         )
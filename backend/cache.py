@@ -0,0 +1,393 @@
+"""
+缓存模块
+
+- LRUCache：进程内的有界 LRU 缓存，按条目数和字节数双重限制容量。
+  条目可携带校验签名（如文件 mtime/size），读取时签名不一致视为过期；也可设置存活时间（TTL）。
+- DiskCache：基于 SQLite 的磁盘缓存，值以 JSON 保存，按 TTL 过期、按条目数淘汰最久未使用的条目，
+  进程重启后仍然有效，多个进程可共享同一个文件。
+- TieredCache：内存层 + 可选磁盘层的两级缓存，磁盘命中的条目会提升到内存层。
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from backend.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    线程安全的 LRU 缓存
+
+    命中/未命中/淘汰次数同时记录到全局指标（{name}.hits 等）。
+    """
+
+    def __init__(self, name: str, max_entries: int = 256, max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None):
+        """
+        初始化 LRU 缓存
+
+        Args:
+            name: 缓存名称（用作指标前缀）
+            max_entries: 最大条目数
+            max_bytes: 最大总字节数（可选，不限制则为 None）
+            ttl: 默认存活时间（秒，可选，不过期则为 None）
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (value, size, signature, expires_at)
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+        self.metrics = get_metrics()
+        self.metrics.register_gauge(f"{name}.entries", lambda: len(self._entries))
+        self.metrics.register_gauge(f"{name}.bytes", lambda: self._bytes)
+        self.metrics.register_gauge(f"{name}.hit_rate", lambda: self.stats()["hit_rate"])
+
+    def get(self, key: Hashable, signature: Any = None) -> Any:
+        """
+        读取缓存
+
+        Args:
+            key: 缓存键
+            signature: 当前签名；与写入时的签名不一致则视为未命中并移除
+
+        Returns:
+            缓存值；未命中或已过期时返回 None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (
+                entry[2] != signature or (entry[3] is not None and entry[3] <= time.monotonic())
+            ):
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self._misses += 1
+                hit = False
+            else:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                hit = True
+
+        self.metrics.incr(f"{self.name}.hits" if hit else f"{self.name}.misses")
+        return entry[0] if hit else None
+
+    def put(self, key: Hashable, value: Any, size: int = 0, signature: Any = None,
+            ttl: Optional[float] = None):
+        """
+        写入缓存（超出容量时淘汰最久未使用的条目）
+
+        Args:
+            key: 缓存键
+            value: 缓存值（不能为 None）
+            size: 估算的字节数
+            signature: 校验签名
+            ttl: 存活时间（秒），默认使用缓存的 ttl
+        """
+        # 单个条目超过总容量时不缓存
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        evicted = 0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, signature, expires_at)
+            self._bytes += size
+
+            while self._entries and (
+                len(self._entries) > self.max_entries
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                evicted += 1
+            self._evictions += evicted
+
+        if evicted:
+            self.metrics.incr(f"{self.name}.evictions", evicted)
+
+    def invalidate(self, key: Hashable):
+        """移除指定条目"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        """返回缓存统计信息"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": self._hits / total if total else 0.0,
+            }
+
+    def _remove(self, key: Hashable):
+        """移除条目（调用方需持有锁）"""
+        size = self._entries.pop(key)[1]
+        self._bytes -= size
+
+
+class DiskCache:
+    """
+    基于 SQLite 的磁盘缓存
+
+    键为字符串，值需可 JSON 序列化。读取时更新访问时间，写入时定期清理过期条目，
+    并在超出 max_entries 时淘汰最久未访问的条目。命中/未命中记录到全局指标（{name}.hits 等）。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        key         TEXT PRIMARY KEY,
+        value       TEXT NOT NULL,
+        expires_at  REAL,
+        accessed_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries(accessed_at);
+    """
+
+    # 每写入多少次执行一次容量清理
+    TRIM_INTERVAL = 64
+
+    def __init__(self, name: str, path: Path, max_entries: int = 10000, ttl: Optional[float] = None):
+        """
+        初始化磁盘缓存
+
+        Args:
+            name: 缓存名称（用作指标前缀）
+            path: 数据库文件路径
+            max_entries: 最大条目数
+            ttl: 默认存活时间（秒，可选，不过期则为 None）
+        """
+        self.name = name
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._puts = 0
+        # sqlite3 连接不能跨线程共享，每个线程持有自己的连接
+        self._local = threading.local()
+        self.metrics = get_metrics()
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(self.SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """获取当前线程的数据库连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=10, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Tuple[Any, Optional[float]]:
+        """
+        读取缓存
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            (缓存值, 过期时间戳)；未命中、已过期或读取失败时缓存值为 None，永不过期时过期时间戳为 None
+        """
+        now = time.time()
+        value = None
+        expires_at = None
+        try:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and row[1] is not None and row[1] <= now:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            elif row is not None:
+                conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+                value = json.loads(row[0])
+                expires_at = row[1]
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f"磁盘缓存 {self.name} 读取失败: {e}")
+
+        self.metrics.incr(f"{self.name}.hits" if value is not None else f"{self.name}.misses")
+        return value, expires_at
+
+    def put(self, key: str, value: Any, ttl: Optional[float] = None):
+        """
+        写入缓存
+
+        Args:
+            key: 缓存键
+            value: 缓存值（需可 JSON 序列化，不能为 None）
+            ttl: 存活时间（秒），默认使用缓存的 ttl
+        """
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + ttl if ttl else None, now)
+            )
+            self._puts += 1
+            if self._puts % self.TRIM_INTERVAL == 0:
+                self.trim()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.warning(f"磁盘缓存 {self.name} 写入失败: {e}")
+
+    def trim(self):
+        """删除过期条目，并淘汰超出容量的最久未访问条目"""
+        conn = self._connection()
+        conn.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+        cursor = conn.execute(
+            "DELETE FROM entries WHERE key IN "
+            "(SELECT key FROM entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        if cursor.rowcount > 0:
+            self.metrics.incr(f"{self.name}.evictions", cursor.rowcount)
+
+    def invalidate(self, key: str):
+        """移除指定条目"""
+        self._connection().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self):
+        """清空缓存"""
+        self._connection().execute("DELETE FROM entries")
+
+    def close(self):
+        """关闭当前线程的数据库连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class TieredCache:
+    """
+    两级缓存：内存 LRU + 可选的磁盘缓存
+
+    先查内存层，未命中再查磁盘层，磁盘命中的条目带着剩余存活时间提升到内存层；写入时两层同时写入。
+    整体命中率记录为 {name}.hits / {name}.misses / {name}.hit_rate，
+    两层各自的指标分别以 {name}.memory、{name}.disk 为前缀。
+    """
+
+    def __init__(self, name: str, max_entries: int = 256, max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None, disk_path: Optional[Path] = None,
+                 disk_max_entries: int = 10000):
+        """
+        初始化两级缓存
+
+        Args:
+            name: 缓存名称（用作指标前缀）
+            max_entries: 内存层最大条目数
+            max_bytes: 内存层最大总字节数（可选）
+            ttl: 默认存活时间（秒，可选）
+            disk_path: 磁盘层数据库文件路径（为空时只使用内存层）
+            disk_max_entries: 磁盘层最大条目数
+        """
+        self.name = name
+        self.memory = LRUCache(f"{name}.memory", max_entries, max_bytes, ttl=ttl)
+        self.disk = None
+        if disk_path:
+            try:
+                self.disk = DiskCache(f"{name}.disk", disk_path, disk_max_entries, ttl=ttl)
+            except sqlite3.Error as e:
+                logger.error(f"磁盘缓存 {name} 初始化失败，只使用内存缓存: {e}")
+
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self.metrics = get_metrics()
+        self.metrics.register_gauge(f"{name}.hit_rate", lambda: self.stats()["hit_rate"])
+
+    def get(self, key: str) -> Any:
+        """
+        读取缓存
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            缓存值；未命中时返回 None
+        """
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value, expires_at = self.disk.get(key)
+            # 提升到内存层，内存层的条目与磁盘层同时过期（永不过期的条目使用内存层的默认 ttl）
+            remaining = None if expires_at is None else expires_at - time.time()
+            if value is not None and (remaining is None or remaining > 0):
+                self.memory.put(key, value, size=len(json.dumps(value, ensure_ascii=False)), ttl=remaining)
+
+        with self._lock:
+            if value is not None:
+                self._hits += 1
+            else:
+                self._misses += 1
+        self.metrics.incr(f"{self.name}.hits" if value is not None else f"{self.name}.misses")
+        return value
+
+    def put(self, key: str, value: Any, size: int = 0, ttl: Optional[float] = None):
+        """
+        写入缓存
+
+        Args:
+            key: 缓存键
+            value: 缓存值（不能为 None；启用磁盘层时需可 JSON 序列化）
+            size: 估算的字节数
+            ttl: 存活时间（秒），默认使用缓存的 ttl
+        """
+        self.memory.put(key, value, size=size, ttl=ttl)
+        if self.disk is not None:
+            self.disk.put(key, value, ttl=ttl)
+
+    def invalidate(self, key: str):
+        """移除指定条目"""
+        self.memory.invalidate(key)
+        if self.disk is not None:
+            self.disk.invalidate(key)
+
+    def clear(self):
+        """清空缓存"""
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> Dict:
+        """返回缓存统计信息"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / total if total else 0.0,
+                "memory": self.memory.stats(),
+                "disk": self.disk is not None,
+            }
@@ -0,0 +1,267 @@
+"""
+LangGraph 检查点存储模块
+
+会话存储（backend/session_manager.py）是对话唯一的持久记录，每轮对话只持久化一次。
+检查点只在内存中缓存智能体的工作状态（工具输出、滚动摘要等），不写入磁盘：
+- BoundedMemorySaver 按线程数和字节数上限 LRU 淘汰最久未使用的线程，只保留每个线程最近的若干个检查点，
+  并定期清理超过保留期的线程
+- 线程不在缓存中时（进程重启、淘汰或清理后），下一轮对话根据已保存的会话重建上下文（见 rehydrate_messages）
+- 运行未正常结束时（超出预算、客户端断开或出错），调用方删除该线程的检查点，
+  下一轮同样从会话重建，缓存不会与会话记录不一致
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    BaseCheckpointSaver, ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+)
+from langgraph.checkpoint.memory import MemorySaver
+
+from backend.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# 最多保留的线程数（超出时淘汰最久未使用的线程）
+CHECKPOINT_MAX_THREADS = int(os.getenv("CHECKPOINT_MAX_THREADS", "500"))
+# 检查点缓存的最大字节数（按序列化后的检查点、通道数据和中间写入计算，超出时淘汰最久未使用的线程）
+CHECKPOINT_MAX_BYTES = int(os.getenv("CHECKPOINT_MAX_BYTES", str(256 * 1024 * 1024)))
+# 每个线程保留的最近检查点数（智能体续写只需要最新的检查点）
+CHECKPOINT_KEEP_PER_THREAD = int(os.getenv("CHECKPOINT_KEEP_PER_THREAD", "2"))
+# 超过该天数未使用的线程会被清理（0 表示不按时间清理）
+CHECKPOINT_RETENTION_DAYS = float(os.getenv("CHECKPOINT_RETENTION_DAYS", "7"))
+# 冷线程恢复上下文时最多带入的历史消息数
+CHECKPOINT_REHYDRATE_MESSAGES = int(os.getenv("CHECKPOINT_REHYDRATE_MESSAGES", "20"))
+
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    有界内存检查点存储器
+
+    - 每个线程只保留最近 keep_per_thread 个检查点及其引用的通道数据
+    - 线程数超过 max_threads 或序列化数据总字节数超过 max_bytes 时淘汰最久未使用的线程
+      （正在写入的线程不会被淘汰，单个线程的大小由 keep_per_thread 限制）
+    - prune() 清理超过保留期未使用的线程
+
+    被淘汰的线程再次访问时没有检查点，由调用方根据已保存的会话恢复上下文。
+    """
+
+    def __init__(
+        self,
+        max_threads: int = CHECKPOINT_MAX_THREADS,
+        keep_per_thread: int = CHECKPOINT_KEEP_PER_THREAD,
+        retention_days: float = CHECKPOINT_RETENTION_DAYS,
+        max_bytes: int = CHECKPOINT_MAX_BYTES,
+    ):
+        """
+        初始化有界内存检查点存储器
+
+        Args:
+            max_threads: 最多保留的线程数
+            max_bytes: 所有线程序列化数据的最大总字节数
+            keep_per_thread: 每个线程保留的最近检查点数
+            retention_days: 超过该天数未使用的线程会被 prune() 清理（0 表示不清理）
+        """
+        super().__init__()
+        self.max_threads = max_threads
+        self.max_bytes = max_bytes
+        self.keep_per_thread = max(1, keep_per_thread)
+        self.retention_days = retention_days
+        # 图在事件循环和线程池中都可能访问存储器，所有读写都在锁内进行
+        self._lock = threading.RLock()
+        # thread_id -> 最近访问时间，按访问顺序排列（最久未使用的在最前）
+        self._recent: "OrderedDict[str, float]" = OrderedDict()
+        # (thread_id, checkpoint_ns) -> 该命名空间下的通道数据键，裁剪时无需扫描全部 blobs
+        self._blob_keys: "defaultdict[Tuple[str, str], Set[tuple]]" = defaultdict(set)
+        # thread_id -> 该线程序列化数据的字节数，以及所有线程的总字节数
+        self._thread_bytes: Dict[str, int] = {}
+        self._bytes = 0
+
+        self.metrics = get_metrics()
+        self.metrics.register_gauge("checkpointer.threads", lambda: len(self._recent))
+        self.metrics.register_gauge("checkpointer.bytes", lambda: self._bytes)
+
+    def _touch(self, thread_id: str):
+        """标记线程为最近使用"""
+        self._recent[thread_id] = time.time()
+        self._recent.move_to_end(thread_id)
+
+    def _trim_thread(self, thread_id: str, checkpoint_ns: str):
+        """只保留线程最近的检查点，并删除不再被引用的通道数据"""
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.keep_per_thread:
+            return
+
+        # 检查点 ID 按时间单调递增
+        for checkpoint_id in sorted(checkpoints)[:-self.keep_per_thread]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+        live = set()
+        for saved_checkpoint, _, _ in checkpoints.values():
+            checkpoint = self.serde.loads_typed(saved_checkpoint)
+            live.update(checkpoint["channel_versions"].items())
+
+        blob_keys = self._blob_keys[(thread_id, checkpoint_ns)]
+        for key in [key for key in blob_keys if (key[2], key[3]) not in live]:
+            self.blobs.pop(key, None)
+            blob_keys.discard(key)
+
+    def _measure(self, thread_id: str):
+        """重新计算线程序列化数据的字节数（检查点、元数据、通道数据和中间写入）"""
+        size = 0
+        for checkpoint_ns, checkpoints in self.storage.get(thread_id, {}).items():
+            for checkpoint_id, (checkpoint, metadata, _) in checkpoints.items():
+                size += len(checkpoint[1]) + len(metadata[1])
+                for write in self.writes.get((thread_id, checkpoint_ns, checkpoint_id), {}).values():
+                    size += len(write[2][1])
+            for key in self._blob_keys.get((thread_id, checkpoint_ns), ()):
+                blob = self.blobs.get(key)
+                if blob is not None:
+                    size += len(blob[1])
+        self._bytes += size - self._thread_bytes.get(thread_id, 0)
+        self._thread_bytes[thread_id] = size
+
+    def _evict(self, current: str):
+        """按线程数和字节数上限淘汰最久未使用的线程（不淘汰正在写入的线程 current）"""
+        while len(self._recent) > self.max_threads or (
+            self._bytes > self.max_bytes and len(self._recent) > 1
+        ):
+            thread_id = next(iter(self._recent))
+            if thread_id == current:
+                self._recent.move_to_end(thread_id)
+                thread_id = next(iter(self._recent))
+            del self._recent[thread_id]
+            self._delete_thread(thread_id)
+            self.metrics.incr("checkpointer.evictions")
+
+    def _delete_thread(self, thread_id: str):
+        """删除线程的全部数据（调用方需持有锁）"""
+        super().delete_thread(thread_id)
+        for key in [key for key in self._blob_keys if key[0] == thread_id]:
+            del self._blob_keys[key]
+        self._bytes -= self._thread_bytes.pop(thread_id, 0)
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        with self._lock:
+            result = super().get_tuple(config)
+            if result is not None:
+                self._touch(config["configurable"]["thread_id"])
+            return result
+
+    def list(self, config: Optional[RunnableConfig], **kwargs: Any) -> Iterator[CheckpointTuple]:
+        # 先在锁内取出结果，避免迭代期间存储被裁剪
+        with self._lock:
+            items = [item for item in super().list(config, **kwargs)]
+        yield from items
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self._lock:
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+            self._blob_keys[(thread_id, checkpoint_ns)].update(
+                (thread_id, checkpoint_ns, channel, version) for channel, version in new_versions.items()
+            )
+            self._touch(thread_id)
+            self._trim_thread(thread_id, checkpoint_ns)
+            self._measure(thread_id)
+            self._evict(thread_id)
+            return next_config
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            super().put_writes(config, writes, task_id, task_path)
+            # 中间写入包含工具输出，同样计入字节数上限
+            self._touch(thread_id)
+            self._measure(thread_id)
+            self._evict(thread_id)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._delete_thread(thread_id)
+            self._recent.pop(thread_id, None)
+
+    def prune(self) -> int:
+        """
+        清理超过保留期未使用的线程
+
+        Returns:
+            清理的线程数
+        """
+        if self.retention_days <= 0:
+            return 0
+
+        cutoff = time.time() - self.retention_days * 86400
+        with self._lock:
+            expired = [thread_id for thread_id, accessed_at in self._recent.items() if accessed_at < cutoff]
+            for thread_id in expired:
+                self._delete_thread(thread_id)
+                del self._recent[thread_id]
+        return len(expired)
+
+    async def aprune(self) -> int:
+        """prune() 的异步版本"""
+        return self.prune()
+
+
+async def has_thread_state(checkpointer: Optional[BaseCheckpointSaver], thread_id: str) -> bool:
+    """
+    检查线程在检查点存储中是否还有状态
+
+    Args:
+        checkpointer: 检查点存储器
+        thread_id: 线程ID（即会话ID）
+
+    Returns:
+        是否存在检查点
+    """
+    if checkpointer is None:
+        return False
+    config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+    return await checkpointer.aget_tuple(config) is not None
+
+
+def rehydrate_messages(session_messages: List[Dict], max_messages: int = CHECKPOINT_REHYDRATE_MESSAGES) -> List[BaseMessage]:
+    """
+    将已保存的会话消息转换为智能体输入的历史消息（用于冷线程恢复上下文）
+
+    只保留最近 max_messages 条用户/助手消息；会话中的 tool_calls 只是界面展示用的记录，
+    没有对应的工具调用 ID，不带入智能体状态。
+
+    Args:
+        session_messages: 会话中保存的消息列表
+        max_messages: 最多带入的消息数
+
+    Returns:
+        LangChain 消息列表
+    """
+    messages: List[BaseMessage] = []
+    for message in session_messages[-max_messages:] if max_messages > 0 else []:
+        content = message.get("content")
+        if not content:
+            continue
+        if message.get("role") == "user":
+            messages.append(HumanMessage(content=content))
+        elif message.get("role") == "assistant":
+            messages.append(AIMessage(content=content))
+    return messages
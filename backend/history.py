@@ -0,0 +1,206 @@
+"""
+对话历史压缩模块
+
+作为 create_react_agent 的 pre_model_hook，在每次调用主 LLM 之前整理发送给模型的消息：
+- 最近 K 轮对话原样保留
+- 更早轮次中的工具输出替换为摘要（或按 token 截断）
+- 超出 token 预算时，将更早的轮次合并进一份滚动摘要（保存在图状态中，后续轮次增量更新）
+
+只影响发送给模型的 llm_input_messages，检查点中的完整消息历史不变。
+"""
+
+import ast
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AnyMessage, HumanMessage, ToolMessage
+from langchain_core.runnables import RunnableLambda
+from langgraph.prebuilt.chat_agent_executor import AgentState
+from typing_extensions import NotRequired
+
+from backend.metrics import get_metrics
+from backend.token_budget import count_message_tokens, model_budget, truncate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 原样保留的最近对话轮数（一轮从一条用户消息开始）
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "3"))
+# 发送给主 LLM 的历史消息 token 预算（0 表示不压缩历史）
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "8000"))
+# 较早轮次中单个工具输出保留的最大 token 数
+HISTORY_TOOL_OUTPUT_TOKENS = int(os.getenv("HISTORY_TOOL_OUTPUT_TOKENS", "300"))
+
+# 生成滚动摘要时新增对话的最大 token 数（不超过摘要模型的输入预算）
+SUMMARY_INPUT_TOKENS = 6000
+# 较早轮次的搜索结果中每条结果保留的 token 数
+SEARCH_RESULT_TOKENS = 50
+
+SUMMARY_PREFIX = "[此前对话的摘要]\n"
+
+
+class CompactingAgentState(AgentState):
+    """带滚动摘要的智能体状态"""
+    # 已合并进摘要的早期对话
+    history_summary: NotRequired[str]
+    # 已合并进摘要的消息数（messages 的前 N 条）
+    summarized_count: NotRequired[int]
+    # 本次模型调用通过压缩节省的 token 数（估算）
+    context_tokens_saved: NotRequired[int]
+
+
+def _turn_boundary(messages: List[AnyMessage], keep_turns: int) -> int:
+    """返回最近 keep_turns 轮对话的起始下标"""
+    human_indexes = [i for i, message in enumerate(messages) if isinstance(message, HumanMessage)]
+    if len(human_indexes) <= keep_turns:
+        return 0
+    return human_indexes[-keep_turns]
+
+
+def _compact_tool_output(message: ToolMessage, max_tokens: int) -> ToolMessage:
+    """将工具输出替换为摘要（Extract/Crawl 已有 summary 字段），否则截断"""
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    if truncate_tokens(content, max_tokens) is content:
+        return message
+
+    try:
+        parsed = json.loads(content)
+    except (json.JSONDecodeError, TypeError):
+        try:
+            parsed = ast.literal_eval(content)
+        except (ValueError, SyntaxError):
+            parsed = None
+
+    if isinstance(parsed, dict) and parsed.get("summary"):
+        content = str(parsed["summary"])
+    elif isinstance(parsed, dict) and isinstance(parsed.get("results"), list):
+        # 搜索结果只保留标题、链接和内容开头
+        content = "\n".join(
+            f"- {item.get('title', '')} ({item.get('url', '')}): {truncate_tokens(str(item.get('content', '')), SEARCH_RESULT_TOKENS)}"
+            for item in parsed["results"] if isinstance(item, dict)
+        )
+
+    content = truncate_tokens(content, max_tokens)
+    return message.model_copy(update={"content": content})
+
+
+def _render_for_summary(messages: List[AnyMessage]) -> str:
+    """把消息渲染为纯文本，供摘要模型阅读"""
+    lines = []
+    for message in messages:
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        if not content:
+            continue
+        lines.append(f"{message.type}: {content}")
+    return "\n".join(lines)
+
+
+def _summary_prompt(previous_summary: str, messages: List[AnyMessage], max_tokens: int) -> str:
+    """构建滚动摘要提示词"""
+    return f"""请将以下对话内容合并为一份简洁的摘要，供后续对话参考。
+保留用户的问题和目标、已经得到的关键结论、引用的来源链接以及尚未解决的问题，删除重复和无关细节。
+
+已有摘要：
+{previous_summary or "（无）"}
+
+新增对话：
+{truncate_tokens(_render_for_summary(messages), max_tokens)}
+
+请直接输出合并后的摘要：
+"""
+
+
+def create_history_compactor(
+    summary_llm: BaseChatModel,
+    keep_turns: int = HISTORY_KEEP_TURNS,
+    token_budget: int = HISTORY_TOKEN_BUDGET,
+    tool_output_tokens: int = HISTORY_TOOL_OUTPUT_TOKENS,
+    summary_timeout: Optional[float] = None,
+) -> RunnableLambda:
+    """
+    创建历史压缩钩子（用作 create_react_agent 的 pre_model_hook）
+
+    Args:
+        summary_llm: 用于生成滚动摘要的语言模型
+        keep_turns: 原样保留的最近对话轮数
+        token_budget: 发送给主 LLM 的历史消息 token 预算
+        tool_output_tokens: 较早轮次中单个工具输出保留的最大 token 数
+        summary_timeout: 异步生成滚动摘要的超时时间（秒，None 表示不限制）；
+            钩子在每次调用主 LLM 之前执行，超时后本次只发送截断后的历史，不阻塞智能体运行
+
+    Returns:
+        同时支持同步和异步调用的钩子
+    """
+    metrics = get_metrics()
+    # 新增对话部分不超过摘要模型的输入预算
+    summary_input_tokens = min(SUMMARY_INPUT_TOKENS, model_budget(summary_llm)[0] // 2)
+
+    def plan(state: Dict[str, Any]) -> Tuple[List[AnyMessage], List[AnyMessage], int, str]:
+        """拆分出待压缩的早期消息和原样保留的最近消息"""
+        messages = state["messages"]
+        summarized = min(state.get("summarized_count", 0), len(messages))
+        summary = state.get("history_summary", "")
+        boundary = max(_turn_boundary(messages, keep_turns), summarized)
+
+        older = [
+            _compact_tool_output(message, tool_output_tokens) if isinstance(message, ToolMessage) else message
+            for message in messages[summarized:boundary]
+        ]
+        return older, messages[boundary:], boundary, summary
+
+    def assemble(summary: str, older: List[AnyMessage], recent: List[AnyMessage]) -> List[AnyMessage]:
+        """组装发送给模型的消息（摘要作为一条用户消息放在最前面）"""
+        prefix = [HumanMessage(content=SUMMARY_PREFIX + summary)] if summary else []
+        return prefix + older + recent
+
+    def finish(state: Dict[str, Any], llm_input: List[AnyMessage], update: Dict[str, Any]) -> Dict[str, Any]:
+        """记录节省的 token 数并返回状态更新"""
+        tokens_saved = max(0, count_message_tokens(state["messages"]) - count_message_tokens(llm_input))
+        metrics.observe("history.tokens_saved", tokens_saved)
+        return {"llm_input_messages": llm_input, "context_tokens_saved": tokens_saved, **update}
+
+    def needs_summary(older: List[AnyMessage], candidate: List[AnyMessage]) -> bool:
+        return bool(older) and count_message_tokens(candidate) > token_budget
+
+    def compact(state: Dict[str, Any]) -> Dict[str, Any]:
+        older, recent, boundary, summary = plan(state)
+        candidate = assemble(summary, older, recent)
+        update: Dict[str, Any] = {}
+
+        if needs_summary(older, candidate):
+            try:
+                summary = summary_llm.invoke(_summary_prompt(summary, older, summary_input_tokens)).content
+                candidate = assemble(summary, [], recent)
+                update = {"history_summary": summary, "summarized_count": boundary}
+                metrics.incr("history.summaries")
+            except Exception as e:
+                logger.error(f"历史摘要生成失败: {e}")
+
+        return finish(state, candidate, update)
+
+    async def acompact(state: Dict[str, Any]) -> Dict[str, Any]:
+        older, recent, boundary, summary = plan(state)
+        candidate = assemble(summary, older, recent)
+        update: Dict[str, Any] = {}
+
+        if needs_summary(older, candidate):
+            try:
+                response = await asyncio.wait_for(
+                    summary_llm.ainvoke(_summary_prompt(summary, older, summary_input_tokens)), summary_timeout
+                )
+                summary = response.content
+                candidate = assemble(summary, [], recent)
+                update = {"history_summary": summary, "summarized_count": boundary}
+                metrics.incr("history.summaries")
+            except asyncio.TimeoutError:
+                metrics.incr("history.summary_timeouts")
+                logger.warning(f"历史摘要生成超时（{summary_timeout} 秒），使用截断后的历史")
+            except Exception as e:
+                logger.error(f"历史摘要生成失败: {e}")
+
+        return finish(state, candidate, update)
+
+    return RunnableLambda(compact, afunc=acompact, name="compact_history")
@@ -4,12 +4,16 @@ LLM 配置模块
 """
 
 import os
-from typing import Optional
+from typing import Optional, Tuple
 from langchain_core.language_models import BaseChatModel
 from langchain_anthropic import ChatAnthropic
 from langchain_openai import ChatOpenAI
 from langchain_groq import ChatGroq
 
+# 主 LLM 单次回复的最大 token 数（不超过模型自身的最大输出）
+LLM_MAX_OUTPUT_TOKENS = int(os.getenv("LLM_MAX_OUTPUT_TOKENS", "8192"))
+# 摘要 LLM 单次回复的最大 token 数
+SUMMARY_MAX_OUTPUT_TOKENS = int(os.getenv("SUMMARY_MAX_OUTPUT_TOKENS", "1024"))
 
 class LLMProvider:
     """LLM 提供商枚举"""
@@ -40,6 +44,21 @@ class LLMConfig:
         "gpt-4.1-nano": "gpt-4.1-nano",
     }
 
+    # 各模型的 (上下文窗口, 最大输出) token 数，键与 CLAUDE_MODELS / OPENAI_MODELS 相同
+    MODEL_TOKEN_LIMITS = {
+        "haiku": (200000, 64000),
+        "sonnet": (200000, 64000),
+        "opus": (200000, 32000),
+        "gpt-5.1": (400000, 128000),
+        "gpt-5-mini": (400000, 128000),
+        "gpt-5-nano": (400000, 128000),
+        "gpt-5": (400000, 128000),
+        "gpt-4.1-nano": (1047576, 32768),
+    }
+
+    # 未登记模型的 (上下文窗口, 最大输出) token 数
+    DEFAULT_TOKEN_LIMITS = (32000, 4096)
+
     # 支持的 Groq 模型
     # GROQ_MODELS = {
     #     "llama-3.3-70b": "llama-3.3-70b-versatile",
@@ -47,12 +66,45 @@ class LLMConfig:
     #     "kimi-k2": "moonshotai/kimi-k2-instruct",
     # }
 
+    @staticmethod
+    def token_limits(model: str) -> Tuple[int, int]:
+        """
+        查询模型的上下文窗口和最大输出 token 数
+
+        Args:
+            model: 模型名称（CLAUDE_MODELS / OPENAI_MODELS 的键）或完整模型 ID
+
+        Returns:
+            (上下文窗口, 最大输出)
+        """
+        if model in LLMConfig.MODEL_TOKEN_LIMITS:
+            return LLMConfig.MODEL_TOKEN_LIMITS[model]
+        for models in (LLMConfig.CLAUDE_MODELS, LLMConfig.OPENAI_MODELS):
+            for key, model_name in models.items():
+                if model_name == model:
+                    return LLMConfig.MODEL_TOKEN_LIMITS.get(key, LLMConfig.DEFAULT_TOKEN_LIMITS)
+        return LLMConfig.DEFAULT_TOKEN_LIMITS
+
+    @staticmethod
+    def max_output_tokens(model: str, limit: int = LLM_MAX_OUTPUT_TOKENS) -> int:
+        """
+        模型单次回复的 token 上限：limit 与模型最大输出的较小值
+
+        Args:
+            model: 模型名称或完整模型 ID
+            limit: 期望的上限
+
+        Returns:
+            最大输出 token 数
+        """
+        return min(limit, LLMConfig.token_limits(model)[1])
+
     @staticmethod
     def create_claude(
         model: str = "sonnet",
         api_key: Optional[str] = None,
         temperature: float = 0.7,
-        max_tokens: int = 4096,
+        max_tokens: Optional[int] = None,
         streaming: bool = True,
     ) -> BaseChatModel:
         """
@@ -62,13 +114,14 @@ class LLMConfig:
             model: 模型名称（haiku/sonnet/opus）
             api_key: Anthropic API 密钥
             temperature: 温度参数（0-1）
-            max_tokens: 最大 token 数
+            max_tokens: 最大输出 token 数（默认按模型取 LLM_MAX_OUTPUT_TOKENS 与模型最大输出的较小值）
             streaming: 是否启用流式输出
 
         Returns:
             Claude 语言模型实例
         """
         model_name = LLMConfig.CLAUDE_MODELS.get(model, LLMConfig.CLAUDE_MODELS["sonnet"])
+        max_tokens = max_tokens or LLMConfig.max_output_tokens(model_name)
 
         llm = ChatAnthropic(
             model=model_name,
@@ -88,7 +141,7 @@ class LLMConfig:
         model: str = "gpt-5.1-mini",
         api_key: Optional[str] = None,
         temperature: float = 1,
-        max_tokens: int = 4096,
+        max_tokens: Optional[int] = None,
         streaming: bool = True,
     ) -> BaseChatModel:
         """
@@ -98,13 +151,14 @@ class LLMConfig:
             model: 模型名称
             api_key: OpenAI API 密钥
             temperature: 温度参数（0-1）
-            max_tokens: 最大 token 数
+            max_tokens: 最大输出 token 数（默认按模型取 LLM_MAX_OUTPUT_TOKENS 与模型最大输出的较小值）
             streaming: 是否启用流式输出
 
         Returns:
             OpenAI 语言模型实例
         """
         model_name = LLMConfig.OPENAI_MODELS.get(model, LLMConfig.OPENAI_MODELS["gpt-5.1"])
+        max_tokens = max_tokens or LLMConfig.max_output_tokens(model_name)
 
         llm = ChatOpenAI(
             model=model_name,
@@ -124,7 +178,7 @@ class LLMConfig:
         model: str = "llama-3.3-70b",
         api_key: Optional[str] = None,
         temperature: float = 0.7,
-        max_tokens: int = 4096,
+        max_tokens: Optional[int] = None,
         streaming: bool = True,
     ) -> BaseChatModel:
         """
@@ -134,13 +188,14 @@ class LLMConfig:
             model: 模型名称
             api_key: Groq API 密钥
             temperature: 温度参数（0-1）
-            max_tokens: 最大 token 数
+            max_tokens: 最大输出 token 数（默认按模型取 LLM_MAX_OUTPUT_TOKENS 与模型最大输出的较小值）
             streaming: 是否启用流式输出
 
         Returns:
             Groq 语言模型实例
         """
         model_name = LLMConfig.GROQ_MODELS.get(model, LLMConfig.GROQ_MODELS["llama-3.3-70b"])
+        max_tokens = max_tokens or LLMConfig.max_output_tokens(model_name)
 
         llm = ChatGroq(
             model=model_name,
@@ -160,7 +215,7 @@ class LLMConfig:
         provider: str = LLMProvider.CLAUDE,
         model: Optional[str] = None,
         api_key: Optional[str] = None,
-        max_tokens: int = 4096,
+        max_tokens: Optional[int] = None,
         streaming: bool = True,
     ) -> BaseChatModel:
         """
@@ -170,7 +225,7 @@ class LLMConfig:
             provider: LLM 提供商（claude/openai/groq）
             model: 模型名称（可选，使用默认值）
             api_key: API 密钥（可选，从环境变量读取）
-            max_tokens: 最大 token 数
+            max_tokens: 最大输出 token 数（默认按模型取 LLM_MAX_OUTPUT_TOKENS 与模型最大输出的较小值）
             streaming: 是否启用流式输出
 
         Returns:
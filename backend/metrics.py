@@ -0,0 +1,94 @@
+"""
+运行指标模块
+
+进程内的轻量指标收集：计数器、耗时/数值观测、以及按需读取的仪表（gauge），
+通过 /api/metrics 接口输出快照。
+"""
+
+import threading
+from typing import Callable, Dict
+
+
+class Metrics:
+    """线程安全的指标注册表"""
+
+    def __init__(self):
+        """初始化指标注册表"""
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._observations: Dict[str, Dict[str, float]] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+
+    def incr(self, name: str, value: float = 1):
+        """
+        增加计数器
+
+        Args:
+            name: 指标名称
+            value: 增量
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float):
+        """
+        记录一次观测值（如耗时），汇总为次数、总和、最大值和最近一次的值
+
+        Args:
+            name: 指标名称
+            value: 观测值
+        """
+        with self._lock:
+            stats = self._observations.setdefault(
+                name, {"count": 0, "sum": 0.0, "max": 0.0, "last": 0.0}
+            )
+            stats["count"] += 1
+            stats["sum"] += value
+            stats["max"] = max(stats["max"], value)
+            stats["last"] = value
+
+    def register_gauge(self, name: str, func: Callable[[], float]):
+        """
+        注册仪表，读取快照时调用 func 获取当前值
+
+        Args:
+            name: 指标名称
+            func: 返回当前值的函数
+        """
+        with self._lock:
+            self._gauges[name] = func
+
+    def snapshot(self) -> Dict:
+        """
+        获取所有指标的快照
+
+        Returns:
+            包含 counters、observations、gauges 的字典
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            observations = {
+                name: {**stats, "avg": stats["sum"] / stats["count"] if stats["count"] else 0.0}
+                for name, stats in self._observations.items()
+            }
+            gauges = dict(self._gauges)
+
+        gauge_values = {}
+        for name, func in gauges.items():
+            try:
+                gauge_values[name] = func()
+            except Exception:
+                gauge_values[name] = None
+
+        return {"counters": counters, "observations": observations, "gauges": gauge_values}
+
+
+# 全局单例
+_metrics = None
+
+def get_metrics() -> Metrics:
+    """获取指标注册表单例"""
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
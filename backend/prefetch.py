@@ -0,0 +1,119 @@
+"""
+推测性搜索预取模块
+
+快速和深度模式下，ReAct 的第一步几乎总是用接近用户问题的查询调用 TavilySearch，
+而这次搜索要等主 LLM 第一轮返回后才开始。开启预取后，请求到达时立即以用户问题发起搜索：
+- 模型随后发出的搜索与预取的查询足够相似（词集合 Jaccard 相似度）且参数一致时，直接使用预取结果
+- 预取经过工具结果缓存和请求合并（见 backend/tool_cache.py），结果同样写入缓存
+- 第一轮工具调用结束或请求结束时仍未被使用的预取会被取消
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from langchain_core.runnables import RunnableConfig
+
+from backend.metrics import get_metrics
+from backend.text import tokenize
+
+logger = logging.getLogger(__name__)
+
+# 是否默认开启推测性搜索预取（请求可通过 speculative_search 覆盖）
+SPECULATIVE_SEARCH = os.getenv("SPECULATIVE_SEARCH", "false").lower() == "true"
+# 模型的搜索查询与预取查询的最低相似度（词集合的 Jaccard 相似度）
+SPECULATIVE_MATCH_THRESHOLD = float(os.getenv("SPECULATIVE_MATCH_THRESHOLD", "0.5"))
+
+# TavilySearch 调用参数的默认值（工具字段和调用参数都为空时使用）
+_SEARCH_DEFAULTS = {"search_depth": "basic", "include_images": False, "topic": "general", "include_favicon": False}
+
+
+def _jaccard(a: str, b: str) -> float:
+    """两段文本词集合的 Jaccard 相似度"""
+    tokens_a, tokens_b = set(tokenize(a)), set(tokenize(b))
+    if not tokens_a or not tokens_b:
+        return 0.0
+    return len(tokens_a & tokens_b) / len(tokens_a | tokens_b)
+
+
+def _effective(value: Any) -> Any:
+    """参数值的比较形式（列表不区分顺序）"""
+    return sorted(value) if isinstance(value, (list, tuple, set)) else value
+
+
+class SearchPrefetch:
+    """
+    单个请求的搜索预取
+
+    通过运行配置 configurable.search_prefetch 传给搜索工具；每个预取最多被使用一次。
+    """
+
+    def __init__(self, search_tool: Any, query: str, threshold: float = SPECULATIVE_MATCH_THRESHOLD):
+        """
+        立即发起预取（需在事件循环中调用）
+
+        Args:
+            search_tool: 带缓存的搜索工具（CachedTavilySearch）
+            query: 预取的查询（用户问题）
+            threshold: 查询匹配的最低相似度
+        """
+        self.search_tool = search_tool
+        self.query = query
+        self.threshold = threshold
+        self.consumed = False
+        self.metrics = get_metrics()
+        self.task = asyncio.create_task(search_tool._afetch(query=query))
+        # 未被使用的预取失败时不产生“异常未被获取”的警告
+        self.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        self.metrics.incr("prefetch.started")
+
+    def matches(self, query: Optional[str], kwargs: Dict[str, Any]) -> bool:
+        """
+        判断一次搜索调用能否使用预取结果
+
+        Args:
+            query: 模型的搜索查询
+            kwargs: 其余调用参数
+
+        Returns:
+            查询足够相似、其余参数与预取一致且预取尚未被使用、未被取消时返回 True
+        """
+        if self.consumed or self.task.cancelled() or not query:
+            return False
+        for name, value in kwargs.items():
+            # 与 TavilySearch 相同：工具字段优先，其次是调用参数，最后是默认值
+            field = getattr(self.search_tool, name, None)
+            default = _SEARCH_DEFAULTS.get(name)
+            if _effective(field or (default if value is None else value)) != _effective(field or default):
+                return False
+        return _jaccard(query, self.query) >= self.threshold
+
+    async def take(self) -> Tuple[Any, bool]:
+        """
+        使用预取结果（等待进行中的预取完成）
+
+        Returns:
+            (API 结果, 是否命中缓存)
+        """
+        self.consumed = True
+        self.metrics.incr("prefetch.hits")
+        logger.info(f"使用预取的搜索结果: {self.query[:50]}")
+        return await asyncio.shield(self.task)
+
+    def cancel(self):
+        """取消未被使用的预取（已使用的预取不受影响）"""
+        if self.consumed:
+            return
+        self.consumed = True
+        if not self.task.done():
+            self.task.cancel()
+            self.metrics.incr("prefetch.cancelled")
+        else:
+            self.metrics.incr("prefetch.wasted")
+        logger.info(f"预取的搜索结果未被使用: {self.query[:50]}")
+
+
+def get_search_prefetch(config: RunnableConfig) -> Optional[SearchPrefetch]:
+    """从运行配置中读取本次请求的搜索预取"""
+    return (config or {}).get("configurable", {}).get("search_prefetch")
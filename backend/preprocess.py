@@ -0,0 +1,299 @@
+"""
+网页内容预处理模块
+
+Extract/Crawl 返回的 raw_content 在交给摘要模型之前先做清理：
+- 空白压缩：去掉行首尾空白，合并行内连续空白和连续空行
+- 行级样板内容移除：导航链接行、主要由 Cookie 提示、订阅/登录/版权等短语和链接组成的行，页内重复行，
+  以及同一批页面中反复出现的页眉页脚（只保留第一次出现）；
+  提到问题关键词的行始终保留，Markdown 表格行不作为分隔符或页眉页脚移除
+- URL 规范化：统一大小写、去掉锚点和跟踪参数，同一页面的不同 URL 只保留一次
+- 近似重复检测：按页面开头的词 shingle 计算 Jaccard 相似度，与已保留页面过于相似的页面被丢弃
+"""
+
+import logging
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Set, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from backend.metrics import get_metrics
+from backend.text import tokenize
+
+logger = logging.getLogger(__name__)
+
+# 是否在摘要前预处理网页内容
+PREPROCESS_ENABLED = os.getenv("PREPROCESS_ENABLED", "true").lower() == "true"
+# 近似重复阈值（shingle 集合的 Jaccard 相似度）
+PREPROCESS_DUP_THRESHOLD = float(os.getenv("PREPROCESS_DUP_THRESHOLD", "0.8"))
+
+# shingle 长度（词数）
+SHINGLE_SIZE = 5
+# 计算 shingle 时只取页面开头的字符数（近似重复的页面开头基本相同，限制长度以控制耗时）
+SHINGLE_MAX_CHARS = 4000
+# 含样板短语的行不超过该长度时视为样板内容
+BOILERPLATE_MAX_LINE = 120
+# 含界面文字的行不超过该长度时视为样板内容（这些词也常见于正文，只匹配很短的行）
+UI_LABEL_MAX_LINE = 30
+# 去掉样板短语和链接后剩余文字的最大比例：不超过该比例时该行才视为样板内容（正文中提到 cookie 等词的句子保留）
+BOILERPLATE_MAX_RESIDUE = 0.5
+
+# 常见样板短语（小写；逐个子串匹配比带 IGNORECASE 的多分支正则快得多）
+_BOILERPLATE_PHRASES = (
+    "cookie", "accept all", "privacy policy", "terms of use", "terms of service",
+    "all rights reserved", "©", "copyright", "skip to content", "skip to main content",
+    "隐私政策", "使用条款", "用户协议", "版权所有", "返回顶部",
+)
+# 常见界面文字（按钮、导航等）
+_UI_LABELS = (
+    "subscribe", "newsletter", "sign in", "sign up", "log in", "share on", "share this",
+    "follow us", "back to top", "advertisement",
+    "登录", "注册", "订阅", "分享到", "广告", "关注我们",
+)
+# 只由 Markdown 链接/图片和分隔符组成的行（导航栏、面包屑等）
+_LINK_ONLY_PATTERN = re.compile(r"^(?:[\s|*•·>/-]*!?\[[^\]]*\]\([^)]*\))+[\s|*•·>/-]*$")
+# Markdown 链接和图片
+_MARKDOWN_LINK_PATTERN = re.compile(r"!?\[([^\]]*)\]\([^)]*\)")
+# 只由标点和分隔符组成的行
+_SEPARATOR_PATTERN = re.compile(r"^[\W_]+$")
+# Markdown 表格行和表头分隔行（|---|---|），属于正文结构，不作为分隔符或页眉页脚移除
+_TABLE_ROW_PATTERN = re.compile(r"^\|.*\|$")
+_TABLE_SEPARATOR_PATTERN = re.compile(r"^(?=.*\|)\|?(?:\s*:?-+:?\s*\|)*\s*:?-+:?\s*\|?$")
+
+# 不作为问题关键词的常见英文虚词（中文按字符二元组切分，无需停用词）
+_QUERY_STOPWORDS = {
+    "the", "and", "for", "are", "was", "what", "how", "why", "who", "when", "where", "which",
+    "with", "does", "did", "can", "from", "that", "this", "about", "into", "you", "your",
+}
+
+# 跟踪参数
+_TRACKING_PARAMS = {"fbclid", "gclid", "msclkid", "mc_cid", "mc_eid", "spm", "_ga", "ref_src"}
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    规范化 URL：协议和域名转小写，去掉默认端口、锚点、跟踪参数和末尾斜杠，查询参数排序
+
+    Args:
+        url: 原始 URL
+
+    Returns:
+        规范化后的 URL
+    """
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, netloc.rsplit(":", 1)[-1]) in (("http", "80"), ("https", "443")):
+        netloc = netloc.rsplit(":", 1)[0]
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in _TRACKING_PARAMS
+    ))
+    return urlunsplit((scheme, netloc, path, query, ""))
+
+
+def unique_url_indexes(urls: List[str]) -> List[int]:
+    """
+    按规范化形式去重 URL，返回每个页面第一次出现的下标（用于同步去重与 URL 对齐的列表，如 favicon）
+
+    Args:
+        urls: URL 列表
+
+    Returns:
+        保留的下标列表（升序）
+    """
+    seen = set()
+    indexes = []
+    for index, url in enumerate(urls):
+        canonical = canonicalize_url(url)
+        if canonical not in seen:
+            seen.add(canonical)
+            indexes.append(index)
+    return indexes
+
+
+def dedupe_urls(urls: List[str]) -> List[str]:
+    """
+    按规范化形式去重 URL，保留每个页面第一次出现的原始 URL
+
+    Args:
+        urls: URL 列表
+
+    Returns:
+        去重后的 URL 列表
+    """
+    return [urls[index] for index in unique_url_indexes(urls)]
+
+
+def compact_whitespace(text: str) -> List[str]:
+    """
+    压缩空白：去掉行首尾空白、合并行内连续空白，连续空行只保留一个
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        行列表（空行以空字符串表示）
+    """
+    lines = []
+    for raw_line in text.splitlines():
+        line = " ".join(raw_line.split())
+        if line or (lines and lines[-1]):
+            lines.append(line)
+    while lines and not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def _letters(text: str) -> int:
+    """文本中的字母和文字数（不含数字、空白和标点）"""
+    return sum(char.isalpha() for char in text)
+
+
+def _mostly_phrases(lowered: str, phrases: List[str]) -> bool:
+    """去掉样板短语和链接后，剩余文字不超过整行的 BOILERPLATE_MAX_RESIDUE"""
+    total = _letters(_MARKDOWN_LINK_PATTERN.sub(r"\1", lowered))
+    residue = _MARKDOWN_LINK_PATTERN.sub(" ", lowered)
+    for phrase in phrases:
+        residue = residue.replace(phrase, " ")
+    return _letters(residue) <= total * BOILERPLATE_MAX_RESIDUE
+
+
+def _is_boilerplate(line: str) -> bool:
+    """判断单行是否为样板内容（样板短语只在该行主要由短语和链接组成时生效）"""
+    if len(line) <= BOILERPLATE_MAX_LINE:
+        lowered = line.lower()
+        phrases = [phrase for phrase in _BOILERPLATE_PHRASES if phrase in lowered]
+        if len(line) <= UI_LABEL_MAX_LINE:
+            phrases += [label for label in _UI_LABELS if label in lowered]
+        if phrases and _mostly_phrases(lowered, phrases):
+            return True
+    if _LINK_ONLY_PATTERN.match(line):
+        return True
+    return bool(_SEPARATOR_PATTERN.match(line)) and not _TABLE_SEPARATOR_PATTERN.match(line)
+
+
+def _query_terms(query: str) -> Set[str]:
+    """问题关键词（去掉过短的英文单词和常见虚词）"""
+    return {
+        token for token in tokenize(query)
+        if not token.isascii() or (len(token) >= 3 and token not in _QUERY_STOPWORDS)
+    }
+
+
+def _mentions(line: str, terms: Set[str]) -> bool:
+    """该行是否包含问题关键词"""
+    return bool(terms) and not terms.isdisjoint(tokenize(line))
+
+
+def _shingles(text: str) -> Set[int]:
+    """计算文本开头部分的词 shingle 哈希集合"""
+    tokens = tokenize(text[:SHINGLE_MAX_CHARS])
+    if len(tokens) < SHINGLE_SIZE:
+        return {hash(tuple(tokens))} if tokens else set()
+    return {hash(tuple(tokens[i:i + SHINGLE_SIZE])) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+
+
+def _jaccard(a: Set[int], b: Set[int]) -> float:
+    """两个集合的 Jaccard 相似度"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def clean_pages(
+    pages: List[Tuple[str, str]],
+    dup_threshold: float = PREPROCESS_DUP_THRESHOLD,
+    query: str = ""
+) -> Tuple[List[Tuple[str, str]], Dict]:
+    """
+    清理一批网页内容
+
+    提到问题关键词的行不会被当作样板内容或页眉页脚移除（页内完全相同的重复行仍只保留一次）。
+
+    Args:
+        pages: (URL, raw_content) 列表，按到达顺序
+        dup_threshold: 近似重复阈值
+        query: 用户问题（可选）
+
+    Returns:
+        (清理后的 (规范化 URL, 内容) 列表, 统计信息)；统计信息包含
+        bytes_before、bytes_after、bytes_removed、duplicate_pages
+    """
+    bytes_before = sum(len(content.encode("utf-8")) for _, content in pages)
+
+    # URL 去重
+    unique_pages = []
+    seen_urls = set()
+    for url, content in pages:
+        canonical = canonicalize_url(url) if url else ""
+        if canonical and canonical in seen_urls:
+            continue
+        seen_urls.add(canonical)
+        unique_pages.append((canonical, compact_whitespace(content)))
+    duplicate_pages = len(pages) - len(unique_pages)
+
+    # 同一批页面中在多个页面出现的短行视为页眉页脚
+    line_pages = Counter()
+    for _, lines in unique_pages:
+        line_pages.update({line for line in lines if line and len(line) <= BOILERPLATE_MAX_LINE * 2})
+    repeated = {
+        line for line, count in line_pages.items() if count >= 2 and not _TABLE_ROW_PATTERN.match(line)
+    }
+    terms = _query_terms(query)
+
+    cleaned = []
+    kept_shingles: List[Set[int]] = []
+    emitted_repeated = set()
+    for url, lines in unique_pages:
+        kept_lines = []
+        seen_lines = set()
+        for line in lines:
+            if not line:
+                if kept_lines and kept_lines[-1]:
+                    kept_lines.append(line)
+                continue
+            if line in seen_lines:
+                continue
+            drop = _is_boilerplate(line) or line in emitted_repeated
+            # 只在要丢弃时才检查关键词，大多数行不需要切词
+            if drop and not _mentions(line, terms):
+                continue
+            if line in repeated:
+                emitted_repeated.add(line)
+            seen_lines.add(line)
+            kept_lines.append(line)
+
+        text = "\n".join(kept_lines).strip()
+        if not text:
+            continue
+
+        # 与已保留页面近似重复的页面丢弃
+        shingles = _shingles(text)
+        if any(_jaccard(shingles, kept) >= dup_threshold for kept in kept_shingles):
+            duplicate_pages += 1
+            continue
+        kept_shingles.append(shingles)
+        cleaned.append((url, text))
+
+    bytes_after = sum(len(text.encode("utf-8")) for _, text in cleaned)
+    stats = {
+        "bytes_before": bytes_before,
+        "bytes_after": bytes_after,
+        "bytes_removed": bytes_before - bytes_after,
+        "duplicate_pages": duplicate_pages,
+    }
+
+    metrics = get_metrics()
+    metrics.observe("preprocess.bytes_removed", stats["bytes_removed"])
+    metrics.observe("preprocess.duplicate_pages", duplicate_pages)
+    if bytes_before:
+        logger.info(
+            f"网页预处理: {len(pages)} 个页面 -> {len(cleaned)} 个，"
+            f"移除 {stats['bytes_removed']}/{bytes_before} 字节"
+        )
+    return cleaned, stats
@@ -0,0 +1,142 @@
+"""
+本地相关性排序模块
+
+摘要之前把页面内容切分为段落，用 BM25（NumPy 向量化计算）按用户问题打分，
+按得分从高到低选取段落装入 token 预算，再按原文顺序拼回各页面。
+与问题无关的内容不再进入摘要模型，摘要更聚焦、消耗的 token 更少。
+"""
+
+import logging
+import os
+import re
+from collections import Counter
+from typing import List, Tuple
+
+import numpy as np
+
+from backend.metrics import get_metrics
+from backend.text import BM25_B, BM25_K1, tokenize
+from backend.token_budget import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 段落目标长度（字符数），较短的相邻段落合并，过长的段落按该长度切分
+RANK_PASSAGE_CHARS = int(os.getenv("RANK_PASSAGE_CHARS", "600"))
+# 送入摘要模型的内容 token 预算（0 表示不排序、不裁剪）
+RANK_TOKEN_BUDGET = int(os.getenv("RANK_TOKEN_BUDGET", "8000"))
+
+def split_passages(text: str, passage_chars: int = RANK_PASSAGE_CHARS) -> List[str]:
+    """
+    按段落切分页面内容
+
+    Args:
+        text: 页面内容
+        passage_chars: 段落目标长度（字符数）
+
+    Returns:
+        段落列表
+    """
+    passages = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        # 过长的段落按固定长度切分
+        pieces = [paragraph[i:i + passage_chars] for i in range(0, len(paragraph), passage_chars)] \
+            if len(paragraph) > passage_chars * 2 else [paragraph]
+        for piece in pieces:
+            if current and len(current) + len(piece) > passage_chars:
+                passages.append(current)
+                current = ""
+            current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        passages.append(current)
+    return passages
+
+
+def bm25_scores(passage_tokens: List[List[str]], query_tokens: List[str]) -> np.ndarray:
+    """
+    计算每个段落相对查询的 BM25 得分
+
+    Args:
+        passage_tokens: 每个段落的词列表
+        query_tokens: 查询词（去重）
+
+    Returns:
+        得分数组，长度与段落数相同
+    """
+    if not passage_tokens or not query_tokens:
+        return np.zeros(len(passage_tokens))
+
+    # 词频矩阵：段落 × 查询词
+    tf = np.array(
+        [[counts[token] for token in query_tokens] for counts in map(Counter, passage_tokens)],
+        dtype=np.float64
+    )
+    lengths = np.array([len(tokens) for tokens in passage_tokens], dtype=np.float64)
+    avg_length = lengths.mean() or 1.0
+
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log(1 + (len(passage_tokens) - df + 0.5) / (df + 0.5))
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_length)
+    return (idf * tf * (BM25_K1 + 1) / (tf + norm[:, None])).sum(axis=1)
+
+
+def select_passages(
+    pages: List[str],
+    query: str,
+    token_budget: int = RANK_TOKEN_BUDGET,
+    passage_chars: int = RANK_PASSAGE_CHARS
+) -> List[str]:
+    """
+    选出与问题最相关的段落装入 token 预算
+
+    Args:
+        pages: 页面内容列表
+        query: 用户问题
+        token_budget: token 预算（0 表示原样返回）
+        passage_chars: 段落目标长度（字符数）
+
+    Returns:
+        页面内容列表：每个页面只保留选中的段落（按原文顺序），没有选中段落的页面被移除
+    """
+    if token_budget <= 0:
+        return pages
+
+    # (页面序号, 段落序号, 段落内容)
+    passages: List[Tuple[int, int, str]] = [
+        (page_index, passage_index, passage)
+        for page_index, page in enumerate(pages)
+        for passage_index, passage in enumerate(split_passages(page, passage_chars))
+    ]
+    costs = np.array([estimate_tokens(passage) for _, _, passage in passages], dtype=np.int64)
+    if costs.sum() <= token_budget:
+        return pages
+
+    query_tokens = list(dict.fromkeys(tokenize(query)))
+    scores = bm25_scores([tokenize(passage) for _, _, passage in passages], query_tokens)
+
+    # 得分从高到低装入预算（得分相同时靠前的段落优先；放不下的段落跳过，继续尝试更短的段落）
+    order = np.lexsort((np.arange(len(passages)), -scores))
+    selected = []
+    remaining = token_budget
+    for index in order:
+        if costs[index] <= remaining:
+            selected.append(index)
+            remaining -= costs[index]
+            if remaining <= 0:
+                break
+
+    # 按原文顺序拼回各页面
+    selected.sort()
+    grouped: List[List[str]] = [[] for _ in pages]
+    for index in selected:
+        page_index, _, passage = passages[index]
+        grouped[page_index].append(passage)
+
+    metrics = get_metrics()
+    metrics.observe("ranking.passages", len(passages))
+    metrics.observe("ranking.tokens_dropped", int(costs.sum()) - (token_budget - remaining))
+    logger.info(f"相关性排序: {len(passages)} 个段落中选取 {len(selected)} 个，约 {token_budget - remaining} tokens")
+    return ["\n\n".join(group) for group in grouped if group]
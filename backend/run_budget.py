@@ -0,0 +1,169 @@
+"""
+请求级运行预算模块
+
+限制单次 /stream_agent 请求的总耗时、ReAct 步数和工具调用次数，分两层生效：
+- 软限制（图内）：预算写入运行配置，ConcurrentToolNode 拒绝超出预算的工具调用并返回错误消息，
+  模型据此根据已有信息直接给出最终答案；为最终答案预留 AGENT_ANSWER_RESERVE_SECONDS（不超过总时长的四分之一），
+  进入预留时间后不再发起工具调用，进行中的工具调用超时时间不超过剩余时间
+- 硬限制（图外）：到达截止时间时取消智能体任务，进行中的 LLM 和工具调用随之取消；
+  步数超出 recursion_limit 时 LangGraph 终止运行。两种情况下都输出尽力而为的答案
+"""
+
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, ToolCall, ToolMessage
+from langchain_core.runnables import RunnableConfig
+
+from backend.token_budget import truncate_tokens
+
+# 单次请求的最长耗时（秒，请求中的 deadline_seconds 不能超过该值）
+AGENT_DEADLINE_SECONDS = float(os.getenv("AGENT_DEADLINE_SECONDS", "300"))
+# 单次请求最多的工具调用轮数（请求中的 max_steps 不能超过该值）
+AGENT_MAX_STEPS = int(os.getenv("AGENT_MAX_STEPS", "15"))
+# 单次请求最多的工具调用次数（请求中的 max_tool_calls 不能超过该值）
+AGENT_MAX_TOOL_CALLS = int(os.getenv("AGENT_MAX_TOOL_CALLS", "20"))
+# 为最终答案预留的时间（秒，不超过总时长的四分之一），剩余时间少于该值时不再发起工具调用
+AGENT_ANSWER_RESERVE_SECONDS = float(os.getenv("AGENT_ANSWER_RESERVE_SECONDS", "30"))
+
+# 尽力而为的答案中每条工具结果保留的 token 数
+FALLBACK_ITEM_TOKENS = 300
+
+
+def _clamp(value: Optional[float], limit: float) -> float:
+    """请求值不超过服务端上限；未指定时使用上限"""
+    return limit if value is None or value <= 0 else min(value, limit)
+
+
+def run_limits(
+    deadline_seconds: Optional[float] = None,
+    max_steps: Optional[int] = None,
+    max_tool_calls: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    计算本次请求的运行预算（写入运行配置的 configurable）
+
+    Args:
+        deadline_seconds: 请求指定的最长耗时（秒）
+        max_steps: 请求指定的最多工具调用轮数
+        max_tool_calls: 请求指定的最多工具调用次数
+
+    Returns:
+        包含 deadline_seconds、tool_deadline（停止发起工具调用的 Unix 时间戳）、max_steps、max_tool_calls 的字典
+    """
+    deadline_seconds = _clamp(deadline_seconds, AGENT_DEADLINE_SECONDS)
+    reserve = min(AGENT_ANSWER_RESERVE_SECONDS, deadline_seconds / 4)
+    return {
+        "deadline_seconds": deadline_seconds,
+        "tool_deadline": time.time() + deadline_seconds - reserve,
+        "max_steps": int(_clamp(max_steps, AGENT_MAX_STEPS)),
+        "max_tool_calls": int(_clamp(max_tool_calls, AGENT_MAX_TOOL_CALLS)),
+    }
+
+
+def recursion_limit(max_steps: int) -> int:
+    """
+    LangGraph 的 recursion_limit：每轮包括历史压缩、模型和工具三个节点，
+    另留出工具被拒绝后模型给出最终答案的一轮
+    """
+    return 3 * (max_steps + 2) + 1
+
+
+def _current_request(messages: Sequence[AnyMessage]) -> Sequence[AnyMessage]:
+    """本次请求产生的消息（最后一条用户消息之后）"""
+    for index in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[index], HumanMessage):
+            return messages[index + 1:]
+    return messages
+
+
+def remaining_seconds(config: RunnableConfig) -> Optional[float]:
+    """距离停止发起工具调用的剩余秒数；未设置截止时间时返回 None"""
+    tool_deadline = (config or {}).get("configurable", {}).get("tool_deadline")
+    if not tool_deadline:
+        return None
+    return tool_deadline - time.time()
+
+
+def budget_refusals(
+    tool_calls: List[ToolCall],
+    messages: Sequence[AnyMessage],
+    config: RunnableConfig
+) -> Dict[str, str]:
+    """
+    找出超出本次请求预算的工具调用
+
+    Args:
+        tool_calls: 本步的工具调用
+        messages: 图状态中的消息
+        config: 运行配置（configurable 中的 tool_deadline、max_steps、max_tool_calls）
+
+    Returns:
+        工具调用 ID -> 拒绝原因；预算内的调用不在其中
+    """
+    configurable = (config or {}).get("configurable", {})
+    request_messages = _current_request(messages)
+    steps = sum(isinstance(message, AIMessage) for message in request_messages)
+    used = sum(isinstance(message, ToolMessage) for message in request_messages)
+
+    remaining = remaining_seconds(config)
+    max_steps = configurable.get("max_steps")
+    max_tool_calls = configurable.get("max_tool_calls")
+    if remaining is not None and remaining <= 0:
+        reason = "本次请求的剩余时间不足"
+    elif max_steps and steps > max_steps:
+        reason = f"已达到本次请求的最大工具调用轮数（{max_steps}）"
+    else:
+        reason = None
+    if reason:
+        return {call["id"]: reason for call in tool_calls}
+
+    if not max_tool_calls:
+        return {}
+    allowed = max(0, max_tool_calls - used)
+    return {
+        call["id"]: f"已达到本次请求的最大工具调用次数（{max_tool_calls}）"
+        for call in tool_calls[allowed:]
+    }
+
+
+def _fallback_item(content: Any) -> Optional[str]:
+    """把一条工具结果整理为答案中的一段"""
+    if isinstance(content, str):
+        try:
+            content = json.loads(content)
+        except (json.JSONDecodeError, TypeError):
+            return truncate_tokens(content, FALLBACK_ITEM_TOKENS) if content.strip() else None
+    if not isinstance(content, dict):
+        return None
+    if content.get("summary"):
+        sources = "、".join(str(url) for url in content.get("urls", [])[:3])
+        text = truncate_tokens(str(content["summary"]), FALLBACK_ITEM_TOKENS)
+        return f"{text}\n（来源：{sources}）" if sources else text
+    if isinstance(content.get("results"), list):
+        lines = [
+            f"- [{item.get('title') or item.get('url')}]({item.get('url')})"
+            for item in content["results"][:5] if isinstance(item, dict) and item.get("url")
+        ]
+        return "\n".join(lines) or None
+    return None
+
+
+def fallback_answer(tool_outputs: List[Any], reason: str) -> str:
+    """
+    模型未能给出答案时，用已收集的工具结果生成尽力而为的答案
+
+    Args:
+        tool_outputs: 本次请求中成功返回的工具结果
+        reason: 终止原因（deadline 或 max_steps）
+
+    Returns:
+        答案文本
+    """
+    header = "已达到本次请求的时间上限" if reason == "deadline" else "已达到本次请求的最大步数"
+    items = [item for item in map(_fallback_item, tool_outputs) if item]
+    if not items:
+        return f"{header}，未能收集到足够的信息，请缩小问题范围后重试。"
+    return f"{header}，以下是目前收集到的信息：\n\n" + "\n\n".join(items)
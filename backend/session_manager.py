@@ -1,82 +1,169 @@
 """
 会话管理模块
 
-负责会话数据的持久化、加载和管理，使用 JSON 文件存储。
+负责会话数据的持久化、加载和管理。
+具体的存储方式由存储后端决定（见 backend/session_storage.py），默认使用 JSON 文件存储。
+
+命令行：
+    python -m backend.session_manager migrate             # 将 data/sessions/*.json 导入 SQLite
+    python -m backend.session_manager archive --days 30   # 归档 30 天未更新的会话
+    python -m backend.session_manager reindex             # 重建全文检索索引
 """
 
+import argparse
+import base64
+import binascii
+import copy
 import json
-import os
-from datetime import datetime
-from pathlib import Path
-from typing import Dict, List, Optional
-from filelock import FileLock, Timeout
 import logging
+import os
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from backend.cache import LRUCache
+from backend.session_search import SearchIndex
+from backend.session_storage import (
+    DB_FILE,
+    BatchWriteError,
+    JSONFileStorage,
+    SessionStorage,
+    SQLiteStorage,
+    create_storage,
+    migrate_json_to_sqlite,
+)
 
 logger = logging.getLogger(__name__)
 
-# 数据存储目录
-DATA_DIR = Path(__file__).parent.parent / "data" / "sessions"
-INDEX_FILE = DATA_DIR / "index.json"
-LOCK_FILE = DATA_DIR / ".lock"
+# 超过该天数未更新的会话会被归档（0 表示不自动归档）
+ARCHIVE_AFTER_DAYS = int(os.getenv("SESSION_ARCHIVE_DAYS", "30"))
+
+# 会话文档缓存容量（条目数 / 字节数）
+CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "256"))
+CACHE_MAX_BYTES = int(os.getenv("SESSION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# 是否维护全文检索索引
+SEARCH_ENABLED = os.getenv("SESSION_SEARCH_ENABLED", "true").lower() not in ("0", "false", "no")
+
+
+def _encode_cursor(session: Dict) -> str:
+    """将会话的排序键编码为不透明的分页游标"""
+    raw = json.dumps([session.get("updated_at", ""), session["session_id"]], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
 
-# 确保目录存在
-DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+def _decode_cursor(cursor: str) -> Tuple[str, str]:
+    """解析分页游标，返回 (updated_at, session_id)"""
+    try:
+        updated_at, session_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(updated_at), str(session_id)
+    except (binascii.Error, UnicodeError, ValueError, TypeError) as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
 
 
 class SessionManager:
-    """会话管理器"""
-
-    def __init__(self):
-        """初始化会话管理器"""
-        self.lock = FileLock(str(LOCK_FILE), timeout=10)
-
-    def _ensure_index_exists(self):
-        """确保索引文件存在"""
-        if not INDEX_FILE.exists():
-            with self.lock:
-                # 双重检查，防止并发创建
-                if not INDEX_FILE.exists():
-                    self._write_json(INDEX_FILE, {"sessions": []})
-
-    def _read_json(self, file_path: Path) -> Dict:
-        """安全读取 JSON 文件"""
+    """
+    会话管理器
+
+    读取路径带有进程内 LRU 缓存（解析后的会话文档 + 排好序的会话列表）：
+    每次读取先向存储后端取廉价签名（文件 mtime/size 或数据库版本字段），
+    签名不变时直接返回缓存；本进程的写操作会主动失效对应条目。
+
+    写操作同时增量更新全文检索索引（见 backend/session_search.py）。
+    """
+
+    def __init__(self, storage: Optional[SessionStorage] = None, search_index: Optional[SearchIndex] = None):
+        """
+        初始化会话管理器
+
+        Args:
+            storage: 存储后端（可选，默认根据环境变量 SESSION_BACKEND 创建）
+            search_index: 全文检索索引（可选，默认在 SESSION_SEARCH_ENABLED 开启时创建）
+        """
+        self.storage = storage or create_storage()
+        if search_index is None and SEARCH_ENABLED:
+            search_index = SearchIndex()
+        self.search_index = search_index
+        self._documents = LRUCache("session_cache.documents", CACHE_MAX_ENTRIES, CACHE_MAX_BYTES)
+        self._index = LRUCache("session_cache.index", max_entries=1)
+
+    def _invalidate(self, session_id: str):
+        """写操作后失效会话文档和会话列表缓存"""
+        self._documents.invalidate(session_id)
+        self._index.clear()
+
+    def cache_stats(self) -> Dict:
+        """
+        获取缓存统计信息
+
+        Returns:
+            会话文档缓存和会话列表缓存的命中/未命中等统计
+        """
+        return {"documents": self._documents.stats(), "index": self._index.stats()}
+
+    def _update_search_index(self, update_fn: Callable[[SearchIndex], None]):
+        """
+        更新全文检索索引
+
+        索引只是派生数据，更新失败不影响会话写入，可通过 reindex 命令重建。
+        """
+        if self.search_index is None:
+            return
         try:
-            if file_path.exists():
-                with open(file_path, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            return {}
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON 解析错误: {file_path}, {e}")
-            return {}
+            update_fn(self.search_index)
         except Exception as e:
-            logger.error(f"读取文件失败: {file_path}, {e}")
-            return {}
+            logger.error(f"更新检索索引失败: {e}", exc_info=True)
 
-    def _write_json(self, file_path: Path, data: Dict):
-        """安全写入 JSON 文件（带备份）"""
-        backup_path = file_path.with_suffix(".json.bak")
+    def search_sessions(self, query: str, limit: int = 20) -> List[Dict]:
+        """
+        全文检索会话消息
 
-        try:
-            # 如果原文件存在，先备份
-            if file_path.exists():
-                import shutil
-                shutil.copy(file_path, backup_path)
+        Args:
+            query: 查询文本
+            limit: 最多返回的会话数
 
-            # 写入新数据
-            with open(file_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+        Returns:
+            按相关度排序的结果，每个会话一条，包含会话标题、命中消息序号和高亮摘要
+        """
+        if self.search_index is None:
+            return []
+
+        # 只在现存会话中检索（索引中可能残留其他进程删除的会话），过滤在 LIMIT 之前完成
+        sessions = {session["session_id"]: session for session in self.get_sessions_list()}
+        return [
+            {
+                **hit,
+                "title": sessions[hit["session_id"]].get("title", hit["session_id"]),
+                "updated_at": sessions[hit["session_id"]].get("updated_at"),
+            }
+            for hit in self.search_index.search(query, limit, session_ids=sessions)
+            if hit["session_id"] in sessions
+        ]
+
+    def rebuild_search_index(self) -> int:
+        """
+        根据存储中的全部会话重建全文检索索引
 
-            # 成功后删除备份
-            if backup_path.exists():
-                backup_path.unlink()
+        Returns:
+            重建索引的会话数
+        """
+        if self.search_index is None:
+            return 0
 
-        except Exception as e:
-            logger.error(f"写入文件失败: {file_path}, {e}")
-            # 如果写入失败且有备份，尝试恢复
-            if backup_path.exists() and not file_path.exists():
-                import shutil
-                shutil.copy(backup_path, file_path)
-            raise
+        # 移除索引中残留的已删除会话
+        live = {session["session_id"] for session in self.storage.list_sessions()}
+        for session_id in set(self.search_index.session_ids()) - live:
+            self.search_index.remove_session(session_id)
+
+        count = 0
+        for session in self.storage.list_sessions():
+            session_data = self.storage.load_session(session["session_id"])
+            if session_data is None:
+                continue
+            self.search_index.replace_session(session_data["session_id"], session_data.get("messages", []))
+            count += 1
+
+        logger.info(f"重建检索索引: {count} 个会话")
+        return count
 
     def get_sessions_list(self) -> List[Dict]:
         """
@@ -85,15 +172,95 @@ class SessionManager:
         Returns:
             会话列表，按更新时间倒序排列
         """
-        self._ensure_index_exists()
+        # 签名需在读取数据之前获取：读取期间发生的写入只会导致下次未命中
+        signature = self.storage.index_signature()
+        if signature is not None:
+            sessions = self._index.get("sessions", signature)
+            if sessions is not None:
+                return [dict(session) for session in sessions]
+
+        sessions = self.storage.list_sessions()
+        if signature is not None:
+            self._index.put("sessions", [dict(session) for session in sessions], signature=signature)
+        return sessions
+
+    def get_sessions_page(self, limit: int, cursor: Optional[str] = None) -> Dict:
+        """
+        分页获取会话列表（按更新时间倒序，游标分页）
+
+        Args:
+            limit: 每页条数
+            cursor: 上一页返回的 next_cursor，None 表示第一页
+
+        Returns:
+            {"sessions": 本页会话, "next_cursor": 下一页游标（没有更多时为 None）}
+
+        Raises:
+            ValueError: 如果游标无效
+        """
+        after = _decode_cursor(cursor) if cursor else None
+
+        # 多取一条用于判断是否还有下一页
+        if self.storage.supports_keyset_pagination:
+            sessions = self.storage.list_sessions_page(limit + 1, after)
+        else:
+            sessions = sorted(
+                self.get_sessions_list(),
+                key=lambda x: (x.get("updated_at", ""), x["session_id"]),
+                reverse=True
+            )
+            if after is not None:
+                sessions = [
+                    s for s in sessions
+                    if (s.get("updated_at", ""), s["session_id"]) < after
+                ]
+            sessions = sessions[:limit + 1]
+
+        has_more = len(sessions) > limit
+        sessions = sessions[:limit]
+        return {
+            "sessions": sessions,
+            "next_cursor": _encode_cursor(sessions[-1]) if has_more else None,
+        }
 
-        with self.lock:
-            data = self._read_json(INDEX_FILE)
-            sessions = data.get("sessions", [])
+    def get_messages_page(self, session_id: str, before: Optional[int] = None, limit: int = 50) -> Optional[Dict]:
+        """
+        分页获取会话消息（从最新消息向前翻页）
+
+        SQLite 后端按序号只读取一页；JSON 后端不支持按序号读取，需要加载整个会话文档
+        （经会话缓存），再从中切出一页。
 
-            # 按更新时间倒序排列
-            sessions.sort(key=lambda x: x.get("updated_at", ""), reverse=True)
-            return sessions
+        Args:
+            session_id: 会话ID
+            before: 只返回序号小于该值的消息，None 表示从最新一条开始
+            limit: 每页条数
+
+        Returns:
+            {"session_id", "messages": 带 seq 序号的消息（升序）, "total", "next_before"}；
+            会话不存在时返回 None
+        """
+        if self.storage.supports_keyset_pagination:
+            result = self.storage.load_messages(session_id, before, limit)
+            if result is None:
+                return None
+            page, total = result
+        else:
+            session_data = self.get_session(session_id)
+            if session_data is None:
+                return None
+            messages = session_data["messages"]
+            total = len(messages)
+            upper = total if before is None else max(0, min(before, total))
+            lower = max(0, upper - limit)
+            page = list(enumerate(messages[lower:upper], start=lower))
+
+        first_seq = page[0][0] if page else 0
+        return {
+            "session_id": session_id,
+            "messages": [{**message, "seq": seq} for seq, message in page],
+            "total": total,
+            "next_before": first_seq if first_seq > 0 else None,
+        }
 
     def get_session(self, session_id: str) -> Optional[Dict]:
         """
@@ -105,14 +272,28 @@ class SessionManager:
         Returns:
             会话数据，包含完整消息列表；如果不存在返回 None
         """
-        session_file = DATA_DIR / f"{session_id}.json"
+        signature = self.storage.session_signature(session_id)
+        if signature is not None:
+            cached = self._documents.get(session_id, signature)
+            if cached is not None:
+                # 深拷贝：调用方修改返回的文档或其中的消息都不会影响缓存
+                return copy.deepcopy(cached)
 
-        if not session_file.exists():
+        session_data = self.storage.load_session(session_id)
+
+        if session_data is None:
             logger.warning(f"会话不存在: {session_id}")
             return None
 
-        with self.lock:
-            return self._read_json(session_file)
+        if signature is not None:
+            size = len(json.dumps(session_data, ensure_ascii=False))
+            self._documents.put(
+                session_id,
+                copy.deepcopy(session_data),
+                size=size,
+                signature=signature
+            )
+        return session_data
 
     def create_session(self, session_id: str, title: Optional[str] = None) -> Dict:
         """
@@ -125,8 +306,6 @@ class SessionManager:
         Returns:
             新创建的会话数据
         """
-        self._ensure_index_exists()
-
         now = datetime.now().isoformat()
         session_data = {
             "session_id": session_id,
@@ -136,28 +315,17 @@ class SessionManager:
             "messages": []
         }
 
-        with self.lock:
-            # 写入会话文件
-            session_file = DATA_DIR / f"{session_id}.json"
-            self._write_json(session_file, session_data)
-
-            # 更新索引
-            index_data = self._read_json(INDEX_FILE)
-            index_data["sessions"].append({
-                "session_id": session_id,
-                "title": session_data["title"],
-                "created_at": session_data["created_at"],
-                "updated_at": session_data["updated_at"],
-                "message_count": 0
-            })
-            self._write_json(INDEX_FILE, index_data)
+        self.storage.write_session(session_data)
+        self._invalidate(session_id)
 
         logger.info(f"创建会话: {session_id}, 标题: {title}")
         return session_data
 
     def save_session(self, session_data: Dict):
         """
-        保存会话数据
+        保存会话数据（整体重写）
+
+        只新增消息时应使用 append_messages，代价与会话长度无关。
 
         Args:
             session_data: 会话数据，必须包含 session_id, title, messages
@@ -166,45 +334,121 @@ class SessionManager:
         if not session_id:
             raise ValueError("session_data 必须包含 session_id")
 
-        self._ensure_index_exists()
-
         now = datetime.now().isoformat()
         session_data["updated_at"] = now
+        session_data.setdefault("created_at", now)
 
-        with self.lock:
-            # 写入会话文件
-            session_file = DATA_DIR / f"{session_id}.json"
-            self._write_json(session_file, session_data)
-
-            # 更新索引
-            index_data = self._read_json(INDEX_FILE)
-            sessions = index_data.get("sessions", [])
-
-            # 查找并更新索引中的会话信息
-            found = False
-            for session in sessions:
-                if session["session_id"] == session_id:
-                    session["title"] = session_data.get("title", "新对话")
-                    session["updated_at"] = now
-                    session["message_count"] = len(session_data.get("messages", []))
-                    found = True
-                    break
-
-            # 如果索引中不存在，添加新条目
-            if not found:
-                sessions.append({
-                    "session_id": session_id,
-                    "title": session_data.get("title", "新对话"),
-                    "created_at": session_data.get("created_at", now),
-                    "updated_at": now,
-                    "message_count": len(session_data.get("messages", []))
-                })
-
-            index_data["sessions"] = sessions
-            self._write_json(INDEX_FILE, index_data)
+        self.storage.write_session(session_data)
+        self._invalidate(session_id)
+        self._update_search_index(
+            lambda index: index.replace_session(session_id, session_data.get("messages", []))
+        )
 
         logger.info(f"保存会话: {session_id}")
 
+    def append_messages(self, session_id: str, messages: List[Dict], title: Optional[str] = None) -> Dict:
+        """
+        向会话追加消息（代价为 O(新消息)）
+
+        Args:
+            session_id: 会话ID
+            messages: 要追加的消息列表
+            title: 会话不存在时使用的标题（可选）
+
+        Returns:
+            更新后的会话元数据
+        """
+        now = datetime.now().isoformat()
+        try:
+            entry = self.storage.append_messages(session_id, messages, title, now)
+        except BatchWriteError as e:
+            self._after_append(e.written)
+            raise
+        self._after_append([((session_id, messages, title), entry)])
+
+        logger.info(f"追加会话消息: {session_id}, 新增 {len(messages)} 条")
+        return entry
+
+    def append_many(self, items: List[Tuple[str, List[Dict], Optional[str]]]) -> List[Dict]:
+        """
+        批量追加多个会话的消息（一次提交）
+
+        Args:
+            items: (会话ID, 消息列表, 新会话标题) 的列表
+
+        Returns:
+            更新后的会话元数据列表
+        """
+        now = datetime.now().isoformat()
+        try:
+            entries = self.storage.append_many(items, now)
+        except BatchWriteError as e:
+            # 部分会话已写入：同样更新缓存和检索索引，使其与存储保持一致
+            self._after_append(e.written)
+            raise
+        self._after_append(list(zip(items, entries)))
+
+        logger.info(f"批量追加会话消息: {len(items)} 个会话")
+        return entries
+
+    def _after_append(self, written: List[Tuple[Tuple[str, List[Dict], Optional[str]], Optional[Dict]]]):
+        """追加写入后失效缓存并索引新消息"""
+        starts = []
+        for (session_id, messages, _), entry in written:
+            self._invalidate(session_id)
+            # 新消息的起始序号 = 追加后的消息数 - 新消息数；元数据缺失时从会话文档计算
+            if entry is not None:
+                count = entry["message_count"]
+            else:
+                session_data = self.storage.load_session(session_id)
+                count = len(session_data["messages"]) if session_data else len(messages)
+            starts.append((session_id, count - len(messages), messages))
+        if starts:
+            self._update_search_index(lambda index: index.add_messages(starts))
+
+    def compact_session(self, session_id: str):
+        """
+        整理会话的存储结构（JSON 后端：将追加日志合并回快照）
+
+        Args:
+            session_id: 会话ID
+        """
+        self.storage.compact_session(session_id)
+        self._invalidate(session_id)
+
+    def archive_sessions(self, older_than_days: int = ARCHIVE_AFTER_DAYS) -> Dict:
+        """
+        将长时间未更新的会话移入压缩归档（读取时透明解压，再次写入时自动恢复）
+
+        Args:
+            older_than_days: 超过该天数未更新的会话会被归档
+
+        Returns:
+            归档统计：会话数、归档前后字节数、回收字节数
+        """
+        cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat()
+        stats = {"archived": 0, "bytes_before": 0, "bytes_after": 0}
+
+        for session_id in self.storage.archive_candidates(cutoff):
+            try:
+                result = self.storage.archive_session(session_id)
+            except Exception as e:
+                logger.error(f"归档会话失败: {session_id}, {e}", exc_info=True)
+                continue
+            if result is None:
+                continue
+
+            self._invalidate(session_id)
+            stats["archived"] += 1
+            stats["bytes_before"] += result[0]
+            stats["bytes_after"] += result[1]
+
+        stats["bytes_reclaimed"] = stats["bytes_before"] - stats["bytes_after"]
+        logger.info(
+            f"归档完成: {stats['archived']} 个会话, 回收 {stats['bytes_reclaimed']} 字节"
+        )
+        return stats
+
     def delete_session(self, session_id: str) -> bool:
         """
         删除会话
@@ -215,19 +459,9 @@ class SessionManager:
         Returns:
             是否删除成功
         """
-        self._ensure_index_exists()
-        session_file = DATA_DIR / f"{session_id}.json"
-
-        with self.lock:
-            # 删除会话文件
-            if session_file.exists():
-                session_file.unlink()
-
-            # 从索引中移除
-            index_data = self._read_json(INDEX_FILE)
-            sessions = index_data.get("sessions", [])
-            index_data["sessions"] = [s for s in sessions if s["session_id"] != session_id]
-            self._write_json(INDEX_FILE, index_data)
+        self.storage.delete_session(session_id)
+        self._invalidate(session_id)
+        self._update_search_index(lambda index: index.remove_session(session_id))
 
         logger.info(f"删除会话: {session_id}")
         return True
@@ -243,29 +477,10 @@ class SessionManager:
         Returns:
             是否重命名成功
         """
-        self._ensure_index_exists()
-        session_file = DATA_DIR / f"{session_id}.json"
-
-        if not session_file.exists():
+        if not self.storage.rename_session(session_id, new_title, datetime.now().isoformat()):
             logger.warning(f"会话不存在: {session_id}")
             return False
-
-        with self.lock:
-            # 更新会话文件
-            session_data = self._read_json(session_file)
-            session_data["title"] = new_title
-            session_data["updated_at"] = datetime.now().isoformat()
-            self._write_json(session_file, session_data)
-
-            # 更新索引
-            index_data = self._read_json(INDEX_FILE)
-            sessions = index_data.get("sessions", [])
-            for session in sessions:
-                if session["session_id"] == session_id:
-                    session["title"] = new_title
-                    session["updated_at"] = session_data["updated_at"]
-                    break
-            self._write_json(INDEX_FILE, index_data)
+        self._invalidate(session_id)
 
         logger.info(f"重命名会话: {session_id} -> {new_title}")
         return True
@@ -303,3 +518,50 @@ def get_session_manager() -> SessionManager:
     if _session_manager is None:
         _session_manager = SessionManager()
     return _session_manager
+
+
+def main():
+    """会话管理命令行入口"""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(description="会话数据管理工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = subparsers.add_parser("migrate", help="将 JSON 会话文件导入 SQLite")
+    migrate_parser.add_argument("--db", default=str(DB_FILE), help="SQLite 数据库路径")
+
+    archive_parser = subparsers.add_parser("archive", help="归档长时间未更新的会话")
+    archive_parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="归档超过该天数未更新的会话")
+    archive_parser.add_argument("--vacuum", action="store_true", help="归档后回收数据库空闲空间（SQLite 后端）")
+
+    subparsers.add_parser("reindex", help="重建全文检索索引")
+
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        target = SQLiteStorage(args.db)
+        try:
+            count = migrate_json_to_sqlite(JSONFileStorage(), target)
+        finally:
+            target.close()
+        print(f"已导入 {count} 个会话到 {args.db}")
+        print("设置环境变量 SESSION_BACKEND=sqlite 以启用 SQLite 后端")
+
+    elif args.command == "archive":
+        session_manager = get_session_manager()
+        stats = session_manager.archive_sessions(args.days)
+        if args.vacuum:
+            session_manager.storage.vacuum()
+        print(
+            f"已归档 {stats['archived']} 个会话: "
+            f"{stats['bytes_before']} -> {stats['bytes_after']} 字节, "
+            f"回收 {stats['bytes_reclaimed']} 字节"
+        )
+
+    elif args.command == "reindex":
+        count = get_session_manager().rebuild_search_index()
+        print(f"已重建 {count} 个会话的检索索引")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+"""
+会话全文检索模块
+
+基于 SQLite 的增量倒排索引：
+- 中文等 CJK 文本按字符二元组（bigram）切分，英文和数字按单词切分
+- 每条消息是一个文档，会话保存/删除时增量更新
+- 查询按 BM25 打分，每个会话取得分最高的消息（在 SQL 中去重并过滤已删除的会话），并生成带高亮的摘要片段
+"""
+
+import html
+import logging
+import math
+import os
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from backend.session_storage import DATA_DIR
+from backend.text import BM25_B, BM25_K1, tokenize
+
+logger = logging.getLogger(__name__)
+
+SEARCH_DB_FILE = Path(os.getenv("SESSION_SEARCH_DB_PATH", str(DATA_DIR / "search.db")))
+
+# 摘要片段长度（命中位置前后各取的字符数）
+SNIPPET_RADIUS = 40
+
+
+def message_text(message: Dict) -> str:
+    """提取消息中的文本内容（content 可能是字符串或内容块列表）"""
+    content = message.get("content", "")
+    if isinstance(content, list):
+        return "\n".join(
+            item.get("text", "") if isinstance(item, dict) else str(item)
+            for item in content
+        )
+    return str(content or "")
+
+
+def highlight_snippet(text: str, query_tokens: Iterable[str], radius: int = SNIPPET_RADIUS) -> str:
+    """
+    截取首个命中位置附近的文本，并用 <mark> 标记所有命中的词（其余内容做 HTML 转义）
+
+    Args:
+        text: 消息文本
+        query_tokens: 查询词
+        radius: 命中位置前后各保留的字符数
+
+    Returns:
+        带高亮的摘要片段
+    """
+    terms = set(query_tokens)
+    lowered = text.lower()
+    positions = [pos for pos in (lowered.find(term) for term in terms) if pos >= 0]
+    first = min(positions) if positions else 0
+    start = max(0, first - radius)
+    end = min(len(text), first + radius)
+    window = text[start:end]
+    lowered_window = lowered[start:end]
+
+    # 收集所有命中区间（相邻的二元组互相重叠，逐个位置查找），再合并重叠部分
+    spans = []
+    for term in terms:
+        pos = lowered_window.find(term)
+        while pos >= 0:
+            spans.append((pos, pos + len(term)))
+            pos = lowered_window.find(term, pos + 1)
+    spans.sort()
+    merged: List[List[int]] = []
+    for span_start, span_end in spans:
+        if merged and span_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], span_end)
+        else:
+            merged.append([span_start, span_end])
+
+    parts = []
+    cursor = 0
+    for span_start, span_end in merged:
+        parts.append(html.escape(window[cursor:span_start]))
+        parts.append(f"<mark>{html.escape(window[span_start:span_end])}</mark>")
+        cursor = span_end
+    parts.append(html.escape(window[cursor:]))
+
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(text) else ""
+    return prefix + "".join(parts).replace("\n", " ") + suffix
+
+
+class SearchIndex:
+    """
+    会话消息倒排索引
+
+    - docs：每条消息一行（session_id, seq, 文本, 词数）
+    - postings：(token, doc_id) -> 词频，主键即 token 索引
+    - meta：文档总数与总词数，用于 BM25 的 IDF 和平均文档长度
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS docs (
+        doc_id     INTEGER PRIMARY KEY,
+        session_id TEXT NOT NULL,
+        seq        INTEGER NOT NULL,
+        role       TEXT,
+        text       TEXT NOT NULL,
+        length     INTEGER NOT NULL,
+        UNIQUE (session_id, seq)
+    );
+
+    CREATE TABLE IF NOT EXISTS postings (
+        token  TEXT NOT NULL,
+        doc_id INTEGER NOT NULL,
+        tf     INTEGER NOT NULL,
+        PRIMARY KEY (token, doc_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings(doc_id);
+
+    CREATE TABLE IF NOT EXISTS meta (
+        key   TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO meta (key, value) VALUES ('doc_count', 0), ('total_length', 0);
+    """
+
+    def __init__(self, db_path: Path = SEARCH_DB_FILE):
+        """
+        初始化倒排索引
+
+        Args:
+            db_path: 索引数据库文件路径
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # sqlite3 连接不能跨线程共享，每个线程持有自己的连接
+        self._local = threading.local()
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(self.SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """获取当前线程的数据库连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=10, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """写事务"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def _add_in_transaction(self, conn: sqlite3.Connection, session_id: str,
+                            start_seq: int, messages: List[Dict]):
+        """在已开启的事务中索引消息"""
+        added_docs = 0
+        added_length = 0
+        for offset, message in enumerate(messages):
+            seq = start_seq + offset
+            # 同一条消息重复索引时（如重建索引与追加写入交错）先移除旧记录
+            existing = conn.execute(
+                "SELECT doc_id, length FROM docs WHERE session_id = ? AND seq = ?",
+                (session_id, seq)
+            ).fetchone()
+            if existing is not None:
+                conn.execute("DELETE FROM postings WHERE doc_id = ?", (existing[0],))
+                conn.execute("DELETE FROM docs WHERE doc_id = ?", (existing[0],))
+                added_docs -= 1
+                added_length -= existing[1]
+
+            text = message_text(message)
+            tokens = tokenize(text)
+            if not tokens:
+                continue
+
+            cursor = conn.execute(
+                "INSERT INTO docs (session_id, seq, role, text, length) VALUES (?, ?, ?, ?, ?)",
+                (session_id, seq, message.get("role"), text, len(tokens))
+            )
+            conn.executemany(
+                "INSERT INTO postings (token, doc_id, tf) VALUES (?, ?, ?)",
+                [(token, cursor.lastrowid, tf) for token, tf in Counter(tokens).items()]
+            )
+            added_docs += 1
+            added_length += len(tokens)
+
+        self._bump_meta(conn, added_docs, added_length)
+
+    def _remove_in_transaction(self, conn: sqlite3.Connection, session_id: str):
+        """在已开启的事务中删除会话的全部索引"""
+        removed_docs, removed_length = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs WHERE session_id = ?",
+            (session_id,)
+        ).fetchone()
+        conn.execute(
+            "DELETE FROM postings WHERE doc_id IN (SELECT doc_id FROM docs WHERE session_id = ?)",
+            (session_id,)
+        )
+        conn.execute("DELETE FROM docs WHERE session_id = ?", (session_id,))
+        self._bump_meta(conn, -removed_docs, -removed_length)
+
+    def _bump_meta(self, conn: sqlite3.Connection, docs: int, length: int):
+        """更新文档总数与总词数"""
+        if docs:
+            conn.execute("UPDATE meta SET value = value + ? WHERE key = 'doc_count'", (docs,))
+        if length:
+            conn.execute("UPDATE meta SET value = value + ? WHERE key = 'total_length'", (length,))
+
+    def add_messages(self, items: List[Tuple[str, int, List[Dict]]]):
+        """
+        增量索引新追加的消息
+
+        Args:
+            items: (会话ID, 第一条消息的序号, 消息列表) 的列表
+        """
+        with self._transaction() as conn:
+            for session_id, start_seq, messages in items:
+                self._add_in_transaction(conn, session_id, start_seq, messages)
+
+    def replace_session(self, session_id: str, messages: List[Dict]):
+        """
+        重建单个会话的索引（会话被整体覆盖时调用）
+
+        Args:
+            session_id: 会话ID
+            messages: 完整消息列表
+        """
+        with self._transaction() as conn:
+            self._remove_in_transaction(conn, session_id)
+            self._add_in_transaction(conn, session_id, 0, messages)
+
+    def remove_session(self, session_id: str):
+        """
+        删除会话的索引
+
+        Args:
+            session_id: 会话ID
+        """
+        with self._transaction() as conn:
+            self._remove_in_transaction(conn, session_id)
+
+    def is_empty(self) -> bool:
+        """索引中是否没有任何文档"""
+        (doc_count,) = self._connection().execute(
+            "SELECT value FROM meta WHERE key = 'doc_count'"
+        ).fetchone()
+        return doc_count == 0
+
+    def search(self, query: str, limit: int = 20, session_ids: Optional[Iterable[str]] = None) -> List[Dict]:
+        """
+        按 BM25 检索会话
+
+        每个会话只取得分最高的消息，会话去重和存活会话过滤都在 SQL 中、LIMIT 之前完成，
+        只要有足够多的会话命中就一定返回 limit 条结果。
+
+        Args:
+            query: 查询文本
+            limit: 最多返回的会话数
+            session_ids: 只在这些会话中检索（如存储中现存的会话），None 表示不限制
+
+        Returns:
+            按得分倒序的结果，每个会话一条：session_id、seq、role、score、snippet
+        """
+        query_tokens = list(dict.fromkeys(tokenize(query)))
+        if not query_tokens:
+            return []
+
+        conn = self._connection()
+        doc_count, total_length = (
+            row[0] for row in conn.execute(
+                "SELECT value FROM meta WHERE key IN ('doc_count', 'total_length') ORDER BY key"
+            )
+        )
+        if doc_count == 0:
+            return []
+        avg_length = total_length / doc_count
+
+        # 逐词计算 IDF（postings 主键以 token 开头，按词统计文档频率走索引）
+        weights = []
+        for token in query_tokens:
+            (df,) = conn.execute("SELECT COUNT(*) FROM postings WHERE token = ?", (token,)).fetchone()
+            if df:
+                weights.append((token, math.log(1 + (doc_count - df + 0.5) / (df + 0.5))))
+        if not weights:
+            return []
+
+        # 存活会话写入连接私有的临时表，在打分时直接过滤
+        live_filter = ""
+        if session_ids is not None:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS live_sessions (session_id TEXT PRIMARY KEY)")
+            conn.execute("DELETE FROM temp.live_sessions")
+            conn.executemany(
+                "INSERT OR IGNORE INTO temp.live_sessions (session_id) VALUES (?)",
+                ((session_id,) for session_id in session_ids)
+            )
+            live_filter = "WHERE d.session_id IN (SELECT session_id FROM temp.live_sessions)"
+
+        values = ", ".join("(?, ?)" for _ in weights)
+        params = [value for pair in weights for value in pair]
+        rows = conn.execute(
+            f"""
+            WITH q(token, idf) AS (VALUES {values}),
+            scored AS (
+                SELECT d.doc_id, d.session_id,
+                       SUM(q.idf * p.tf * ({BM25_K1} + 1)
+                           / (p.tf + {BM25_K1} * (1 - {BM25_B} + {BM25_B} * d.length / ?))) AS score
+                FROM q
+                JOIN postings p ON p.token = q.token
+                JOIN docs d ON d.doc_id = p.doc_id
+                {live_filter}
+                GROUP BY p.doc_id
+            ),
+            ranked AS (
+                SELECT doc_id, score,
+                       ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY score DESC, doc_id) AS session_rank
+                FROM scored
+            )
+            SELECT d.session_id, d.seq, d.role, d.text, r.score
+            FROM ranked r
+            JOIN docs d ON d.doc_id = r.doc_id
+            WHERE r.session_rank = 1
+            ORDER BY r.score DESC, d.session_id
+            LIMIT ?
+            """,
+            params + [avg_length, limit]
+        ).fetchall()
+
+        return [
+            {
+                "session_id": session_id,
+                "seq": seq,
+                "role": role,
+                "score": round(score, 4),
+                "snippet": highlight_snippet(text, query_tokens),
+            }
+            for session_id, seq, role, text, score in rows
+        ]
+
+    def session_ids(self) -> List[str]:
+        """索引中的全部会话ID"""
+        return [row[0] for row in self._connection().execute("SELECT DISTINCT session_id FROM docs")]
+
+    def close(self):
+        """关闭当前线程的数据库连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
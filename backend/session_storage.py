@@ -0,0 +1,1028 @@
+"""
+会话存储后端模块
+
+SessionManager 通过存储后端读写会话数据，目前提供两种实现：
+- JSONFileStorage：JSON 快照 + 追加日志（默认）
+- SQLiteStorage：SQLite 数据库（WAL 模式），会话元数据与消息分表存储
+
+通过环境变量 SESSION_BACKEND（json/sqlite）选择后端。
+
+长时间未更新的会话可以归档为压缩格式（gzip，安装 zstandard 时可选 zstd），
+读取时透明解压，再次写入时自动恢复为普通存储。
+"""
+
+import gzip
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from filelock import FileLock
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# 数据存储目录
+DATA_DIR = Path(__file__).parent.parent / "data" / "sessions"
+INDEX_FILE = DATA_DIR / "index.json"
+INDEX_LOCK_FILE = DATA_DIR / ".index.lock"
+LOCK_DIR = DATA_DIR / ".locks"
+LOG_SUFFIX = ".log.jsonl"
+ARCHIVE_DIR = DATA_DIR / "archive"
+DB_FILE = Path(os.getenv("SESSION_DB_PATH", str(DATA_DIR / "sessions.db")))
+
+# 会话锁分桶数量（同一分桶内的会话共享一把锁）
+LOCK_STRIPES = int(os.getenv("SESSION_LOCK_STRIPES", "64"))
+
+# 追加日志超过该字节数时合并回快照
+LOG_COMPACT_BYTES = int(os.getenv("SESSION_LOG_COMPACT_BYTES", str(256 * 1024)))
+
+# 归档压缩格式：gzip 或 zstd（需要安装 zstandard）
+ARCHIVE_CODEC = os.getenv("SESSION_ARCHIVE_CODEC", "gzip").lower()
+
+# 确保目录存在
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+
+class ArchiveCodec:
+    """归档压缩格式枚举"""
+    GZIP = "gzip"
+    ZSTD = "zstd"
+
+    SUFFIXES = {GZIP: ".json.gz", ZSTD: ".json.zst"}
+
+
+def _resolve_codec(codec: str) -> str:
+    """校验压缩格式，zstd 不可用时回退到 gzip"""
+    if codec == ArchiveCodec.ZSTD and zstandard is None:
+        logger.warning("未安装 zstandard，归档使用 gzip 压缩")
+        return ArchiveCodec.GZIP
+    if codec not in ArchiveCodec.SUFFIXES:
+        raise ValueError(f"不支持的归档压缩格式: {codec}")
+    return codec
+
+
+def _open_archive(path: Path, codec: str, mode: str) -> io.TextIOBase:
+    """以流式文本方式打开压缩文件（mode 为 "rt" 或 "wt"）"""
+    if codec == ArchiveCodec.ZSTD:
+        if "w" in mode:
+            stream = zstandard.ZstdCompressor().stream_writer(open(path, "wb"))
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return gzip.open(path, mode, encoding="utf-8")
+
+
+def _compress(data: bytes, codec: str) -> bytes:
+    """压缩字节串"""
+    if codec == ArchiveCodec.ZSTD:
+        return zstandard.ZstdCompressor().compress(data)
+    return gzip.compress(data)
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    """解压字节串"""
+    if codec == ArchiveCodec.ZSTD:
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+class StorageBackend:
+    """存储后端枚举"""
+    JSON = "json"
+    SQLITE = "sqlite"
+
+
+class BatchWriteError(Exception):
+    """
+    批量追加部分失败
+
+    写入方据此只重试未写入的请求，已写入的消息不会被重复追加。
+    """
+
+    def __init__(self, message: str, written: List[Tuple[Tuple, Optional[Dict]]], failed: List[Tuple]):
+        """
+        Args:
+            message: 错误信息
+            written: 已写入的 (请求, 更新后的元数据)；元数据为 None 表示消息已写入、
+                     会话列表尚未更新（下次写入时补写）
+            failed: 未写入的请求，可以安全重试
+        """
+        super().__init__(message)
+        self.written = written
+        self.failed = failed
+
+
+class SessionStorage:
+    """
+    会话存储后端接口
+
+    所有时间戳由调用方（SessionManager）生成，存储后端只负责持久化。
+    """
+
+    # 是否能直接按索引分页（否则由 SessionManager 在缓存的完整数据上切片）
+    supports_keyset_pagination = False
+
+    def list_sessions(self) -> List[Dict]:
+        """返回所有会话的元数据，按更新时间倒序排列"""
+        raise NotImplementedError
+
+    def load_session(self, session_id: str) -> Optional[Dict]:
+        """返回完整会话文档；不存在时返回 None"""
+        raise NotImplementedError
+
+    def list_sessions_page(self, limit: int, after: Optional[Tuple[str, str]] = None) -> List[Dict]:
+        """
+        按 (updated_at, session_id) 倒序分页返回会话元数据
+
+        Args:
+            limit: 最多返回的条数
+            after: 上一页最后一条的 (updated_at, session_id)，None 表示第一页
+        """
+        raise NotImplementedError
+
+    def load_messages(self, session_id: str, before: Optional[int], limit: int) -> Optional[Tuple[List[Tuple[int, Dict]], int]]:
+        """
+        返回序号小于 before 的最后 limit 条消息
+
+        Args:
+            session_id: 会话ID
+            before: 消息序号上界（不含），None 表示从最新一条开始
+            limit: 最多返回的条数
+
+        Returns:
+            ([(序号, 消息)]（按序号升序）, 消息总数)；会话不存在时返回 None
+        """
+        raise NotImplementedError
+
+    def session_signature(self, session_id: str) -> Any:
+        """
+        返回会话当前版本的廉价签名，用于校验缓存；数据变化时签名随之变化
+
+        返回 None 表示无法校验，调用方不应缓存
+        """
+        return None
+
+    def index_signature(self) -> Any:
+        """返回会话列表当前版本的廉价签名；返回 None 表示无法校验"""
+        return None
+
+    def write_session(self, session_data: Dict):
+        """整体写入会话文档并更新元数据（新建或覆盖）"""
+        raise NotImplementedError
+
+    def append_messages(self, session_id: str, messages: List[Dict], title: Optional[str], now: str) -> Dict:
+        """追加消息，会话不存在时以 title 创建；返回更新后的元数据"""
+        raise NotImplementedError
+
+    def append_many(self, items: List[Tuple[str, List[Dict], Optional[str]]], now: str) -> List[Dict]:
+        """
+        批量追加多个会话的消息（group commit），默认逐个调用 append_messages
+
+        整批要么全部写入，要么全部未写入；只写入了一部分时抛出 BatchWriteError
+        """
+        entries = []
+        for index, (session_id, messages, title) in enumerate(items):
+            try:
+                entries.append(self.append_messages(session_id, messages, title, now))
+            except Exception as e:
+                if not entries:
+                    raise
+                raise BatchWriteError(
+                    f"追加会话消息失败: {session_id}, {e}", list(zip(items, entries)), list(items[index:])
+                ) from e
+        return entries
+
+    def rename_session(self, session_id: str, title: str, now: str) -> bool:
+        """修改会话标题；会话不存在时返回 False"""
+        raise NotImplementedError
+
+    def delete_session(self, session_id: str):
+        """删除会话"""
+        raise NotImplementedError
+
+    def compact_session(self, session_id: str):
+        """整理会话的存储结构（默认无需处理）"""
+
+    def archive_candidates(self, cutoff: str) -> List[str]:
+        """返回 updated_at 早于 cutoff 且尚未归档的会话ID"""
+        return [
+            s["session_id"] for s in self.list_sessions()
+            if s.get("updated_at", "") < cutoff and not s.get("archived")
+        ]
+
+    def archive_session(self, session_id: str) -> Optional[Tuple[int, int]]:
+        """
+        将会话移入压缩归档
+
+        Returns:
+            (归档前字节数, 归档后字节数)；会话不存在或已归档时返回 None
+        """
+        raise NotImplementedError
+
+    def vacuum(self):
+        """回收存储后端的空闲空间（默认无需处理）"""
+
+    def close(self):
+        """释放存储后端持有的资源"""
+
+
+class JSONFileStorage(SessionStorage):
+    """
+    JSON 文件存储后端
+
+    每个会话由两部分组成：
+    - {session_id}.json：会话快照（完整文档）
+    - {session_id}.log.jsonl：追加日志，每行一条记录（新增消息 / 标题变更）
+
+    新增一轮对话只需在日志末尾追加一行，代价为 O(新消息)；
+    日志超过阈值后会合并回快照（压缩），读取时快照 + 日志合并为同一文档结构。
+
+    锁：
+    - 会话锁按会话ID哈希分桶（.locks/stripe-NN.lock），不同会话的读写可跨线程、跨进程并行
+    - 索引锁（.index.lock）只在读-改-写 index.json 时短暂持有
+    - 加锁顺序固定为先会话锁、后索引锁，且不同时持有多个会话锁
+    - 所有 JSON 文件通过临时文件 + 原子替换写入，读取索引无需加锁
+
+    归档：快照和日志合并后流式压缩为 archive/{session_id}.json.gz（或 .json.zst），
+    索引条目标记 archived；读取时直接解压，写入前先恢复为快照。
+    """
+
+    def __init__(self, data_dir: Path = DATA_DIR, lock_stripes: int = LOCK_STRIPES,
+                 archive_codec: str = ARCHIVE_CODEC):
+        """
+        初始化 JSON 文件存储
+
+        Args:
+            data_dir: 会话数据目录
+            lock_stripes: 会话锁分桶数量
+            archive_codec: 归档压缩格式（gzip/zstd）
+        """
+        self.data_dir = Path(data_dir)
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self.index_file = self.data_dir / INDEX_FILE.name
+        self.archive_dir = self.data_dir / ARCHIVE_DIR.name
+        self.archive_codec = _resolve_codec(archive_codec)
+        self.index_lock = FileLock(str(self.data_dir / INDEX_LOCK_FILE.name), timeout=10)
+        # 消息已写入、索引更新失败的追加请求：[((会话ID, 消息列表, 标题), 时间)]，下次写入索引时补写
+        self._unindexed: List[Tuple[Tuple, str]] = []
+        self._unindexed_lock = threading.Lock()
+
+        lock_dir = self.data_dir / LOCK_DIR.name
+        lock_dir.mkdir(exist_ok=True)
+        self._session_locks = [
+            FileLock(str(lock_dir / f"stripe-{i:02d}.lock"), timeout=10)
+            for i in range(lock_stripes)
+        ]
+
+    def _session_lock(self, session_id: str) -> FileLock:
+        """获取会话所在分桶的锁（使用稳定哈希，保证多进程映射一致）"""
+        stripe = zlib.crc32(session_id.encode("utf-8")) % len(self._session_locks)
+        return self._session_locks[stripe]
+
+    def _ensure_index_exists(self):
+        """确保索引文件存在"""
+        if not self.index_file.exists():
+            with self.index_lock:
+                # 双重检查，防止并发创建
+                if not self.index_file.exists():
+                    self._write_json(self.index_file, {"sessions": []})
+
+    def _read_json(self, file_path: Path) -> Dict:
+        """安全读取 JSON 文件"""
+        try:
+            if file_path.exists():
+                with open(file_path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            return {}
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON 解析错误: {file_path}, {e}")
+            return {}
+        except Exception as e:
+            logger.error(f"读取文件失败: {file_path}, {e}")
+            return {}
+
+    def _write_json(self, file_path: Path, data: Dict):
+        """安全写入 JSON 文件（先写临时文件再原子替换，读取方不会看到写了一半的文件）"""
+        tmp_path = file_path.with_name(f".{file_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, file_path)
+
+        except Exception as e:
+            logger.error(f"写入文件失败: {file_path}, {e}")
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    def _update_index(self, update: Callable[[List[Dict]], None]):
+        """在索引锁内读-改-写 index.json"""
+        with self.index_lock:
+            index_data = self._read_json(self.index_file)
+            update(index_data.setdefault("sessions", []))
+            self._write_json(self.index_file, index_data)
+
+    def _session_file(self, session_id: str) -> Path:
+        """会话快照文件路径"""
+        return self.data_dir / f"{session_id}.json"
+
+    def _log_file(self, session_id: str) -> Path:
+        """会话追加日志文件路径"""
+        return self.data_dir / f"{session_id}{LOG_SUFFIX}"
+
+    def _archive_file(self, session_id: str) -> Optional[Tuple[Path, str]]:
+        """查找会话的归档文件，返回 (路径, 压缩格式)；未归档时返回 None"""
+        for codec, suffix in ArchiveCodec.SUFFIXES.items():
+            path = self.archive_dir / f"{session_id}{suffix}"
+            if path.exists():
+                return path, codec
+        return None
+
+    def _read_archive(self, session_id: str) -> Optional[Dict]:
+        """流式解压读取归档的会话文档"""
+        archived = self._archive_file(session_id)
+        if archived is None:
+            return None
+
+        path, codec = archived
+        with _open_archive(path, codec, "rt") as f:
+            return json.load(f)
+
+    def _restore_archived(self, session_id: str):
+        """写入前把归档的会话恢复为快照（调用方需持有会话锁）"""
+        archived = self._archive_file(session_id)
+        if archived is None or self._session_file(session_id).exists():
+            return
+
+        self._write_json(self._session_file(session_id), self._read_archive(session_id))
+        archived[0].unlink()
+        logger.info(f"已恢复归档会话: {session_id}")
+
+    def _remove_archive(self, session_id: str):
+        """删除会话的归档文件（调用方需持有会话锁）"""
+        for suffix in ArchiveCodec.SUFFIXES.values():
+            (self.archive_dir / f"{session_id}{suffix}").unlink(missing_ok=True)
+
+    def _read_log(self, log_path: Path) -> List[Dict]:
+        """读取追加日志，跳过损坏的行（例如写入中断留下的半行）"""
+        records = []
+        if not log_path.exists():
+            return records
+
+        with open(log_path, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError as e:
+                    logger.warning(f"跳过损坏的日志行: {log_path}:{line_no}, {e}")
+        return records
+
+    def _append_log(self, session_id: str, record: Dict):
+        """在会话日志末尾追加一条记录"""
+        with open(self._log_file(session_id), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _load_session(self, session_id: str) -> Optional[Dict]:
+        """
+        加载会话：读取快照并重放追加日志；已归档的会话直接解压（调用方需持有会话锁）
+
+        Returns:
+            合并后的会话数据；会话不存在时返回 None
+        """
+        session_file = self._session_file(session_id)
+        log_file = self._log_file(session_id)
+
+        if not session_file.exists() and not log_file.exists():
+            return self._read_archive(session_id)
+
+        session_data = self._read_json(session_file)
+        session_data.setdefault("session_id", session_id)
+        session_data.setdefault("messages", [])
+
+        for record in self._read_log(log_file):
+            session_data["messages"].extend(record.get("messages", []))
+            if "title" in record:
+                session_data["title"] = record["title"]
+            if "updated_at" in record:
+                session_data["updated_at"] = record["updated_at"]
+
+        return session_data
+
+    def _compact_session(self, session_id: str):
+        """将追加日志合并回快照并删除日志（调用方需持有会话锁）"""
+        log_file = self._log_file(session_id)
+        if not log_file.exists():
+            return
+
+        session_data = self._load_session(session_id)
+        self._write_json(self._session_file(session_id), session_data)
+        log_file.unlink()
+        logger.info(f"会话日志已合并: {session_id}, 消息数: {len(session_data['messages'])}")
+
+    def session_ids(self) -> List[str]:
+        """列出数据目录中所有会话文件对应的会话ID（包括已归档和未登记到索引的会话）"""
+        session_ids = {
+            p.stem for p in self.data_dir.glob("*.json")
+            if p.name != self.index_file.name
+        }
+        for suffix in ArchiveCodec.SUFFIXES.values():
+            session_ids.update(
+                p.name[:-len(suffix)] for p in self.archive_dir.glob(f"*{suffix}")
+            )
+        return sorted(session_ids)
+
+    def _stat_signature(self, file_path: Path) -> Optional[Tuple[int, int, int]]:
+        """文件签名：(inode, mtime_ns, size)；原子替换会改变 inode，追加会改变 size"""
+        try:
+            st = file_path.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def session_signature(self, session_id: str) -> Any:
+        archived = self._archive_file(session_id)
+        return (
+            self._stat_signature(self._session_file(session_id)),
+            self._stat_signature(self._log_file(session_id)),
+            self._stat_signature(archived[0]) if archived else None,
+        )
+
+    def index_signature(self) -> Any:
+        return self._stat_signature(self.index_file)
+
+    def list_sessions(self) -> List[Dict]:
+        self._ensure_index_exists()
+
+        # 索引通过原子替换写入，读取无需加锁
+        sessions = self._read_json(self.index_file).get("sessions", [])
+
+        # 按更新时间倒序排列
+        sessions.sort(key=lambda x: x.get("updated_at", ""), reverse=True)
+        return sessions
+
+    def load_session(self, session_id: str) -> Optional[Dict]:
+        with self._session_lock(session_id):
+            return self._load_session(session_id)
+
+    def write_session(self, session_data: Dict):
+        self._ensure_index_exists()
+        session_id = session_data["session_id"]
+
+        with self._session_lock(session_id):
+            # 写入会话文件（清理已合并进文档的追加日志和旧归档）
+            self._write_json(self._session_file(session_id), session_data)
+            self._log_file(session_id).unlink(missing_ok=True)
+            self._remove_archive(session_id)
+
+        # 更新索引
+        def update(sessions: List[Dict]):
+            entry = next((s for s in sessions if s["session_id"] == session_id), None)
+            if entry is None:
+                entry = {"session_id": session_id, "created_at": session_data.get("created_at")}
+                sessions.append(entry)
+            entry.pop("archived", None)
+            entry["title"] = session_data.get("title", "新对话")
+            entry["updated_at"] = session_data.get("updated_at")
+            entry["message_count"] = len(session_data.get("messages", []))
+
+        self._update_index(update)
+
+    def _append_session_files(self, session_id: str, messages: List[Dict], title: Optional[str], now: str):
+        """在会话锁内写入会话文件：必要时恢复归档或创建空快照，追加日志，日志过大时合并"""
+        with self._session_lock(session_id):
+            self._restore_archived(session_id)
+            session_file = self._session_file(session_id)
+
+            # 会话不存在时先创建空快照
+            if not session_file.exists():
+                self._write_json(session_file, {
+                    "session_id": session_id,
+                    "title": title or session_id,
+                    "created_at": now,
+                    "updated_at": now,
+                    "messages": []
+                })
+                self._log_file(session_id).unlink(missing_ok=True)
+
+            self._append_log(session_id, {"updated_at": now, "messages": messages})
+
+            # 日志过大时合并回快照
+            if self._log_file(session_id).stat().st_size > LOG_COMPACT_BYTES:
+                self._compact_session(session_id)
+
+    def append_messages(self, session_id: str, messages: List[Dict], title: Optional[str], now: str) -> Dict:
+        return self.append_many([(session_id, messages, title)], now)[0]
+
+    def append_many(self, items: List[Tuple[str, List[Dict], Optional[str]]], now: str) -> List[Dict]:
+        self._ensure_index_exists()
+
+        # 逐个会话加锁写文件，不同时持有多个会话锁；单个会话失败不影响其他会话
+        written, failed = [], []
+        error = None
+        for item in items:
+            try:
+                self._append_session_files(item[0], item[1], item[2], now)
+            except Exception as e:
+                logger.error(f"追加会话消息失败: {item[0]}, {e}")
+                failed.append(item)
+                error = e
+            else:
+                written.append(item)
+
+        # 整批只加一次索引锁、写回一次索引（只登记文件已写入的会话，索引与快照保持一致）
+        with self._unindexed_lock:
+            unindexed, self._unindexed = self._unindexed, []
+        entries = []
+
+        def update(sessions: List[Dict]):
+            entries.clear()
+            by_id = {s["session_id"]: s for s in sessions}
+            for (session_id, messages, title), updated_at in (
+                [(item, item_now) for item, item_now in unindexed] + [(item, now) for item in written]
+            ):
+                entry = by_id.get(session_id)
+                if entry is None:
+                    entry = {
+                        "session_id": session_id,
+                        "title": title or session_id,
+                        "created_at": updated_at,
+                        "message_count": 0
+                    }
+                    sessions.append(entry)
+                    by_id[session_id] = entry
+                entry.pop("archived", None)
+                entry["updated_at"] = max(entry.get("updated_at") or "", updated_at)
+                entry["message_count"] = entry.get("message_count", 0) + len(messages)
+                entries.append(dict(entry))
+
+        if written or unindexed:
+            try:
+                self._update_index(update)
+            except Exception as e:
+                # 消息已写入会话文件，不能重试追加：记下待补写的索引条目，下次写入时一并更新
+                with self._unindexed_lock:
+                    self._unindexed = unindexed + [(item, now) for item in written] + self._unindexed
+                raise BatchWriteError(
+                    f"更新会话索引失败: {e}", [(item, None) for item in written], failed
+                ) from e
+
+        entries = entries[len(unindexed):]
+        if failed:
+            raise BatchWriteError(
+                f"{len(failed)} 个会话追加失败: {error}", list(zip(written, entries)), failed
+            ) from error
+        return entries
+
+    def rename_session(self, session_id: str, title: str, now: str) -> bool:
+        self._ensure_index_exists()
+
+        with self._session_lock(session_id):
+            self._restore_archived(session_id)
+            if not self._session_file(session_id).exists():
+                return False
+
+            # 标题变更同样写入追加日志，无需重写快照
+            self._append_log(session_id, {"updated_at": now, "title": title})
+
+        # 更新索引
+        def update(sessions: List[Dict]):
+            for session in sessions:
+                if session["session_id"] == session_id:
+                    session.pop("archived", None)
+                    session["title"] = title
+                    session["updated_at"] = now
+                    break
+
+        self._update_index(update)
+        return True
+
+    def delete_session(self, session_id: str):
+        self._ensure_index_exists()
+
+        with self._session_lock(session_id):
+            # 删除会话文件、追加日志及归档
+            self._session_file(session_id).unlink(missing_ok=True)
+            self._log_file(session_id).unlink(missing_ok=True)
+            self._remove_archive(session_id)
+
+        # 从索引中移除
+        def update(sessions: List[Dict]):
+            sessions[:] = [s for s in sessions if s["session_id"] != session_id]
+
+        self._update_index(update)
+
+    def compact_session(self, session_id: str):
+        with self._session_lock(session_id):
+            self._compact_session(session_id)
+
+    def archive_session(self, session_id: str) -> Optional[Tuple[int, int]]:
+        self._ensure_index_exists()
+        self.archive_dir.mkdir(exist_ok=True)
+
+        with self._session_lock(session_id):
+            session_file = self._session_file(session_id)
+            log_file = self._log_file(session_id)
+            if not session_file.exists() and not log_file.exists():
+                return None
+
+            bytes_before = sum(p.stat().st_size for p in (session_file, log_file) if p.exists())
+            session_data = self._load_session(session_id)
+
+            # 先流式压缩到临时文件，再原子替换
+            suffix = ArchiveCodec.SUFFIXES[self.archive_codec]
+            archive_path = self.archive_dir / f"{session_id}{suffix}"
+            tmp_path = archive_path.with_name(f".{archive_path.name}.{os.getpid()}.tmp")
+            try:
+                with _open_archive(tmp_path, self.archive_codec, "wt") as f:
+                    json.dump(session_data, f, ensure_ascii=False)
+                os.replace(tmp_path, archive_path)
+            except Exception:
+                tmp_path.unlink(missing_ok=True)
+                raise
+
+            session_file.unlink(missing_ok=True)
+            log_file.unlink(missing_ok=True)
+            bytes_after = archive_path.stat().st_size
+
+        def update(sessions: List[Dict]):
+            for session in sessions:
+                if session["session_id"] == session_id:
+                    session["archived"] = True
+                    break
+
+        self._update_index(update)
+        return bytes_before, bytes_after
+
+
+class SQLiteStorage(SessionStorage):
+    """
+    SQLite 存储后端
+
+    - WAL 模式：读写互不阻塞，多进程可并发读取
+    - sessions 表保存元数据（(updated_at, session_id) 建索引，列表按索引分页）
+    - messages 表按 (session_id, seq) 存储每条消息，追加消息只插入新行，按主键分页读取
+    - archived_sessions 表保存归档会话的压缩消息列表（对应的 messages 行被删除）
+    """
+
+    supports_keyset_pagination = True
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sessions (
+        session_id    TEXT PRIMARY KEY,
+        title         TEXT NOT NULL,
+        created_at    TEXT NOT NULL,
+        updated_at    TEXT NOT NULL,
+        message_count INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions(updated_at, session_id);
+
+    CREATE TABLE IF NOT EXISTS messages (
+        session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+        seq        INTEGER NOT NULL,
+        data       TEXT NOT NULL,
+        PRIMARY KEY (session_id, seq)
+    );
+
+    CREATE TABLE IF NOT EXISTS archived_sessions (
+        session_id TEXT PRIMARY KEY REFERENCES sessions(session_id) ON DELETE CASCADE,
+        codec      TEXT NOT NULL,
+        data       BLOB NOT NULL
+    );
+    """
+
+    def __init__(self, db_path: Path = DB_FILE, archive_codec: str = ARCHIVE_CODEC):
+        """
+        初始化 SQLite 存储
+
+        Args:
+            db_path: 数据库文件路径
+            archive_codec: 归档压缩格式（gzip/zstd）
+        """
+        self.db_path = Path(db_path)
+        self.archive_codec = _resolve_codec(archive_codec)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # sqlite3 连接不能跨线程共享，每个线程持有自己的连接
+        self._local = threading.local()
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(self.SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """获取当前线程的数据库连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None：由 _transaction 显式控制事务边界
+            conn = sqlite3.connect(str(self.db_path), timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """写事务（BEGIN IMMEDIATE，提前获取写锁避免读后写升级冲突）"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def _archived_messages(self, conn: sqlite3.Connection, session_id: str) -> Optional[List[Dict]]:
+        """读取归档会话的消息列表；未归档时返回 None"""
+        row = conn.execute(
+            "SELECT codec, data FROM archived_sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(_decompress(row["data"], row["codec"]))
+
+    def _restore_in_transaction(self, conn: sqlite3.Connection, session_id: str):
+        """写入前把归档的消息恢复到 messages 表（在已开启的事务中调用）"""
+        messages = self._archived_messages(conn, session_id)
+        if messages is None:
+            return
+
+        conn.executemany(
+            "INSERT INTO messages (session_id, seq, data) VALUES (?, ?, ?)",
+            [
+                (session_id, seq, json.dumps(message, ensure_ascii=False))
+                for seq, message in enumerate(messages)
+            ]
+        )
+        conn.execute("DELETE FROM archived_sessions WHERE session_id = ?", (session_id,))
+        logger.info(f"已恢复归档会话: {session_id}")
+
+    def list_sessions(self) -> List[Dict]:
+        rows = self._connection().execute(
+            "SELECT session_id, title, created_at, updated_at, message_count "
+            "FROM sessions ORDER BY updated_at DESC"
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def session_signature(self, session_id: str) -> Any:
+        row = self._connection().execute(
+            "SELECT updated_at, message_count FROM sessions WHERE session_id = ?",
+            (session_id,)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def index_signature(self) -> Any:
+        return tuple(self._connection().execute(
+            "SELECT COUNT(*), MAX(updated_at) FROM sessions"
+        ).fetchone())
+
+    def list_sessions_page(self, limit: int, after: Optional[Tuple[str, str]] = None) -> List[Dict]:
+        columns = "session_id, title, created_at, updated_at, message_count"
+        if after is None:
+            rows = self._connection().execute(
+                f"SELECT {columns} FROM sessions "
+                "ORDER BY updated_at DESC, session_id DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        else:
+            rows = self._connection().execute(
+                f"SELECT {columns} FROM sessions WHERE (updated_at, session_id) < (?, ?) "
+                "ORDER BY updated_at DESC, session_id DESC LIMIT ?",
+                (after[0], after[1], limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def load_messages(self, session_id: str, before: Optional[int], limit: int) -> Optional[Tuple[List[Tuple[int, Dict]], int]]:
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT message_count FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        total = row[0]
+        upper = total if before is None else min(before, total)
+
+        archived = self._archived_messages(conn, session_id)
+        if archived is not None:
+            lower = max(0, upper - limit)
+            return list(enumerate(archived[lower:upper], start=lower)), total
+
+        rows = conn.execute(
+            "SELECT seq, data FROM messages WHERE session_id = ? AND seq < ? "
+            "ORDER BY seq DESC LIMIT ?",
+            (session_id, upper, limit)
+        ).fetchall()
+        return [(seq, json.loads(data)) for seq, data in reversed(rows)], total
+
+    def load_session(self, session_id: str) -> Optional[Dict]:
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT session_id, title, created_at, updated_at FROM sessions WHERE session_id = ?",
+            (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        session_data = dict(row)
+        archived = self._archived_messages(conn, session_id)
+        if archived is not None:
+            session_data["messages"] = archived
+            return session_data
+
+        session_data["messages"] = [
+            json.loads(data) for (data,) in conn.execute(
+                "SELECT data FROM messages WHERE session_id = ? ORDER BY seq",
+                (session_id,)
+            )
+        ]
+        return session_data
+
+    def write_session(self, session_data: Dict):
+        session_id = session_data["session_id"]
+        messages = session_data.get("messages", [])
+
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO sessions (session_id, title, created_at, updated_at, message_count) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET "
+                "title = excluded.title, updated_at = excluded.updated_at, "
+                "message_count = excluded.message_count",
+                (
+                    session_id,
+                    session_data.get("title", "新对话"),
+                    session_data.get("created_at") or session_data.get("updated_at"),
+                    session_data.get("updated_at"),
+                    len(messages),
+                )
+            )
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM archived_sessions WHERE session_id = ?", (session_id,))
+            conn.executemany(
+                "INSERT INTO messages (session_id, seq, data) VALUES (?, ?, ?)",
+                [
+                    (session_id, seq, json.dumps(message, ensure_ascii=False))
+                    for seq, message in enumerate(messages)
+                ]
+            )
+
+    def _append_in_transaction(self, conn: sqlite3.Connection, session_id: str,
+                               messages: List[Dict], title: Optional[str], now: str) -> Dict:
+        """在已开启的事务中追加消息"""
+        conn.execute(
+            "INSERT OR IGNORE INTO sessions (session_id, title, created_at, updated_at, message_count) "
+            "VALUES (?, ?, ?, ?, 0)",
+            (session_id, title or session_id, now, now)
+        )
+        self._restore_in_transaction(conn, session_id)
+        (start,) = conn.execute(
+            "SELECT message_count FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+
+        conn.executemany(
+            "INSERT INTO messages (session_id, seq, data) VALUES (?, ?, ?)",
+            [
+                (session_id, start + offset, json.dumps(message, ensure_ascii=False))
+                for offset, message in enumerate(messages)
+            ]
+        )
+        conn.execute(
+            "UPDATE sessions SET updated_at = ?, message_count = ? WHERE session_id = ?",
+            (now, start + len(messages), session_id)
+        )
+        row = conn.execute(
+            "SELECT session_id, title, created_at, updated_at, message_count "
+            "FROM sessions WHERE session_id = ?",
+            (session_id,)
+        ).fetchone()
+        return dict(row)
+
+    def append_messages(self, session_id: str, messages: List[Dict], title: Optional[str], now: str) -> Dict:
+        return self.append_many([(session_id, messages, title)], now)[0]
+
+    def append_many(self, items: List[Tuple[str, List[Dict], Optional[str]]], now: str) -> List[Dict]:
+        # 整批在同一个事务中提交
+        with self._transaction() as conn:
+            return [
+                self._append_in_transaction(conn, session_id, messages, title, now)
+                for session_id, messages, title in items
+            ]
+
+    def rename_session(self, session_id: str, title: str, now: str) -> bool:
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE sessions SET title = ?, updated_at = ? WHERE session_id = ?",
+                (title, now, session_id)
+            )
+        return cursor.rowcount > 0
+
+    def delete_session(self, session_id: str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def archive_candidates(self, cutoff: str) -> List[str]:
+        rows = self._connection().execute(
+            "SELECT session_id FROM sessions WHERE updated_at < ? "
+            "AND session_id NOT IN (SELECT session_id FROM archived_sessions)",
+            (cutoff,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def archive_session(self, session_id: str) -> Optional[Tuple[int, int]]:
+        with self._transaction() as conn:
+            exists = conn.execute(
+                "SELECT 1 FROM sessions WHERE session_id = ? "
+                "AND session_id NOT IN (SELECT session_id FROM archived_sessions)",
+                (session_id,)
+            ).fetchone()
+            if exists is None:
+                return None
+
+            rows = conn.execute(
+                "SELECT data FROM messages WHERE session_id = ? ORDER BY seq", (session_id,)
+            ).fetchall()
+            # 各条消息已是 JSON 文本，直接拼接为 JSON 数组，无需反序列化
+            raw = ("[" + ",".join(data for (data,) in rows) + "]").encode("utf-8")
+            blob = _compress(raw, self.archive_codec)
+
+            conn.execute(
+                "INSERT INTO archived_sessions (session_id, codec, data) VALUES (?, ?, ?)",
+                (session_id, self.archive_codec, blob)
+            )
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+
+        return len(raw), len(blob)
+
+    def vacuum(self):
+        # 归档删除的消息行只会进入空闲页，VACUUM 才能把空间还给文件系统
+        self._connection().execute("VACUUM")
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def create_storage(backend: Optional[str] = None) -> SessionStorage:
+    """
+    根据配置创建存储后端
+
+    Args:
+        backend: 后端类型（json/sqlite），默认读取环境变量 SESSION_BACKEND
+
+    Returns:
+        存储后端实例
+
+    Raises:
+        ValueError: 如果后端类型不支持
+    """
+    backend = (backend or os.getenv("SESSION_BACKEND", StorageBackend.JSON)).lower()
+
+    if backend == StorageBackend.JSON:
+        return JSONFileStorage()
+    elif backend == StorageBackend.SQLITE:
+        return SQLiteStorage()
+    else:
+        raise ValueError(f"不支持的会话存储后端: {backend}")
+
+
+def migrate_json_to_sqlite(source: JSONFileStorage, target: SQLiteStorage) -> int:
+    """
+    将 JSON 文件中的会话导入 SQLite（已存在的会话会被覆盖，可重复执行）
+
+    Args:
+        source: JSON 文件存储
+        target: SQLite 存储
+
+    Returns:
+        导入的会话数量
+    """
+    imported = 0
+    for session_id in source.session_ids():
+        session_data = source.load_session(session_id)
+        if not session_data or "updated_at" not in session_data:
+            logger.warning(f"跳过无效的会话文件: {session_id}")
+            continue
+
+        target.write_session(session_data)
+        imported += 1
+        logger.info(f"已导入会话: {session_id}, 消息数: {len(session_data.get('messages', []))}")
+
+    return imported
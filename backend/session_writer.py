@@ -0,0 +1,251 @@
+"""
+会话写入队列模块
+
+流式接口结束时只把新消息放入有界队列，由后台线程批量写入存储（group commit），
+避免在 asyncio 事件循环中阻塞于文件锁和磁盘写入。
+
+写入是异步的：提交返回时消息可能还在队列中。需要读到某个会话全部已提交消息的调用方
+（如冷线程根据会话恢复上下文）先调用 wait_for_session 等待该会话的写入完成。
+"""
+
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from backend.metrics import get_metrics
+from backend.session_manager import SessionManager
+from backend.session_storage import BatchWriteError
+
+logger = logging.getLogger(__name__)
+
+# 队列容量（队列满时提交方等待，形成背压）
+WRITE_QUEUE_SIZE = int(os.getenv("SESSION_WRITE_QUEUE_SIZE", "1000"))
+# 单批最多合并的写入请求数
+WRITE_BATCH_SIZE = int(os.getenv("SESSION_WRITE_BATCH_SIZE", "64"))
+# 收到第一个请求后等待更多请求加入同一批的时间（秒）
+WRITE_BATCH_WAIT = float(os.getenv("SESSION_WRITE_BATCH_WAIT", "0.05"))
+# 批量写入失败后的重试次数（重试仍失败时逐个会话写入）
+WRITE_RETRIES = int(os.getenv("SESSION_WRITE_RETRIES", "3"))
+# 第一次重试前的等待时间（秒），之后每次翻倍
+WRITE_RETRY_BACKOFF = float(os.getenv("SESSION_WRITE_RETRY_BACKOFF", "0.1"))
+# 读取会话前等待其排队写入完成的最长时间（秒）
+PENDING_WAIT_TIMEOUT = 10
+
+# 停止信号
+_STOP = object()
+
+
+class SessionWriter:
+    """
+    会话写入后台线程（write-behind）
+
+    指标：
+    - session_writer.queue_depth：当前队列长度
+    - session_writer.flush_seconds：每批写入耗时
+    - session_writer.batch_size：每批合并的写入请求数
+    - session_writer.retries：批量写入的重试次数
+    - session_writer.errors / session_writer.dropped_messages：重试和逐个写入后仍失败的会话数 / 消息数
+
+    批量写入失败时按指数退避重试未写入的部分；仍然失败时逐个会话写入，
+    单个会话的错误不会导致同一批中其他会话的消息丢失。
+    """
+
+    def __init__(
+        self,
+        session_manager: SessionManager,
+        max_queue: int = WRITE_QUEUE_SIZE,
+        batch_size: int = WRITE_BATCH_SIZE,
+        batch_wait: float = WRITE_BATCH_WAIT,
+        retries: int = WRITE_RETRIES,
+        retry_backoff: float = WRITE_RETRY_BACKOFF,
+    ):
+        """
+        初始化会话写入器
+
+        Args:
+            session_manager: 会话管理器
+            max_queue: 队列容量
+            batch_size: 单批最多合并的写入请求数
+            batch_wait: 攒批等待时间（秒）
+            retries: 批量写入失败后的重试次数
+            retry_backoff: 第一次重试前的等待时间（秒），之后每次翻倍
+        """
+        self.session_manager = session_manager
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        # 会话ID -> 已提交但尚未写完（写入或放弃）的请求数
+        self._pending: Counter = Counter()
+        self._pending_changed = threading.Condition()
+
+        self.metrics = get_metrics()
+        self.metrics.register_gauge("session_writer.queue_depth", self._queue.qsize)
+
+    def start(self):
+        """启动后台写入线程"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="session-writer", daemon=True)
+        self._thread.start()
+        logger.info("会话写入线程已启动")
+
+    def stop(self, timeout: float = 30):
+        """
+        停止后台线程，写完队列中剩余的请求后返回
+
+        Args:
+            timeout: 最长等待时间（秒）
+        """
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error(f"会话写入线程未能在 {timeout} 秒内退出，剩余 {self._queue.qsize()} 个请求")
+        else:
+            logger.info("会话写入线程已停止")
+        self._thread = None
+
+    async def submit(self, session_id: str, messages: List[Dict], title: Optional[str] = None):
+        """
+        提交一次追加写入（不阻塞事件循环）
+
+        Args:
+            session_id: 会话ID
+            messages: 要追加的消息列表
+            title: 会话不存在时使用的标题（可选）
+        """
+        item = (session_id, messages, title)
+        with self._pending_changed:
+            self._pending[session_id] += 1
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # 队列已满：在线程池中等待空位，不阻塞事件循环
+            self.metrics.incr("session_writer.queue_full")
+            await asyncio.to_thread(self._queue.put, item)
+
+    def wait_for_session(self, session_id: str, timeout: float = PENDING_WAIT_TIMEOUT) -> bool:
+        """
+        等待会话已提交的消息全部写完（阻塞调用，在事件循环中需通过 asyncio.to_thread 调用）
+
+        Args:
+            session_id: 会话ID
+            timeout: 最长等待时间（秒）
+
+        Returns:
+            是否已写完；超时返回 False（此时读到的会话可能缺少最近提交的消息）
+        """
+        with self._pending_changed:
+            done = self._pending_changed.wait_for(lambda: not self._pending[session_id], timeout)
+        if not done:
+            self.metrics.incr("session_writer.wait_timeouts")
+            logger.warning(f"等待会话写入超时（{timeout} 秒）: {session_id}")
+        return done
+
+    def _mark_done(self, batch: List[Tuple[str, List[Dict], Optional[str]]]):
+        """一批请求写完（包括放弃写入）后减少对应会话的待写计数并通知等待方"""
+        with self._pending_changed:
+            for session_id, _, _ in batch:
+                if self._pending[session_id] > 1:
+                    self._pending[session_id] -= 1
+                else:
+                    self._pending.pop(session_id, None)
+            self._pending_changed.notify_all()
+
+    def _run(self):
+        """后台线程主循环：取出一批请求并写入"""
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._flush(batch)
+
+        # 停止前写完剩余请求
+        remaining_items = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                remaining_items.append(item)
+        if remaining_items:
+            self._flush(remaining_items)
+
+    def _flush(self, batch: List[Tuple[str, List[Dict], Optional[str]]]):
+        """合并同一会话的请求并一次性写入；失败时重试，仍失败则逐个会话写入"""
+        merged: Dict[str, Tuple[List[Dict], Optional[str]]] = {}
+        for session_id, messages, title in batch:
+            if session_id in merged:
+                merged[session_id][0].extend(messages)
+            else:
+                merged[session_id] = (list(messages), title)
+        pending = [(session_id, messages, title) for session_id, (messages, title) in merged.items()]
+
+        start = time.perf_counter()
+        try:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    self.metrics.incr("session_writer.retries")
+                    time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+                try:
+                    self.session_manager.append_many(pending)
+                    pending = []
+                    break
+                except BatchWriteError as e:
+                    # 已写入的会话不再重试，避免重复追加
+                    pending = e.failed
+                    logger.warning(f"批量保存会话部分失败（第 {attempt + 1} 次）: {e}")
+                    if not pending:
+                        break
+                except Exception as e:
+                    logger.warning(f"批量保存会话失败（第 {attempt + 1} 次）: {e}")
+
+            for session_id, messages, title in pending:
+                self._append_one(session_id, messages, title)
+        finally:
+            self._mark_done(batch)
+            self.metrics.observe("session_writer.flush_seconds", time.perf_counter() - start)
+            self.metrics.observe("session_writer.batch_size", len(batch))
+
+        logger.info(f"批量保存会话: {len(batch)} 个请求, {len(merged)} 个会话")
+
+    def _append_one(self, session_id: str, messages: List[Dict], title: Optional[str]):
+        """单独写入一个会话（批量写入重试仍失败后的回退）"""
+        try:
+            self.session_manager.append_messages(session_id, messages, title)
+        except BatchWriteError as e:
+            if e.failed:
+                self._record_loss(session_id, messages, e)
+        except Exception as e:
+            self._record_loss(session_id, messages, e)
+
+    def _record_loss(self, session_id: str, messages: List[Dict], error: Exception):
+        """记录最终未能写入的消息"""
+        self.metrics.incr("session_writer.errors")
+        self.metrics.incr("session_writer.dropped_messages", len(messages))
+        logger.error(f"保存会话失败，丢弃 {len(messages)} 条消息: {session_id}, {error}", exc_info=True)
@@ -0,0 +1,121 @@
+"""
+请求合并模块（single-flight）
+
+同一时刻对同一个键的多次调用只执行一次，其余调用等待并共享同一个结果（或异常）。
+用于热点话题下并发请求相同的 Tavily 查询、相同 URL 的提取以及相同内容的摘要。
+
+- 异步调用：第一个调用者创建任务，后来者通过 asyncio.shield 等待同一个任务；
+  单个调用者被取消不影响其他调用者，所有调用者都取消后才取消任务
+- 同步调用：第一个调用者在自己的线程中执行，后来者阻塞等待其结果
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from backend.metrics import get_metrics
+
+
+class _AsyncCall:
+    """进行中的异步调用"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    按键合并进行中的调用
+
+    合并次数和实际执行次数记录到全局指标（{name}.coalesced、{name}.executions）。
+    """
+
+    def __init__(self, name: str):
+        """
+        初始化请求合并器
+
+        Args:
+            name: 名称（用作指标前缀）
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._async_calls: Dict[Hashable, _AsyncCall] = {}
+        self._sync_calls: Dict[Hashable, Future] = {}
+        self.metrics = get_metrics()
+        self.metrics.register_gauge(
+            f"{name}.in_flight", lambda: len(self._async_calls) + len(self._sync_calls)
+        )
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        执行异步调用；同一个键已有进行中的调用时等待其结果
+
+        Args:
+            key: 合并键
+            func: 无参数的协程函数
+
+        Returns:
+            (结果, 是否共享了其他调用者的结果)
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            call = self._async_calls.get(key)
+            # 任务只能在创建它的事件循环中等待
+            shared = call is not None and call.task.get_loop() is loop
+            if not shared:
+                call = _AsyncCall(loop.create_task(func()))
+                self._async_calls[key] = call
+                call.task.add_done_callback(lambda _, call=call: self._forget(key, call))
+            call.waiters += 1
+
+        self.metrics.incr(f"{self.name}.coalesced" if shared else f"{self.name}.executions")
+        try:
+            return await asyncio.shield(call.task), shared
+        finally:
+            with self._lock:
+                call.waiters -= 1
+                abandoned = call.waiters == 0 and not call.task.done()
+            if abandoned:
+                call.task.cancel()
+
+    def do_sync(self, key: Hashable, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        执行同步调用；同一个键已有进行中的调用时阻塞等待其结果
+
+        Args:
+            key: 合并键
+            func: 无参数的函数
+
+        Returns:
+            (结果, 是否共享了其他调用者的结果)
+        """
+        with self._lock:
+            future = self._sync_calls.get(key)
+            shared = future is not None
+            if not shared:
+                future = Future()
+                self._sync_calls[key] = future
+
+        self.metrics.incr(f"{self.name}.coalesced" if shared else f"{self.name}.executions")
+        if shared:
+            return future.result(), True
+
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                self._sync_calls.pop(key, None)
+
+    def _forget(self, key: Hashable, call: _AsyncCall):
+        """异步调用结束后移除记录（键可能已被新的调用占用）"""
+        with self._lock:
+            if self._async_calls.get(key) is call:
+                del self._async_calls[key]
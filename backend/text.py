@@ -0,0 +1,40 @@
+"""
+文本切分模块
+
+会话检索（backend/session_search.py）、相关性排序（backend/ranking.py）、网页预处理和推测性搜索预取
+共用的分词规则和 BM25 参数。本模块不依赖存储，导入时没有副作用。
+"""
+
+import re
+from typing import List
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# CJK 字符（中日韩统一表意文字、假名、谚文）连续片段，或由字母数字组成的单词
+_TOKEN_PATTERN = re.compile(
+    r"[぀-ヿ㐀-䶿一-鿿豈-﫿가-힯]+|[a-z0-9]+"
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    切分文本为索引词
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        索引词列表：CJK 片段切为字符二元组（单字片段保留单字），其余按单词切分
+    """
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text.lower()):
+        run = match.group()
+        if run[0].isascii():
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
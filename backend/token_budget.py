@@ -0,0 +1,197 @@
+"""
+token 预算模块
+
+用本地估算代替字符切片来控制发送给模型的内容长度：
+- token 估算：CJK 字符按每字 1 个，其余按每 4 个字符 1 个（中英文混排时比按字符数截断准确得多），
+  较短的字符串按内容哈希缓存估算结果（缓存不持有字符串本身）
+- 按 token 截断和切分文本：基于逐字符代价的前缀和（NumPy 计算），优先在换行处断开
+- 按模型分配输入/输出预算：上下文窗口与最大输出来自 LLMConfig.MODEL_TOKEN_LIMITS
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from backend.llm_config import LLM_MAX_OUTPUT_TOKENS, LLMConfig
+
+# 每条消息的固定开销（角色、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+# 估算结果缓存的最大字符串长度（更长的字符串通常是只估算一次的页面内容，直接重新估算）
+ESTIMATE_CACHE_MAX_CHARS = 16384
+# 估算结果缓存的条目数
+ESTIMATE_CACHE_SIZE = 4096
+
+_CJK_PATTERN = re.compile(r"[぀-ヿ㐀-䶿一-鿿豈-﫿가-힯]")
+# 与 _CJK_PATTERN 相同的码位区间（闭区间）
+_CJK_RANGES = ((0x3040, 0x30FF), (0x3400, 0x4DBF), (0x4E00, 0x9FFF), (0xF900, 0xFAFF), (0xAC00, 0xD7AF))
+
+
+def _estimate(text: str) -> int:
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+# (文本哈希, 长度) -> 估算的 token 数；键只有两个整数，缓存占用与字符串长度无关
+_estimate_cache: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+_estimate_cache_lock = threading.Lock()
+
+
+def _estimate_cached(text: str) -> int:
+    """按 (哈希, 长度) 缓存的估算（哈希碰撞只会让估算值略有偏差）"""
+    key = (hash(text), len(text))
+    with _estimate_cache_lock:
+        tokens = _estimate_cache.get(key)
+        if tokens is not None:
+            _estimate_cache.move_to_end(key)
+            return tokens
+
+    tokens = _estimate(text)
+    with _estimate_cache_lock:
+        _estimate_cache[key] = tokens
+        while len(_estimate_cache) > ESTIMATE_CACHE_SIZE:
+            _estimate_cache.popitem(last=False)
+    return tokens
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的 token 数
+
+    Args:
+        text: 文本
+
+    Returns:
+        估算的 token 数
+    """
+    if not text:
+        return 0
+    if len(text) <= ESTIMATE_CACHE_MAX_CHARS:
+        return _estimate_cached(text)
+    return _estimate(text)
+
+
+def _content_text(content: Any) -> str:
+    """消息内容转为文本（多段内容只取文本部分）"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(
+            part if isinstance(part, str) else str(part.get("text", "")) if isinstance(part, dict) else str(part)
+            for part in content
+        )
+    return str(content)
+
+
+def count_message_tokens(messages: Sequence[Any]) -> int:
+    """
+    估算消息列表的 token 数（内容、工具调用参数与每条消息的固定开销）
+
+    Args:
+        messages: LangChain 消息列表
+
+    Returns:
+        估算的 token 数
+    """
+    total = 0
+    for message in messages:
+        total += MESSAGE_OVERHEAD_TOKENS + estimate_tokens(_content_text(message.content))
+        for call in getattr(message, "tool_calls", None) or []:
+            total += estimate_tokens(call.get("name", "")) + estimate_tokens(str(call.get("args", "")))
+    return total
+
+
+def _cumulative_costs(text: str) -> np.ndarray:
+    """逐字符 token 代价的前缀和（CJK 字符 1，其余 0.25）"""
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    cjk = np.zeros(len(codes), dtype=bool)
+    for low, high in _CJK_RANGES:
+        cjk |= (codes >= low) & (codes <= high)
+    return np.cumsum(np.where(cjk, 1.0, 0.25))
+
+
+def _break_point(text: str, start: int, end: int) -> int:
+    """在 [start, end) 的后半段中找换行（其次是空白）作为断点，找不到时在 end 处断开"""
+    if end >= len(text):
+        return len(text)
+    middle = start + (end - start) // 2
+    for separator in ("\n", " "):
+        index = text.rfind(separator, middle, end)
+        if index > start:
+            return index + 1
+    return end
+
+
+def truncate_tokens(text: str, max_tokens: int, suffix: str = "…") -> str:
+    """
+    按 token 预算截断文本
+
+    Args:
+        text: 文本
+        max_tokens: token 预算
+        suffix: 截断后追加的后缀
+
+    Returns:
+        不超过预算的文本（未超出时原样返回）
+    """
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    end = int(np.searchsorted(_cumulative_costs(text), max_tokens, side="right"))
+    return text[:_break_point(text, 0, end)].rstrip() + suffix
+
+
+def split_tokens(text: str, chunk_tokens: int) -> List[str]:
+    """
+    按 token 数将文本切分为若干块，优先在换行处断开
+
+    Args:
+        text: 文本
+        chunk_tokens: 每块的 token 数
+
+    Returns:
+        分块列表
+    """
+    if not text:
+        return []
+    if chunk_tokens <= 0 or estimate_tokens(text) <= chunk_tokens:
+        return [text]
+
+    costs = _cumulative_costs(text)
+    chunks = []
+    start = 0
+    while start < len(text):
+        base = costs[start - 1] if start else 0.0
+        end = max(int(np.searchsorted(costs, base + chunk_tokens, side="right")), start + 1)
+        end = _break_point(text, start, end)
+        chunks.append(text[start:end])
+        start = end
+    return chunks
+
+
+def _model_name(llm: Any) -> str:
+    """读取语言模型实例的模型名（兼容 with_config 包装后的实例）"""
+    llm = getattr(llm, "bound", llm)
+    return getattr(llm, "model", None) or getattr(llm, "model_name", None) or ""
+
+
+def model_budget(llm: Any, output_tokens: Optional[int] = None) -> Tuple[int, int]:
+    """
+    按模型分配输入/输出 token 预算
+
+    Args:
+        llm: 语言模型实例或模型名（CLAUDE_MODELS / OPENAI_MODELS 的键或完整模型 ID）
+        output_tokens: 输出预算（默认取模型实例的 max_tokens，其次为模型最大输出与 LLM_MAX_OUTPUT_TOKENS 的较小值）
+
+    Returns:
+        (输入预算, 输出预算)
+    """
+    name = llm if isinstance(llm, str) else _model_name(llm)
+    context_window, max_output = LLMConfig.token_limits(name)
+    if output_tokens is None and not isinstance(llm, str):
+        output_tokens = getattr(getattr(llm, "bound", llm), "max_tokens", None)
+    output_tokens = min(output_tokens or LLM_MAX_OUTPUT_TOKENS, max_output)
+    return context_window - output_tokens, output_tokens
@@ -0,0 +1,201 @@
+"""
+Tavily 工具结果缓存模块
+
+参数相同的搜索、提取和爬取直接返回缓存的 API 结果，不再消耗网络延迟和 API 额度：
+- 缓存键由工具名、工具配置和调用参数规范化后计算（空白、列表顺序以及查询的大小写不影响命中）
+- 存活时间取决于搜索主题：新闻和财经较短，通用较长
+- 内存层按条目数和字节数限制容量，可选磁盘层（进程重启后仍然有效）
+- 工具以 content_and_artifact 格式返回，artifact 中的 cached 标记本次调用是否命中缓存
+- 缓存未命中时，使用同一 API 密钥的并发相同调用合并为一次 API 请求（见 backend/singleflight.py）；
+  不同密钥的调用各自请求，一个密钥的错误（如密钥无效、额度用尽）不会传给其他用户
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, ClassVar, Dict, Optional, Tuple
+
+from backend.cache import TieredCache
+from backend.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# 工具结果缓存的内存层条目数（0 表示关闭工具结果缓存）
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "256"))
+# 工具结果缓存的内存层最大字节数
+TOOL_CACHE_MAX_BYTES = int(os.getenv("TOOL_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# 新闻、财经主题结果的存活时间（秒）
+TOOL_CACHE_TTL_NEWS = float(os.getenv("TOOL_CACHE_TTL_NEWS", "600"))
+# 通用主题结果的存活时间（秒）
+TOOL_CACHE_TTL_GENERAL = float(os.getenv("TOOL_CACHE_TTL_GENERAL", "21600"))
+# 工具结果缓存的磁盘层数据库路径（为空时只使用内存层）
+TOOL_CACHE_DB_PATH = os.getenv("TOOL_CACHE_DB_PATH", "")
+# 工具结果缓存的磁盘层条目数
+TOOL_CACHE_DISK_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_DISK_MAX_ENTRIES", "5000"))
+
+_tool_cache: Optional[TieredCache] = None
+_tool_cache_lock = threading.Lock()
+
+# 进行中的 Tavily 调用（按缓存键和 API 密钥合并，缓存关闭时同样生效）
+_tool_flight = SingleFlight("tool_cache.singleflight")
+
+
+def get_tool_cache() -> Optional[TieredCache]:
+    """获取进程内共享的工具结果缓存（所有用户和线程共用；关闭时返回 None）"""
+    global _tool_cache
+    if TOOL_CACHE_MAX_ENTRIES <= 0:
+        return None
+    with _tool_cache_lock:
+        if _tool_cache is None:
+            _tool_cache = TieredCache(
+                "tool_cache",
+                max_entries=TOOL_CACHE_MAX_ENTRIES,
+                max_bytes=TOOL_CACHE_MAX_BYTES,
+                ttl=TOOL_CACHE_TTL_GENERAL,
+                disk_path=TOOL_CACHE_DB_PATH or None,
+                disk_max_entries=TOOL_CACHE_DISK_MAX_ENTRIES,
+            )
+    return _tool_cache
+
+
+def tool_cache_ttl(topic: Optional[str]) -> float:
+    """
+    按搜索主题返回缓存存活时间
+
+    Args:
+        topic: 搜索主题（general、news 或 finance）
+
+    Returns:
+        存活时间（秒）
+    """
+    return TOOL_CACHE_TTL_NEWS if topic in ("news", "finance") else TOOL_CACHE_TTL_GENERAL
+
+
+def _normalize(value: Any) -> Any:
+    """规范化参数值：字符串去掉首尾空白并合并空白，列表排序，丢弃空值"""
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, (list, tuple, set)):
+        return sorted(
+            (_normalize(item) for item in value),
+            key=lambda item: json.dumps(item, sort_keys=True, ensure_ascii=False, default=str)
+        )
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items() if item is not None}
+    return value
+
+
+def tool_cache_key(tool_name: str, config: Dict[str, Any], args: Tuple, kwargs: Dict[str, Any]) -> str:
+    """
+    计算工具调用的缓存键（搜索查询不区分大小写，URL 等其他参数保留大小写）
+
+    Args:
+        tool_name: 工具名称
+        config: 影响结果的工具配置
+        args: 位置参数
+        kwargs: 调用参数
+
+    Returns:
+        缓存键（十六进制哈希）
+    """
+    payload = {
+        "tool": tool_name,
+        "config": _normalize(config),
+        "args": [_normalize(arg) for arg in args],
+        "kwargs": _normalize(kwargs),
+    }
+    if isinstance(payload["kwargs"].get("query"), str):
+        payload["kwargs"]["query"] = payload["kwargs"]["query"].lower()
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def _cacheable_size(result: Any) -> Optional[int]:
+    """返回可缓存结果的字节数；出错或无法序列化的结果返回 None"""
+    if not isinstance(result, dict) or "error" in result:
+        return None
+    try:
+        return len(json.dumps(result, ensure_ascii=False).encode("utf-8"))
+    except (TypeError, ValueError):
+        return None
+
+
+class CachedToolMixin:
+    """
+    为 Tavily 工具添加结果缓存
+
+    需放在 Tavily 工具类之前继承；子类声明 cache_fields（影响结果的工具配置字段）
+    和 cache_ttl 字段，并在 _run/_arun 中调用 _fetch/_afetch 代替父类的 _run/_arun。
+    """
+    cache_fields: ClassVar[Tuple[str, ...]] = ()
+
+    def _cache_key(self, args: Tuple, kwargs: Dict[str, Any]) -> str:
+        """计算本次调用的缓存键"""
+        config = {field: getattr(self, field, None) for field in self.cache_fields}
+        return tool_cache_key(self.name, config, args, kwargs)
+
+    def _flight_key(self, key: str) -> Tuple[str, str]:
+        """请求合并键：缓存键加 API 密钥的哈希（只合并使用同一密钥的调用）"""
+        api_key = getattr(getattr(self, "api_wrapper", None), "tavily_api_key", None)
+        secret = api_key.get_secret_value() if hasattr(api_key, "get_secret_value") else str(api_key or "")
+        return key, hashlib.sha256(secret.encode("utf-8")).hexdigest()
+
+    def _cache_store(self, cache: TieredCache, key: str, result: Any):
+        """写入缓存（出错的结果不缓存）"""
+        size = _cacheable_size(result)
+        if size is not None:
+            cache.put(key, result, size=size, ttl=self.cache_ttl)
+
+    def _fetch(self, *args, **kwargs) -> Tuple[Any, bool]:
+        """
+        同步调用 Tavily API，优先返回缓存结果；使用同一密钥的并发相同调用只请求一次
+
+        Returns:
+            (API 结果, 是否命中缓存)
+        """
+        cache = get_tool_cache()
+        key = self._cache_key(args, kwargs)
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                logger.info(f"工具结果缓存命中: {self.name}")
+                return cached, True
+
+        run = super()._run
+
+        def call() -> Any:
+            result = run(*args, **kwargs)
+            if cache is not None:
+                self._cache_store(cache, key, result)
+            return result
+
+        result, _ = _tool_flight.do_sync(self._flight_key(key), call)
+        return result, False
+
+    async def _afetch(self, *args, **kwargs) -> Tuple[Any, bool]:
+        """
+        异步调用 Tavily API，优先返回缓存结果；使用同一密钥的并发相同调用只请求一次
+
+        Returns:
+            (API 结果, 是否命中缓存)
+        """
+        cache = get_tool_cache()
+        key = self._cache_key(args, kwargs)
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                logger.info(f"工具结果缓存命中: {self.name}")
+                return cached, True
+
+        arun = super()._arun
+
+        async def call() -> Any:
+            result = await arun(*args, **kwargs)
+            if cache is not None:
+                self._cache_store(cache, key, result)
+            return result
+
+        result, _ = await _tool_flight.do(self._flight_key(key), call)
+        return result, False
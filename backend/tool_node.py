@@ -0,0 +1,211 @@
+"""
+并发工具执行模块
+
+模型在一步中发出多个工具调用（如一次搜索加两次提取）时并发执行：
+- 每个请求的工具并发数有上限（默认 TOOL_MAX_CONCURRENCY，可通过 configurable.max_tool_concurrency 覆盖）
+- 每个工具有独立的超时时间，超时的调用返回错误消息，模型可以据此换一种方式继续
+- 记录每一步的耗时，以及相对串行执行节省的时间（各调用耗时之和减去实际耗时）
+- 超出请求级预算（时间、步数、调用次数，见 backend/run_budget.py）的调用不执行，返回错误消息
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from langchain_core.messages import AIMessage, AnyMessage, ToolCall, ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables.config import ensure_config, get_config_list, get_executor_for_config
+from langchain_core.tools import BaseTool
+from langgraph.prebuilt import ToolNode
+from pydantic import BaseModel
+
+from backend.metrics import get_metrics
+from backend.run_budget import budget_refusals, remaining_seconds
+
+logger = logging.getLogger(__name__)
+
+# 单个请求中同时执行的工具调用数上限
+TOOL_MAX_CONCURRENCY = int(os.getenv("TOOL_MAX_CONCURRENCY", "4"))
+# 各工具的超时时间（秒，提取和爬取包含摘要耗时；0 表示不限制）
+TOOL_TIMEOUT_SEARCH = float(os.getenv("TOOL_TIMEOUT_SEARCH", "30"))
+TOOL_TIMEOUT_EXTRACT = float(os.getenv("TOOL_TIMEOUT_EXTRACT", "90"))
+TOOL_TIMEOUT_CRAWL = float(os.getenv("TOOL_TIMEOUT_CRAWL", "150"))
+
+DEFAULT_TOOL_TIMEOUTS = {
+    "tavily_search": TOOL_TIMEOUT_SEARCH,
+    "tavily_extract": TOOL_TIMEOUT_EXTRACT,
+    "tavily_crawl": TOOL_TIMEOUT_CRAWL,
+}
+
+
+class ConcurrentToolNode(ToolNode):
+    """
+    限制并发数并带超时的 ToolNode
+
+    只通过 ToolNode 的公开接口扩展：invoke/ainvoke 取出本步的工具调用后，把每个调用单独交给
+    ToolNode.invoke/ainvoke 执行（工具查找、参数校验和错误处理仍由 ToolNode 负责），
+    在外层施加并发上限、超时和请求预算。工具应返回普通输出，不支持返回 Command。
+
+    异步执行时（/stream_agent 使用 astream_events）按信号量限制并发、按工具超时；
+    同步执行时通过 max_concurrency 限制线程池大小，线程无法中断，因此不应用超时。
+    """
+
+    def __init__(
+        self,
+        tools: Sequence[BaseTool],
+        *,
+        max_concurrency: int = TOOL_MAX_CONCURRENCY,
+        timeouts: Optional[Dict[str, float]] = None,
+        **kwargs: Any,
+    ):
+        """
+        初始化工具节点
+
+        Args:
+            tools: 工具列表
+            max_concurrency: 同时执行的工具调用数上限
+            timeouts: 工具名 -> 超时时间（秒），默认使用 DEFAULT_TOOL_TIMEOUTS
+            **kwargs: 传给 ToolNode 的其他参数
+        """
+        super().__init__(tools, **kwargs)
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeouts = DEFAULT_TOOL_TIMEOUTS if timeouts is None else timeouts
+        self.metrics = get_metrics()
+
+    def _concurrency_limit(self, config: RunnableConfig) -> int:
+        """本次请求的并发上限（运行配置中的 max_tool_concurrency 优先）"""
+        limit = (config or {}).get("configurable", {}).get("max_tool_concurrency")
+        return max(1, int(limit)) if limit else self.max_concurrency
+
+    def _record_step(self, durations: List[float], elapsed: float):
+        """记录一步的耗时与并发节省的时间"""
+        saved = max(0.0, sum(durations) - elapsed)
+        self.metrics.observe("tools.calls_per_step", len(durations))
+        self.metrics.observe("tools.step_seconds", elapsed)
+        self.metrics.observe("tools.parallel_saved_seconds", saved)
+        if len(durations) > 1:
+            logger.info(f"并发执行 {len(durations)} 个工具调用，耗时 {elapsed:.2f} 秒，节省 {saved:.2f} 秒")
+
+    def _timeout_message(self, call: ToolCall, timeout: float) -> ToolMessage:
+        """超时调用返回给模型的错误消息"""
+        self.metrics.incr("tools.timeouts")
+        logger.warning(f"工具调用超时: {call['name']}（{timeout:g} 秒）")
+        return ToolMessage(
+            content=f"工具调用超时（{timeout:g} 秒），请调整参数或换用其他工具后继续",
+            name=call["name"],
+            tool_call_id=call["id"],
+            status="error",
+        )
+
+    def _refusal_message(self, call: ToolCall, reason: str) -> ToolMessage:
+        """超出请求预算的调用返回给模型的错误消息"""
+        self.metrics.incr("tools.budget_refusals")
+        logger.warning(f"工具调用超出请求预算: {call['name']}（{reason}）")
+        return ToolMessage(
+            content=f"{reason}，不再执行工具调用，请根据已有信息直接给出最终答案",
+            name=call["name"],
+            tool_call_id=call["id"],
+            status="error",
+        )
+
+    def _state_messages(self, input: Union[List[AnyMessage], Dict[str, Any], BaseModel]) -> List[AnyMessage]:
+        """图状态中的消息（直接传入工具调用列表时为空）"""
+        if isinstance(input, list):
+            return [] if self._is_tool_call_list(input) else input
+        if isinstance(input, dict):
+            return input.get(self.messages_key, [])
+        return getattr(input, self.messages_key, [])
+
+    @staticmethod
+    def _is_tool_call_list(input: Any) -> bool:
+        """输入是否为直接传入的工具调用列表"""
+        return isinstance(input, list) and bool(input) and isinstance(input[-1], dict) and input[-1].get("type") == "tool_call"
+
+    def _tool_calls(self, input: Union[List[AnyMessage], Dict[str, Any], BaseModel]) -> List[ToolCall]:
+        """本步要执行的工具调用：直接传入的工具调用列表，或最后一条 AIMessage 中的调用"""
+        if self._is_tool_call_list(input):
+            return input
+        ai_message = next((m for m in reversed(self._state_messages(input)) if isinstance(m, AIMessage)), None)
+        if ai_message is None:
+            raise ValueError("输入中没有 AIMessage")
+        # 图未配置 store，注入的只有 InjectedState 参数
+        return [self.inject_tool_args(call, input, None) for call in ai_message.tool_calls]
+
+    def _messages(self, output: Union[List[Any], Dict[str, Any]]) -> List[Any]:
+        """单个调用的 ToolNode 输出中的消息（工具调用列表输入时 ToolNode 返回状态更新）"""
+        return output[self.messages_key] if isinstance(output, dict) else output
+
+    def _combine(self, outputs: List[List[Any]], input: Any) -> Any:
+        """按输入形式合并各调用的输出（与 ToolNode 一致：列表输入返回列表，其余返回状态更新）"""
+        messages = [message for output in outputs for message in output]
+        return messages if isinstance(input, list) else {self.messages_key: messages}
+
+    def invoke(
+        self,
+        input: Union[List[AnyMessage], Dict[str, Any], BaseModel],
+        config: Optional[RunnableConfig] = None,
+        **kwargs: Any,
+    ) -> Any:
+        config = ensure_config(config)
+        tool_calls = self._tool_calls(input)
+        refusals = budget_refusals(tool_calls, self._state_messages(input), config)
+        config_list = get_config_list(config, len(tool_calls))
+        durations: List[float] = []
+
+        def run(call: ToolCall, call_config: RunnableConfig) -> List[Any]:
+            if call["id"] in refusals:
+                return [self._refusal_message(call, refusals[call["id"]])]
+            started = time.perf_counter()
+            try:
+                # 每个调用单独交给 ToolNode 执行（错误处理等行为与 ToolNode 相同）
+                return self._messages(ToolNode.invoke(self, [call], call_config, **kwargs))
+            finally:
+                durations.append(time.perf_counter() - started)
+
+        start = time.perf_counter()
+        executor_config = {**config, "max_concurrency": self._concurrency_limit(config)}
+        with get_executor_for_config(executor_config) as executor:
+            outputs = list(executor.map(run, tool_calls, config_list))
+        self._record_step(durations, time.perf_counter() - start)
+        return self._combine(outputs, input)
+
+    async def ainvoke(
+        self,
+        input: Union[List[AnyMessage], Dict[str, Any], BaseModel],
+        config: Optional[RunnableConfig] = None,
+        **kwargs: Any,
+    ) -> Any:
+        config = ensure_config(config)
+        tool_calls = self._tool_calls(input)
+        refusals = budget_refusals(tool_calls, self._state_messages(input), config)
+        semaphore = asyncio.Semaphore(self._concurrency_limit(config))
+        durations: List[float] = []
+
+        async def run(call: ToolCall) -> List[Any]:
+            if call["id"] in refusals:
+                return [self._refusal_message(call, refusals[call["id"]])]
+            async with semaphore:
+                started = time.perf_counter()
+                # 超时时间不超过请求的剩余时间（为最终答案预留的时间除外）
+                timeout = self.timeouts.get(call["name"], 0)
+                remaining = remaining_seconds(config)
+                if remaining is not None:
+                    timeout = min(timeout, remaining) if timeout > 0 else remaining
+                try:
+                    if timeout > 0:
+                        output = await asyncio.wait_for(ToolNode.ainvoke(self, [call], config, **kwargs), timeout)
+                        return self._messages(output)
+                    if remaining is not None:
+                        return [self._refusal_message(call, "本次请求的剩余时间不足")]
+                    return self._messages(await ToolNode.ainvoke(self, [call], config, **kwargs))
+                except asyncio.TimeoutError:
+                    return [self._timeout_message(call, timeout)]
+                finally:
+                    durations.append(time.perf_counter() - started)
+
+        start = time.perf_counter()
+        outputs = await asyncio.gather(*(run(call) for call in tool_calls))
+        self._record_step(durations, time.perf_counter() - start)
+        return self._combine(list(outputs), input)
@@ -371,10 +371,17 @@ def stream_agent_response(user_input: str, config: Dict) -> tuple:
                             "tool_name": event["tool_name"],
                             "tool_type": event["tool_type"],
                             "operation_index": event["operation_index"],
-                            "content": event["content"]
+                            "content": event["content"],
+                            "cached": event.get("cached", False),
+                            "status": event.get("status", "success")
                         })
                         yield None, tool_calls[-1]
 
+                    elif event["type"] == "deadline_exceeded":
+                        # 超出请求的运行预算（时间或步数），答案可能不完整
+                        reason = "时间上限" if event.get("reason") == "deadline" else "最大步数"
+                        st.warning(f"⏱️ 已达到本次请求的{reason}，答案可能不完整")
+
                     elif event["type"] == "error":
                         # 错误事件
                         st.error(f"❌ {event['content']}")
@@ -449,7 +456,9 @@ def render_tool_call(tool_event: Dict):
 
     elif tool_event["type"] == "end":
         # 工具调用完成
-        with st.expander(f"{icon} {friendly_name} - 操作 #{operation_index + 1} 已完成", expanded=False):
+        cached_label = "（缓存）" if tool_event.get("cached") else ""
+        status_label = "失败" if tool_event.get("status") == "error" else "已完成"
+        with st.expander(f"{icon} {friendly_name} - 操作 #{operation_index + 1} {status_label}{cached_label}", expanded=False):
             st.markdown(f"**🎯 任务**: {description}")
 
             content = tool_event.get('content', {})
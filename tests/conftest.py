@@ -0,0 +1,46 @@
+"""
+测试公共配置
+
+在导入后端模块之前把数据库路径指向临时目录，测试不会写入 data/ 下的真实数据。
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+_TMP_DIR = Path(tempfile.mkdtemp(prefix="chatbot-tests-"))
+os.environ.setdefault("SESSION_DB_PATH", str(_TMP_DIR / "sessions.db"))
+os.environ.setdefault("SESSION_SEARCH_DB_PATH", str(_TMP_DIR / "search.db"))
+os.environ.setdefault("TOOL_CACHE_DB_PATH", "")
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend.session_storage import JSONFileStorage, SQLiteStorage  # noqa: E402
+
+
+@pytest.fixture
+def json_storage(tmp_path):
+    """临时目录中的 JSON 文件存储"""
+    return JSONFileStorage(tmp_path / "sessions")
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path):
+    """临时目录中的 SQLite 存储"""
+    storage = SQLiteStorage(tmp_path / "sessions.db")
+    yield storage
+    storage.close()
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def storage(request, tmp_path):
+    """两种存储后端各运行一次"""
+    if request.param == "json":
+        yield JSONFileStorage(tmp_path / "sessions")
+    else:
+        storage = SQLiteStorage(tmp_path / "sessions.db")
+        yield storage
+        storage.close()
@@ -0,0 +1,58 @@
+"""智能体图缓存测试"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from backend.agent import WebAgent
+
+
+def test_concurrent_misses_build_once_off_the_event_loop():
+    agent = WebAgent()
+    loop_thread = threading.get_ident()
+    builds = []
+
+    def build():
+        builds.append(threading.get_ident())
+        time.sleep(0.2)
+        return object()
+
+    async def run():
+        # 构建在线程中执行时，事件循环仍能调度其他协程
+        ticks = []
+
+        async def ticker():
+            for _ in range(5):
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.02)
+
+        results = await asyncio.gather(
+            *(agent.get_or_build_graph(("key",), build) for _ in range(5)), ticker()
+        )
+        return results[:5], ticks
+
+    graphs, ticks = asyncio.run(run())
+
+    assert len(builds) == 1 and builds[0] != loop_thread
+    assert len({id(graph) for graph in graphs}) == 1
+    assert ticks[-1] - ticks[0] < 0.2
+    assert asyncio.run(agent.get_or_build_graph(("key",), build)) is graphs[0]
+    assert len(builds) == 1
+
+
+def test_failed_build_is_not_cached():
+    agent = WebAgent()
+    attempts = []
+
+    def build():
+        attempts.append(True)
+        if len(attempts) == 1:
+            raise ValueError("密钥无效")
+        return object()
+
+    with pytest.raises(ValueError):
+        asyncio.run(agent.get_or_build_graph(("key",), build))
+    assert asyncio.run(agent.get_or_build_graph(("key",), build)) is not None
+    assert len(attempts) == 2
@@ -0,0 +1,41 @@
+"""缓存测试"""
+
+import time
+
+from backend.cache import DiskCache, TieredCache
+
+
+def test_disk_get_returns_expiry(tmp_path):
+    disk = DiskCache("test_disk", tmp_path / "cache.db", ttl=60)
+    disk.put("a", {"value": 1})
+    disk.put("forever", "x", ttl=0)
+
+    value, expires_at = disk.get("a")
+    assert value == {"value": 1}
+    assert 59 < expires_at - time.time() <= 60
+    assert disk.get("forever") == ("x", None)
+    assert disk.get("missing") == (None, None)
+
+
+def test_promoted_entry_keeps_remaining_ttl(tmp_path):
+    path = tmp_path / "cache.db"
+    TieredCache("test_tiered_writer", ttl=0.3, disk_path=path).put("k", "v")
+
+    # 新实例的内存层为空，默认 ttl 远大于磁盘条目的剩余存活时间
+    cache = TieredCache("test_tiered_reader", ttl=3600, disk_path=path)
+    assert cache.get("k") == "v"
+    assert cache.memory.stats()["entries"] == 1
+
+    time.sleep(0.4)
+    assert cache.memory.get("k") is None
+    assert cache.get("k") is None
+
+
+def test_expired_disk_entry_is_not_promoted(tmp_path):
+    path = tmp_path / "cache.db"
+    TieredCache("test_tiered_writer", ttl=0.05, disk_path=path).put("k", "v")
+    time.sleep(0.1)
+
+    cache = TieredCache("test_tiered_reader", ttl=3600, disk_path=path)
+    assert cache.get("k") is None
+    assert cache.memory.stats()["entries"] == 0
@@ -0,0 +1,124 @@
+"""检查点存储测试"""
+
+import asyncio
+import operator
+from typing import Annotated, List, TypedDict
+
+from langgraph.graph import END, START, StateGraph
+
+from backend.checkpointer import BoundedMemorySaver
+
+
+class _State(TypedDict):
+    items: Annotated[List[str], operator.add]
+
+
+def _graph(checkpointer, payload: str):
+    builder = StateGraph(_State)
+    builder.add_node("step", lambda state: {"items": [payload]})
+    builder.add_edge(START, "step")
+    builder.add_edge("step", END)
+    return builder.compile(checkpointer=checkpointer)
+
+
+def _config(thread_id: str):
+    return {"configurable": {"thread_id": thread_id}}
+
+
+def _total_bytes(saver: BoundedMemorySaver) -> int:
+    total = 0
+    for thread_id in list(saver._thread_bytes):
+        saver._measure(thread_id)
+        total += saver._thread_bytes[thread_id]
+    return total
+
+
+def test_keeps_only_recent_checkpoints_per_thread():
+    saver = BoundedMemorySaver(max_threads=10, keep_per_thread=2, max_bytes=10 ** 9)
+    graph = _graph(saver, "x")
+    for _ in range(5):
+        graph.invoke({"items": []}, _config("t1"))
+
+    assert len(saver.storage["t1"][""]) == 2
+    assert len(graph.get_state(_config("t1")).values["items"]) == 5
+    # 只保留仍被引用的通道数据
+    live = set()
+    for saved, _, _ in saver.storage["t1"][""].values():
+        live.update(saver.serde.loads_typed(saved)["channel_versions"].items())
+    assert all((key[2], key[3]) in live for key in saver.blobs if key[0] == "t1")
+
+
+def test_evicts_least_recently_used_threads_by_count():
+    saver = BoundedMemorySaver(max_threads=2, max_bytes=10 ** 9)
+    graph = _graph(saver, "x")
+    for thread_id in ("t1", "t2"):
+        graph.invoke({"items": []}, _config(thread_id))
+    graph.get_state(_config("t1"))  # t1 变为最近使用
+    graph.invoke({"items": []}, _config("t3"))
+
+    assert set(saver._recent) == {"t1", "t3"}
+    assert graph.get_state(_config("t2")).values == {}
+
+
+def test_byte_budget_bounds_memory_for_long_threads():
+    payload = "x" * 20000
+    saver = BoundedMemorySaver(max_threads=100, max_bytes=200000)
+    graph = _graph(saver, payload)
+    for turn in range(3):
+        for thread_id in ("t1", "t2", "t3", "t4", "t5"):
+            graph.invoke({"items": []}, _config(thread_id))
+
+    assert saver._bytes == _total_bytes(saver)
+    assert saver._bytes <= 200000
+    assert "t5" in saver._recent
+    assert "t1" not in saver._recent
+    assert saver.metrics.snapshot()["counters"]["checkpointer.evictions"] > 0
+
+    saver.delete_thread("t5")
+    assert saver._bytes == _total_bytes(saver)
+
+
+def test_current_thread_is_never_evicted():
+    saver = BoundedMemorySaver(max_threads=100, max_bytes=1000)
+    graph = _graph(saver, "y" * 5000)
+    graph.invoke({"items": []}, _config("t1"))
+    graph.invoke({"items": []}, _config("t2"))
+
+    assert list(saver._recent) == ["t2"]
+    assert graph.get_state(_config("t2")).values["items"] == ["y" * 5000]
+
+
+def test_rehydrate_messages_keeps_recent_user_and_assistant_turns():
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    from backend.checkpointer import rehydrate_messages
+
+    session_messages = [
+        {"role": "user", "content": "第一个问题"},
+        {"role": "assistant", "content": "第一个回答", "tool_calls": [{"name": "search"}]},
+        {"role": "assistant", "content": ""},
+        {"role": "user", "content": "第二个问题"},
+        {"role": "assistant", "content": "第二个回答"},
+    ]
+
+    messages = rehydrate_messages(session_messages, max_messages=4)
+    assert [type(message) for message in messages] == [AIMessage, HumanMessage, AIMessage]
+    assert [message.content for message in messages] == ["第一个回答", "第二个问题", "第二个回答"]
+    assert not messages[0].tool_calls
+    assert rehydrate_messages(session_messages, max_messages=0) == []
+
+
+def test_has_thread_state_after_eviction():
+    from backend.checkpointer import has_thread_state
+
+    saver = BoundedMemorySaver(max_threads=1, max_bytes=10 ** 9)
+    graph = _graph(saver, "x")
+    graph.invoke({"items": []}, _config("t1"))
+
+    async def check(thread_id):
+        return await has_thread_state(saver, thread_id)
+
+    assert asyncio.run(check("t1"))
+    graph.invoke({"items": []}, _config("t2"))
+    assert not asyncio.run(check("t1"))
+    assert not asyncio.run(has_thread_state(None, "t2"))
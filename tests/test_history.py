@@ -0,0 +1,52 @@
+"""对话历史压缩测试"""
+
+import asyncio
+import time
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+
+from backend.history import SUMMARY_PREFIX, create_history_compactor
+
+
+class SlowChatModel(FakeListChatModel):
+    """异步调用前先等待的假模型"""
+
+    async def _agenerate(self, *args, **kwargs):
+        await asyncio.sleep(5)
+        return await super()._agenerate(*args, **kwargs)
+
+
+def _state(turns: int):
+    messages = []
+    for index in range(turns):
+        messages.append(HumanMessage(content=f"问题 {index} " + "内容 " * 50))
+        messages.append(AIMessage(content=f"回答 {index} " + "内容 " * 50))
+    return {"messages": messages}
+
+
+def test_summary_replaces_older_turns():
+    compactor = create_history_compactor(
+        FakeListChatModel(responses=["早期摘要"]), keep_turns=1, token_budget=50, summary_timeout=5
+    )
+    result = asyncio.run(compactor.ainvoke(_state(4)))
+
+    assert result["history_summary"] == "早期摘要"
+    assert result["summarized_count"] == 6
+    assert result["llm_input_messages"][0].content == SUMMARY_PREFIX + "早期摘要"
+    assert len(result["llm_input_messages"]) == 3
+
+
+def test_slow_summary_falls_back_to_truncated_history():
+    state = _state(4)
+    compactor = create_history_compactor(
+        SlowChatModel(responses=["早期摘要"]), keep_turns=1, token_budget=50, summary_timeout=0.1
+    )
+
+    started = time.monotonic()
+    result = asyncio.run(compactor.ainvoke(state))
+
+    assert time.monotonic() - started < 2
+    assert "history_summary" not in result
+    assert "summarized_count" not in result
+    assert [m.content for m in result["llm_input_messages"]] == [m.content for m in state["messages"]]
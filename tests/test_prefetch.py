@@ -0,0 +1,93 @@
+"""推测性搜索预取测试"""
+
+import asyncio
+
+from backend.agent import CachedTavilySearch
+from backend.metrics import get_metrics
+from backend.prefetch import SearchPrefetch
+
+
+def _search_tool(monkeypatch, delay: float = 0.05, fail: bool = False):
+    tool = CachedTavilySearch(tavily_api_key="tvly-test")
+    calls = []
+
+    async def afetch(*args, **kwargs):
+        calls.append(kwargs)
+        await asyncio.sleep(delay)
+        if fail and len(calls) == 1:
+            raise RuntimeError("预取失败")
+        return {"query": kwargs["query"], "results": []}, False
+
+    monkeypatch.setattr(tool, "_afetch", afetch)
+    return tool, calls
+
+
+def _config(prefetch):
+    return {"configurable": {"search_prefetch": prefetch}}
+
+
+def _counter(name: str) -> float:
+    return get_metrics().snapshot()["counters"].get(name, 0)
+
+
+def test_matching_search_uses_the_prefetched_result(monkeypatch):
+    tool, calls = _search_tool(monkeypatch)
+
+    async def run():
+        prefetch = SearchPrefetch(tool, "latest python asyncio tutorial")
+        result = await tool._arun(query="Python asyncio tutorial latest", config=_config(prefetch))
+        # 预取只能使用一次，之后的搜索照常请求
+        again = await tool._arun(query="Python asyncio tutorial latest", config=_config(prefetch))
+        return result, again
+
+    (result, artifact), (_, again_artifact) = asyncio.run(run())
+    assert result["query"] == "latest python asyncio tutorial"
+    assert artifact == {"cached": False, "prefetched": True}
+    assert "prefetched" not in again_artifact
+    assert len(calls) == 2
+
+
+def test_different_query_or_options_do_not_match(monkeypatch):
+    tool, _ = _search_tool(monkeypatch)
+
+    async def run():
+        prefetch = SearchPrefetch(tool, "python asyncio tutorial")
+        checks = (
+            prefetch.matches("rust borrow checker", {}),
+            prefetch.matches("python asyncio tutorial", {"topic": "news"}),
+            prefetch.matches("python asyncio tutorial", {"topic": "general", "include_images": None}),
+        )
+        prefetch.cancel()
+        return checks
+
+    assert asyncio.run(run()) == (False, False, True)
+
+
+def test_unused_prefetch_is_cancelled(monkeypatch):
+    tool, _ = _search_tool(monkeypatch, delay=5)
+    cancelled = _counter("prefetch.cancelled")
+
+    async def run():
+        prefetch = SearchPrefetch(tool, "python asyncio tutorial")
+        await asyncio.sleep(0)
+        prefetch.cancel()
+        await asyncio.sleep(0)
+        return prefetch
+
+    prefetch = asyncio.run(run())
+    assert prefetch.task.cancelled()
+    assert not prefetch.matches("python asyncio tutorial", {})
+    assert _counter("prefetch.cancelled") == cancelled + 1
+
+
+def test_failed_prefetch_falls_back_to_a_new_search(monkeypatch):
+    tool, calls = _search_tool(monkeypatch, fail=True)
+
+    async def run():
+        prefetch = SearchPrefetch(tool, "python asyncio tutorial")
+        return await tool._arun(query="python asyncio tutorial", config=_config(prefetch))
+
+    result, artifact = asyncio.run(run())
+    assert result["query"] == "python asyncio tutorial"
+    assert artifact == {"cached": False}
+    assert len(calls) == 2
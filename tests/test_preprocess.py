@@ -0,0 +1,76 @@
+"""网页内容预处理测试"""
+
+from backend.agent import _prepare_summary
+from backend.preprocess import clean_pages, unique_url_indexes
+
+BODY = "Transformers process tokens in parallel using attention over the whole sequence."
+
+
+def _clean(*contents: str, query: str = "") -> list:
+    pages = [(f"https://example.com/{index}", content) for index, content in enumerate(contents)]
+    cleaned, _ = clean_pages(pages, dup_threshold=1.1, query=query)
+    return [text.splitlines() for _, text in cleaned]
+
+
+def test_only_mostly_boilerplate_lines_are_removed():
+    lines = _clean("\n".join([
+        BODY,
+        "© 2024 Example Corp. All rights reserved.",
+        "Read our [Privacy Policy](https://example.com/privacy)",
+        "Sign in",
+        "Browsers store a cookie so the server can recognise a returning visitor across requests.",
+        "See the copyright section of the license for the redistribution terms of the dataset.",
+        "注册会计师考试每年举行一次",
+    ]))[0]
+
+    assert lines == [
+        BODY,
+        "Browsers store a cookie so the server can recognise a returning visitor across requests.",
+        "See the copyright section of the license for the redistribution terms of the dataset.",
+        "注册会计师考试每年举行一次",
+    ]
+
+
+def test_table_separator_rows_are_kept():
+    table = "| Model | Params |\n|---|---|\n| :--- | ---: |\n| base | 110M |"
+    first, second = _clean(f"{BODY}\n{table}\n---", f"Second page body text about models.\n{table}")
+
+    assert first == [BODY, "| Model | Params |", "|---|---|", "| :--- | ---: |", "| base | 110M |"]
+    # 表格出现在多个页面时不作为页眉页脚移除
+    assert second[1:] == ["| Model | Params |", "|---|---|", "| :--- | ---: |", "| base | 110M |"]
+
+
+def test_lines_with_query_terms_are_never_dropped():
+    footer = "Accept all cookies"
+    first, second = _clean(f"{BODY}\n{footer}", f"Another page body text.\n{footer}", query="Why do sites use cookies?")
+    assert footer in first and footer in second
+
+    first, second = _clean(f"{BODY}\n{footer}", f"Another page body text.\n{footer}", query="What is attention?")
+    assert footer not in first and footer not in second
+
+
+def test_repeated_lines_are_kept_once():
+    header = "Example News — technology section"
+    first, second = _clean(f"{header}\n{BODY}", f"{header}\nAnother page body text.")
+    assert first == [header, BODY]
+    assert second == ["Another page body text."]
+
+
+def test_favicons_stay_aligned_with_deduped_urls():
+    output = {"results": [
+        {"url": "https://a.com/page?utm_source=x", "favicon": "https://a.com/a.ico", "raw_content": BODY},
+        {"url": "https://b.com/", "raw_content": "Page b body text about something else entirely."},
+        {"url": "https://A.com/page", "favicon": "https://a.com/dup.ico", "raw_content": BODY},
+        {"url": "https://c.com/", "favicon": "https://c.com/c.ico", "raw_content": "Page c is about cooking pasta at home."},
+    ]}
+
+    result, _ = _prepare_summary(output)
+
+    assert result["urls"] == ["https://a.com/page?utm_source=x", "https://b.com/", "https://c.com/"]
+    assert result["favicons"] == ["https://a.com/a.ico", None, "https://c.com/c.ico"]
+    assert unique_url_indexes([item["url"] for item in output["results"]]) == [0, 1, 3]
+
+
+def test_favicons_are_empty_without_favicon_data():
+    result, _ = _prepare_summary({"results": [{"url": "https://a.com/", "raw_content": BODY}]})
+    assert result["favicons"] == []
@@ -0,0 +1,52 @@
+"""分词与段落相关性排序测试"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+from backend.ranking import bm25_scores, select_passages
+from backend.text import tokenize
+
+
+def test_tokenize_splits_cjk_into_bigrams_and_words():
+    assert tokenize("Python 异步编程") == ["python", "异步", "步编", "编程"]
+    assert tokenize("单 GPT-4o") == ["单", "gpt", "4o"]
+
+
+def test_bm25_prefers_passages_with_rare_query_terms():
+    passages = [tokenize(text) for text in (
+        "the weather today is sunny and warm",
+        "attention lets transformers weigh every token in the sequence",
+        "the the the weather",
+    )]
+    scores = bm25_scores(passages, tokenize("transformers attention"))
+    assert scores.argmax() == 1
+    assert scores[0] == scores[2] == 0
+
+
+def test_select_passages_keeps_relevant_passages_in_order():
+    pages = [
+        "\n\n".join([
+            "Filler paragraph about gardening and tomatoes. " * 6,
+            "Attention lets transformers weigh every token. " * 6,
+            "Another filler paragraph about cooking pasta. " * 6,
+        ]),
+        "Transformers use attention heads in parallel. " * 6,
+    ]
+
+    selected = select_passages(pages, "transformers attention", token_budget=200, passage_chars=300)
+
+    assert len(selected) == 2
+    assert "Attention lets transformers" in selected[0] and "gardening" not in selected[0]
+    assert "attention heads" in selected[1]
+
+
+def test_text_helpers_do_not_touch_session_storage():
+    # 排序、预处理和预取只依赖 backend.text，导入时不再创建会话数据目录
+    code = (
+        "import sys, backend.ranking, backend.preprocess, backend.prefetch; "
+        "print('backend.session_storage' in sys.modules)"
+    )
+    root = Path(__file__).resolve().parent.parent
+    output = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == "False"
@@ -0,0 +1,56 @@
+"""请求级运行预算测试"""
+
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from backend import run_budget
+from backend.run_budget import budget_refusals, fallback_answer, run_limits
+
+
+def _calls(count: int):
+    return [{"name": "tavily_search", "args": {}, "id": f"call_{index}", "type": "tool_call"} for index in range(count)]
+
+
+def _history(steps: int, tool_messages: int):
+    messages = [HumanMessage(content="旧问题"), AIMessage(content="旧回答"), HumanMessage(content="问题")]
+    messages += [AIMessage(content="") for _ in range(steps)]
+    messages += [ToolMessage(content="结果", tool_call_id=f"t{index}") for index in range(tool_messages)]
+    return messages
+
+
+def test_request_limits_are_clamped_to_server_limits(monkeypatch):
+    monkeypatch.setattr(run_budget, "AGENT_DEADLINE_SECONDS", 100)
+    monkeypatch.setattr(run_budget, "AGENT_MAX_STEPS", 5)
+    monkeypatch.setattr(run_budget, "AGENT_ANSWER_RESERVE_SECONDS", 30)
+
+    limits = run_limits(deadline_seconds=1000, max_steps=50, max_tool_calls=None)
+    assert limits["deadline_seconds"] == 100 and limits["max_steps"] == 5
+    assert limits["max_tool_calls"] == run_budget.AGENT_MAX_TOOL_CALLS
+    # 为最终答案预留的时间不超过总时长的四分之一
+    assert abs(limits["tool_deadline"] - (time.time() + 75)) < 1
+    assert abs(run_limits(deadline_seconds=20)["tool_deadline"] - (time.time() + 15)) < 1
+
+
+def test_calls_beyond_the_budget_are_refused():
+    config = {"configurable": {"max_steps": 3, "max_tool_calls": 4}}
+
+    # 只统计本次请求（最后一条用户消息之后）的步数和调用次数
+    assert budget_refusals(_calls(2), _history(1, 2), config) == {}
+    assert list(budget_refusals(_calls(3), _history(2, 2), config)) == ["call_2"]
+    assert set(budget_refusals(_calls(2), _history(4, 0), config)) == {"call_0", "call_1"}
+
+    expired = {"configurable": {"tool_deadline": time.time() - 1}}
+    assert "剩余时间不足" in budget_refusals(_calls(1), _history(0, 0), expired)["call_0"]
+
+
+def test_fallback_answer_uses_collected_results():
+    answer = fallback_answer([
+        '{"summary": "摘要内容", "urls": ["https://a.com"]}',
+        {"results": [{"title": "标题", "url": "https://b.com"}]},
+        {"error": "失败"},
+    ], "deadline")
+
+    assert answer.startswith("已达到本次请求的时间上限")
+    assert "摘要内容" in answer and "https://a.com" in answer and "[标题](https://b.com)" in answer
+    assert "未能收集到足够的信息" in fallback_answer([], "max_steps")
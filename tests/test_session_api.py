@@ -0,0 +1,61 @@
+"""会话接口测试"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as app_module
+from backend.session_manager import SessionManager
+from backend.session_search import SearchIndex
+
+
+@pytest.fixture
+def client(storage, tmp_path, monkeypatch):
+    manager = SessionManager(storage=storage, search_index=SearchIndex(tmp_path / "search.db"))
+    manager.append_messages("s1", [{"role": "user", "content": f"message {index}"} for index in range(7)], "标题")
+    monkeypatch.setattr(app_module, "get_session_manager", lambda: manager)
+    # 不进入上下文管理器：不运行 lifespan，不创建智能体和后台任务
+    return TestClient(app_module.app)
+
+
+def _contents(page):
+    return [message["content"] for message in page["messages"]]
+
+
+def test_latest_page_by_default(client):
+    response = client.get("/api/sessions/s1/messages", params={"limit": 3})
+
+    assert response.status_code == 200
+    page = response.json()
+    assert page["session_id"] == "s1"
+    assert page["total"] == 7
+    assert _contents(page) == ["message 4", "message 5", "message 6"]
+    assert [message["seq"] for message in page["messages"]] == [4, 5, 6]
+    assert page["next_before"] == 4
+
+
+def test_paging_backwards_with_before(client):
+    page = client.get("/api/sessions/s1/messages?before=4&limit=3").json()
+    assert _contents(page) == ["message 1", "message 2", "message 3"]
+    assert page["next_before"] == 1
+
+    page = client.get("/api/sessions/s1/messages?before=1&limit=3").json()
+    assert _contents(page) == ["message 0"]
+    assert page["next_before"] is None
+
+
+def test_default_limit_and_before_past_the_end(client):
+    assert len(client.get("/api/sessions/s1/messages").json()["messages"]) == 7
+    assert len(client.get("/api/sessions/s1/messages?before=100").json()["messages"]) == 7
+    assert client.get("/api/sessions/s1/messages?before=0").json()["messages"] == []
+
+
+@pytest.mark.parametrize("query", ["limit=0", "limit=501", "limit=abc", "before=-1", "before=abc"])
+def test_invalid_query_params_are_rejected(client, query):
+    assert client.get(f"/api/sessions/s1/messages?{query}").status_code == 422
+
+
+def test_unknown_session_is_404(client):
+    response = client.get("/api/sessions/missing/messages")
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "会话不存在"
@@ -0,0 +1,116 @@
+"""会话管理器测试"""
+
+from backend.session_manager import SessionManager
+
+
+def _manager(storage):
+    return SessionManager(storage=storage, search_index=None)
+
+
+def _turn(index: int):
+    return [
+        {"role": "user", "content": f"问题 {index}"},
+        {"role": "assistant", "content": f"回答 {index}", "tool_calls": [{"name": "search"}]},
+    ]
+
+
+def test_cached_session_is_isolated_from_callers(storage):
+    manager = _manager(storage)
+    manager.append_messages("s1", _turn(0), "标题")
+    manager.get_session("s1")
+
+    # 两次读取都命中缓存：修改第一次的返回值不能影响第二次
+    first = manager.get_session("s1")
+    first["messages"][0]["content"] = "已修改"
+    first["messages"][1]["tool_calls"].append({"name": "extract"})
+    first["messages"].append({"role": "user", "content": "多出的消息"})
+    first["title"] = "已修改"
+
+    second = manager.get_session("s1")
+    assert second["title"] == "标题"
+    assert [m["content"] for m in second["messages"]] == ["问题 0", "回答 0"]
+    assert second["messages"][1]["tool_calls"] == [{"name": "search"}]
+    assert manager.cache_stats()["documents"]["hits"] >= 1
+
+
+def test_cache_is_invalidated_by_writes(storage):
+    manager = _manager(storage)
+    manager.append_messages("s1", _turn(0), "标题")
+    assert len(manager.get_session("s1")["messages"]) == 2
+
+    manager.append_messages("s1", _turn(1))
+    manager.rename_session("s1", "新标题")
+    session = manager.get_session("s1")
+    assert len(session["messages"]) == 4
+    assert session["title"] == "新标题"
+    assert manager.get_sessions_list()[0]["title"] == "新标题"
+
+
+def test_cache_detects_writes_from_another_process(storage):
+    manager = _manager(storage)
+    manager.append_messages("s1", _turn(0), "标题")
+    manager.get_session("s1")
+    manager.get_sessions_list()
+
+    # 绕过管理器直接写存储，相当于另一个进程的写入
+    storage.append_messages("s1", _turn(1), None, "2099-01-01T00:00:00")
+    assert len(manager.get_session("s1")["messages"]) == 4
+    assert manager.get_sessions_list()[0]["message_count"] == 4
+
+
+def test_session_pages_cover_every_session_once(storage):
+    import pytest
+
+    manager = _manager(storage)
+    for index in range(7):
+        storage.append_messages(f"s{index}", _turn(index), None, f"2026-01-01T00:00:0{index % 3}")
+
+    seen = []
+    cursor = None
+    while True:
+        page = manager.get_sessions_page(3, cursor)
+        seen.extend(session["session_id"] for session in page["sessions"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert sorted(seen) == [f"s{index}" for index in range(7)]
+    assert len(seen) == 7
+    keys = [(s["updated_at"], s["session_id"]) for s in manager.get_sessions_list()]
+    assert seen == [session_id for _, session_id in sorted(keys, reverse=True)]
+    with pytest.raises(ValueError):
+        manager.get_sessions_page(3, "not-a-cursor")
+
+
+def test_message_pages_walk_backwards(storage):
+    manager = _manager(storage)
+    for index in range(5):
+        manager.append_messages("s1", _turn(index), "标题")
+
+    page = manager.get_messages_page("s1", limit=4)
+    assert [m["seq"] for m in page["messages"]] == [6, 7, 8, 9]
+    assert page["total"] == 10
+    page = manager.get_messages_page("s1", before=page["next_before"], limit=4)
+    assert [m["seq"] for m in page["messages"]] == [2, 3, 4, 5]
+    page = manager.get_messages_page("s1", before=page["next_before"], limit=4)
+    assert [m["content"] for m in page["messages"]] == ["问题 0", "回答 0"]
+    assert page["next_before"] is None
+    assert manager.get_messages_page("missing") is None
+
+
+def test_archived_sessions_read_transparently_and_restore_on_write(storage):
+    manager = _manager(storage)
+    storage.append_messages("old", _turn(0) * 20, "旧会话", "2020-01-01T00:00:00")
+    manager.append_messages("new", _turn(0), "新会话")
+
+    stats = manager.archive_sessions(older_than_days=30)
+    assert stats["archived"] == 1
+    assert 0 < stats["bytes_after"] < stats["bytes_before"]
+    assert storage.archive_candidates("2030-01-01T00:00:00") == ["new"]
+
+    assert len(manager.get_session("old")["messages"]) == 40
+    assert [m["seq"] for m in manager.get_messages_page("old", limit=2)["messages"]] == [38, 39]
+
+    manager.append_messages("old", _turn(1))
+    assert len(manager.get_session("old")["messages"]) == 42
+    assert manager.archive_sessions(older_than_days=30)["archived"] == 0
@@ -0,0 +1,63 @@
+"""会话全文检索测试"""
+
+from backend.session_manager import SessionManager
+from backend.session_search import SearchIndex, highlight_snippet, tokenize
+
+
+def test_highlight_escapes_html():
+    snippet = highlight_snippet("<b>缓存</b> 命中率", tokenize("缓存"))
+    assert snippet == "&lt;b&gt;<mark>缓存</mark>&lt;/b&gt; 命中率"
+
+
+def test_search_returns_limit_sessions_when_one_session_dominates(tmp_path):
+    index = SearchIndex(tmp_path / "search.db")
+    # 一个会话有大量高分消息，其余会话各一条命中
+    index.add_messages([("busy", 0, [{"role": "user", "content": "redis redis redis"}] * 50)])
+    index.add_messages([
+        (f"s{i}", 0, [{"role": "user", "content": f"redis cache {i}"}]) for i in range(5)
+    ])
+
+    results = index.search("redis", limit=4)
+    assert len(results) == 4
+    assert len({hit["session_id"] for hit in results}) == 4
+    assert results[0]["session_id"] == "busy"
+    assert [hit["score"] for hit in results] == sorted((hit["score"] for hit in results), reverse=True)
+
+
+def test_live_session_filter_is_applied_before_limit(tmp_path):
+    index = SearchIndex(tmp_path / "search.db")
+    index.add_messages([
+        (f"s{i}", 0, [{"role": "user", "content": "redis " * (10 - i)}]) for i in range(6)
+    ])
+
+    results = index.search("redis", limit=3, session_ids=["s3", "s4", "s5"])
+    assert [hit["session_id"] for hit in results] == ["s3", "s4", "s5"]
+
+
+def test_deleted_sessions_leave_no_postings(storage, tmp_path):
+    index = SearchIndex(tmp_path / "search.db")
+    manager = SessionManager(storage=storage, search_index=index)
+    manager.append_messages("keep", [{"role": "user", "content": "向量数据库"}], "保留")
+    manager.append_messages("drop", [{"role": "user", "content": "向量数据库"}], "删除")
+
+    manager.delete_session("drop")
+    conn = index._connection()
+    assert conn.execute("SELECT COUNT(*) FROM docs WHERE session_id = 'drop'").fetchone()[0] == 0
+    assert conn.execute(
+        "SELECT COUNT(*) FROM postings WHERE doc_id NOT IN (SELECT doc_id FROM docs)"
+    ).fetchone()[0] == 0
+    assert [hit["session_id"] for hit in manager.search_sessions("向量")] == ["keep"]
+
+
+def test_stale_sessions_are_filtered_and_pruned(storage, tmp_path):
+    index = SearchIndex(tmp_path / "search.db")
+    manager = SessionManager(storage=storage, search_index=index)
+    for i in range(3):
+        manager.append_messages(f"s{i}", [{"role": "user", "content": "量化交易"}])
+    # 另一个进程删除了会话，本进程的索引没有收到通知
+    storage.delete_session("s0")
+
+    assert len(manager.search_sessions("量化", limit=2)) == 2
+    assert "s0" not in {hit["session_id"] for hit in manager.search_sessions("量化")}
+    manager.rebuild_search_index()
+    assert sorted(index.session_ids()) == ["s1", "s2"]
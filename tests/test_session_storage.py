@@ -0,0 +1,128 @@
+"""会话存储后端测试"""
+
+import json
+
+from backend import session_storage
+
+NOW = "2026-01-01T00:00:00"
+
+
+def _turn(index: int):
+    return [
+        {"role": "user", "content": f"问题 {index}"},
+        {"role": "assistant", "content": f"回答 {index}"},
+    ]
+
+
+def test_append_writes_log_without_rewriting_snapshot(json_storage):
+    json_storage.append_messages("s1", _turn(0), "标题", NOW)
+    snapshot = json_storage._session_file("s1")
+    before = snapshot.stat().st_mtime_ns
+
+    json_storage.append_messages("s1", _turn(1), None, "2026-01-01T00:01:00")
+
+    assert snapshot.stat().st_mtime_ns == before
+    log_lines = json_storage._log_file("s1").read_text(encoding="utf-8").splitlines()
+    assert len(log_lines) == 2
+    session = json_storage.load_session("s1")
+    assert [m["content"] for m in session["messages"]] == ["问题 0", "回答 0", "问题 1", "回答 1"]
+    assert session["updated_at"] == "2026-01-01T00:01:00"
+    assert json_storage.list_sessions()[0]["message_count"] == 4
+
+
+def test_log_is_compacted_into_snapshot(json_storage, monkeypatch):
+    monkeypatch.setattr(session_storage, "LOG_COMPACT_BYTES", 200)
+    for index in range(5):
+        json_storage.append_messages("s1", _turn(index), "标题", NOW)
+
+    assert not json_storage._log_file("s1").exists() or json_storage._log_file("s1").stat().st_size <= 200
+    snapshot = json.loads(json_storage._session_file("s1").read_text(encoding="utf-8"))
+    assert len(snapshot["messages"]) >= 8
+    assert len(json_storage.load_session("s1")["messages"]) == 10
+
+
+def test_torn_log_line_is_skipped(json_storage):
+    json_storage.append_messages("s1", _turn(0), "标题", NOW)
+    with open(json_storage._log_file("s1"), "a", encoding="utf-8") as f:
+        f.write('{"messages": [{"role": "user"')
+
+    assert len(json_storage.load_session("s1")["messages"]) == 2
+
+
+def test_rename_is_logged(json_storage):
+    json_storage.append_messages("s1", _turn(0), "旧标题", NOW)
+    assert json_storage.rename_session("s1", "新标题", NOW)
+    assert json_storage.load_session("s1")["title"] == "新标题"
+    assert not json_storage.rename_session("missing", "标题", NOW)
+
+
+def test_backends_share_semantics(storage):
+    storage.append_many([("s1", _turn(0), "会话一"), ("s2", _turn(0), None)], NOW)
+    storage.append_messages("s1", _turn(1), None, "2026-01-02T00:00:00")
+
+    session = storage.load_session("s1")
+    assert session["title"] == "会话一"
+    assert [m["content"] for m in session["messages"]] == ["问题 0", "回答 0", "问题 1", "回答 1"]
+    assert [s["session_id"] for s in storage.list_sessions()] == ["s1", "s2"]
+    assert storage.list_sessions()[1]["title"] == "s2"
+
+    storage.delete_session("s2")
+    assert storage.load_session("s2") is None
+    assert [s["session_id"] for s in storage.list_sessions()] == ["s1"]
+
+
+def test_sqlite_append_is_one_transaction(sqlite_storage):
+    entries = sqlite_storage.append_many([("s1", _turn(0), "标题"), ("s1", _turn(1), None)], NOW)
+    assert [entry["message_count"] for entry in entries] == [2, 4]
+    rows = sqlite_storage._connection().execute(
+        "SELECT seq FROM messages WHERE session_id = 's1' ORDER BY seq"
+    ).fetchall()
+    assert [row[0] for row in rows] == [0, 1, 2, 3]
+    assert sqlite_storage._connection().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_migrate_json_to_sqlite(json_storage, sqlite_storage):
+    json_storage.write_session({
+        "session_id": "s1", "title": "标题", "created_at": NOW, "updated_at": NOW, "messages": _turn(0)
+    })
+    json_storage.append_messages("s1", _turn(1), None, NOW)
+
+    assert session_storage.migrate_json_to_sqlite(json_storage, sqlite_storage) == 1
+    assert sqlite_storage.load_session("s1")["messages"] == json_storage.load_session("s1")["messages"]
+
+
+def test_stripe_mapping_is_stable(tmp_path):
+    first = session_storage.JSONFileStorage(tmp_path / "a", lock_stripes=8)
+    second = session_storage.JSONFileStorage(tmp_path / "b", lock_stripes=8)
+    for session_id in ("s1", "s2", "会话"):
+        index = first._session_locks.index(first._session_lock(session_id))
+        assert second._session_locks.index(second._session_lock(session_id)) == index
+
+
+def test_other_stripes_are_not_blocked(json_storage):
+    import threading
+
+    busy = json_storage._session_lock("s1")
+    other = next(
+        session_id for session_id in (f"s{i}" for i in range(2, 100))
+        if json_storage._session_lock(session_id) is not busy
+    )
+    done = threading.Event()
+    with busy:
+        thread = threading.Thread(target=lambda: (json_storage.append_messages(other, _turn(0), None, NOW), done.set()))
+        thread.start()
+        assert done.wait(5)
+    thread.join()
+
+
+def test_concurrent_appends_keep_every_turn(json_storage):
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(
+            lambda i: json_storage.append_messages(f"s{i % 4}", _turn(i), None, NOW), range(40)
+        ))
+
+    for session in json_storage.list_sessions():
+        assert session["message_count"] == 20
+        assert len(json_storage.load_session(session["session_id"])["messages"]) == 20
@@ -0,0 +1,149 @@
+"""会话后台写入测试"""
+
+import asyncio
+
+import pytest
+
+from backend.session_manager import SessionManager
+from backend.session_search import SearchIndex
+from backend.session_writer import SessionWriter
+
+
+def _turn(session_id: str, index: int):
+    return [
+        {"role": "user", "content": f"{session_id} question {index}"},
+        {"role": "assistant", "content": f"{session_id} answer {index}"},
+    ]
+
+
+@pytest.fixture
+def manager(storage, tmp_path):
+    return SessionManager(storage=storage, search_index=SearchIndex(tmp_path / "search.db"))
+
+
+def _writer(manager):
+    return SessionWriter(manager, retries=2, retry_backoff=0)
+
+
+def _contents(manager, session_id):
+    session = manager.get_session(session_id)
+    return [message["content"] for message in session["messages"]] if session else []
+
+
+def test_submitted_turns_are_flushed_on_stop(manager):
+    writer = _writer(manager)
+    writer.start()
+
+    async def submit():
+        for index in range(3):
+            await writer.submit("s1", _turn("s1", index), "标题")
+            await writer.submit("s2", _turn("s2", index))
+
+    asyncio.run(submit())
+    writer.stop()
+
+    assert len(_contents(manager, "s1")) == 6
+    assert len(_contents(manager, "s2")) == 6
+
+
+def test_transient_failure_is_retried_without_losing_turns(manager, monkeypatch):
+    append_many = manager.storage.append_many
+    calls = []
+
+    def flaky(items, now):
+        calls.append(items)
+        if len(calls) <= 2:
+            raise OSError("磁盘暂时不可用")
+        return append_many(items, now)
+
+    monkeypatch.setattr(manager.storage, "append_many", flaky)
+    _writer(manager)._flush([("s1", _turn("s1", 0), None), ("s2", _turn("s2", 0), None)])
+
+    assert len(calls) == 3
+    assert _contents(manager, "s1") == ["s1 question 0", "s1 answer 0"]
+    assert _contents(manager, "s2") == ["s2 question 0", "s2 answer 0"]
+
+
+def test_bad_session_does_not_sink_the_batch(manager, monkeypatch):
+    # JSON 后端逐个会话写文件；SQLite 后端整批一个事务，失败时全部回滚
+    if hasattr(manager.storage, "_append_session_files"):
+        target, name = manager.storage, "_append_session_files"
+    else:
+        target, name = manager.storage, "_append_in_transaction"
+    original = getattr(target, name)
+
+    def poisoned(*args):
+        if "bad" in args:
+            raise ValueError("无法写入")
+        return original(*args)
+
+    monkeypatch.setattr(target, name, poisoned)
+    writer = _writer(manager)
+    writer._flush([
+        ("s1", _turn("s1", 0), None),
+        ("bad", _turn("bad", 0), None),
+        ("s2", _turn("s2", 0), None),
+    ])
+
+    # 其他会话的消息恰好写入一次，会话列表和检索索引与存储一致
+    assert _contents(manager, "s1") == ["s1 question 0", "s1 answer 0"]
+    assert _contents(manager, "s2") == ["s2 question 0", "s2 answer 0"]
+    assert _contents(manager, "bad") == []
+    counts = {s["session_id"]: s["message_count"] for s in manager.get_sessions_list()}
+    assert counts == {"s1": 2, "s2": 2}
+    assert {hit["session_id"] for hit in manager.search_sessions("answer")} == {"s1", "s2"}
+    assert writer.metrics.snapshot()["counters"]["session_writer.dropped_messages"] >= 2
+
+
+def test_json_index_failure_is_repaired_without_duplicates(json_storage, tmp_path, monkeypatch):
+    manager = SessionManager(storage=json_storage, search_index=SearchIndex(tmp_path / "search.db"))
+    update_index = json_storage._update_index
+    failures = []
+
+    def failing_once(update):
+        if not failures:
+            failures.append(True)
+            raise OSError("索引写入失败")
+        return update_index(update)
+
+    monkeypatch.setattr(json_storage, "_update_index", failing_once)
+    _writer(manager)._flush([("s1", _turn("s1", 0), "标题")])
+    assert _contents(manager, "s1") == ["s1 question 0", "s1 answer 0"]
+
+    manager.append_messages("s1", _turn("s1", 1))
+    assert len(_contents(manager, "s1")) == 4
+    assert manager.get_sessions_list()[0]["message_count"] == 4
+    assert [hit["seq"] for hit in manager.search_sessions("question 0")][:1] == [0]
+
+
+def test_wait_for_session_blocks_until_queued_turn_is_written(manager):
+    writer = _writer(manager)
+    asyncio.run(writer.submit("s1", _turn("s1", 0), "标题"))
+
+    # 写入线程未启动：消息仍在队列中，等待超时
+    assert writer.wait_for_session("s1", timeout=0.05) is False
+    assert writer.wait_for_session("other", timeout=0) is True
+    assert _contents(manager, "s1") == []
+
+    writer.start()
+    try:
+        assert writer.wait_for_session("s1", timeout=5) is True
+        assert _contents(manager, "s1") == ["s1 question 0", "s1 answer 0"]
+    finally:
+        writer.stop()
+
+
+def test_wait_for_session_returns_after_failed_write(manager, monkeypatch):
+    def broken(*args, **kwargs):
+        raise OSError("磁盘不可用")
+
+    monkeypatch.setattr(manager, "append_many", broken)
+    monkeypatch.setattr(manager, "append_messages", broken)
+    writer = _writer(manager)
+    writer.start()
+    try:
+        asyncio.run(writer.submit("s1", _turn("s1", 0)))
+        # 放弃写入也算写完，等待方不会一直阻塞
+        assert writer.wait_for_session("s1", timeout=5) is True
+    finally:
+        writer.stop()
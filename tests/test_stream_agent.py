@@ -0,0 +1,306 @@
+"""/stream_agent 运行预算与断开连接测试"""
+
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from langchain_core.messages import AIMessageChunk, ToolMessage
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.errors import GraphRecursionError
+
+import app as app_module
+from backend.checkpointer import BoundedMemorySaver, has_thread_state
+from backend.metrics import get_metrics
+from backend.session_manager import SessionManager
+from backend.session_search import SearchIndex
+from backend.session_writer import SessionWriter
+
+ANSWER = "This is a partial answer streamed directly to the client before anything else happens."
+
+
+class FakeGraph:
+    """按脚本产生事件的智能体图；脚本结束后正常结束（finish=True）或一直等待，直到被取消或抛出指定异常"""
+
+    def __init__(self, events, error: Exception = None, finish: bool = False):
+        self.events = events
+        self.error = error
+        self.finish = finish
+        self.cancelled = False
+        self.config = None
+        self.input = None
+
+    async def astream_events(self, input, config, version):
+        self.input = input
+        self.config = config
+        for event in self.events:
+            yield event
+            await asyncio.sleep(0)
+        if self.error is not None:
+            raise self.error
+        if self.finish:
+            return
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+class StreamingGraph(FakeGraph):
+    """模型不停输出的智能体图：事件队列始终不为空"""
+
+    def __init__(self):
+        super().__init__([])
+        self.chunks = 0
+        self.stopped = False
+
+    async def astream_events(self, input, config, version):
+        self.input = input
+        self.config = config
+        try:
+            while True:
+                # 每次让出控制权之前连续产生多个事件，消费方取事件时总有事件就绪
+                for _ in range(10):
+                    self.chunks += 1
+                    yield {
+                        "event": "on_chat_model_stream",
+                        "data": {"chunk": AIMessageChunk(content="token ")},
+                        "metadata": {"langgraph_step": 1},
+                    }
+                await asyncio.sleep(0)
+        finally:
+            # 任务被取消时通常停在向事件队列写入处，生成器随后才被关闭
+            self.stopped = True
+
+
+class FakeAgent:
+    def __init__(self, graph, checkpointer=None):
+        self.graph = graph
+        self.checkpointer = checkpointer
+
+    async def get_or_build_graph(self, key, build):
+        return self.graph
+
+    def prefetch_search(self, graph, query):
+        return None
+
+
+class FakeWriter:
+    def __init__(self):
+        self.submitted = []
+
+    async def submit(self, session_id, messages, title=None):
+        self.submitted.append((session_id, messages))
+
+    def wait_for_session(self, session_id, timeout=None):
+        return True
+
+
+class FakeRequest:
+    headers = {"X-Tavily-Key": "tvly-test"}
+
+    def __init__(self, disconnect_after: float = None):
+        self.disconnect_at = None if disconnect_after is None else asyncio.get_running_loop().time() + disconnect_after
+
+    async def is_disconnected(self) -> bool:
+        return self.disconnect_at is not None and asyncio.get_running_loop().time() >= self.disconnect_at
+
+
+def _tool_events():
+    output = ToolMessage(
+        content=json.dumps({"results": [{"title": "Example", "url": "https://example.com"}]}),
+        artifact={"cached": False}, tool_call_id="call_0", name="tavily_search",
+    )
+    return [
+        {"event": "on_tool_start", "name": "tavily_search", "run_id": "r0", "data": {"input": {"query": "q"}}},
+        {"event": "on_tool_end", "name": "tavily_search", "run_id": "r0", "data": {"output": output}},
+        {"event": "on_tool_start", "name": "tavily_extract", "run_id": "r1", "data": {"input": {"urls": ["u"]}}},
+    ]
+
+
+def _answer_event():
+    return {
+        "event": "on_chat_model_stream",
+        "data": {"chunk": AIMessageChunk(content=ANSWER)},
+        "metadata": {"langgraph_step": 1},
+    }
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    writer = FakeWriter()
+    monkeypatch.setattr(app_module.app.state, "session_writer", writer, raising=False)
+    monkeypatch.setattr(app_module, "DISCONNECT_POLL_SECONDS", 0.05)
+    return writer
+
+
+def _stream(graph, disconnect_after=None, checkpointer=None, **fields):
+    app_module.app.state.agent = FakeAgent(graph, checkpointer)
+    fields.setdefault("thread_id", "t1")
+    body = app_module.AgentRequest(input="问题", agent_type="fast", **fields)
+
+    async def run():
+        response = await app_module.stream_agent(body, FakeRequest(disconnect_after))
+        return [json.loads(line) async for line in response.body_iterator]
+
+    return asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def _counter(name: str) -> float:
+    return get_metrics().snapshot()["counters"].get(name, 0)
+
+
+def test_deadline_cancels_the_run_and_answers_from_tool_results(writer):
+    graph = FakeGraph(_tool_events())
+    exceeded = _counter("agent.deadline_exceeded")
+
+    events = _stream(graph, deadline_seconds=0.3, max_steps=3)
+
+    assert graph.cancelled
+    assert graph.config["configurable"]["max_steps"] == 3
+    assert [event["type"] for event in events] == [
+        "tool_start", "tool_end", "tool_start", "tool_end", "chatbot", "deadline_exceeded"
+    ]
+    assert events[3]["status"] == "error" and events[3]["operation_index"] == 1
+    assert "https://example.com" in events[4]["content"]
+    assert events[5]["reason"] == "deadline" and events[5]["deadline_seconds"] == 0.3
+    assert _counter("agent.deadline_exceeded") == exceeded + 1
+    assert writer.submitted[0][1][-1]["content"] == events[4]["content"]
+
+
+def test_step_limit_ends_with_a_best_effort_answer(writer):
+    graph = FakeGraph(_tool_events()[:2], error=GraphRecursionError("too many steps"))
+
+    events = _stream(graph)
+
+    assert [event["type"] for event in events][-2:] == ["chatbot", "deadline_exceeded"]
+    assert events[-1]["reason"] == "max_steps"
+
+
+def test_started_answer_is_kept_when_the_deadline_hits(writer):
+    graph = FakeGraph([_answer_event()])
+
+    events = _stream(graph, deadline_seconds=0.3)
+
+    # 已输出的答案保留，不再用工具结果生成答案
+    assert [event["type"] for event in events][-1] == "deadline_exceeded"
+    assert events[0]["content"] == ANSWER
+    assert writer.submitted[0][1][-1]["content"] == ANSWER
+
+
+
+async def _eager_wait_for(awaitable, timeout):
+    """Python 3.12 起的 wait_for 语义：结果已就绪时直接返回，即使已经超时"""
+    async with asyncio.timeout(timeout):
+        return await awaitable
+
+
+def test_deadline_fires_while_the_model_streams_nonstop(writer, monkeypatch):
+    # 3.11 的 wait_for 在超时为 0 时总是超时，会掩盖只在等待超时时检查截止时间的问题
+    monkeypatch.setattr(asyncio, "wait_for", _eager_wait_for)
+    graph = StreamingGraph()
+    app_module.app.state.agent = FakeAgent(graph)
+    body = app_module.AgentRequest(input="问题", thread_id="t1", agent_type="fast", deadline_seconds=0.3)
+
+    async def run():
+        response = await app_module.stream_agent(body, FakeRequest())
+        events = []
+        async for line in response.body_iterator:
+            events.append(json.loads(line))
+            # 写入响应时让出控制权（与真实连接相同），智能体任务趁机继续填充事件队列
+            await asyncio.sleep(0)
+        return events
+
+    started = time.monotonic()
+    events = asyncio.run(asyncio.wait_for(run(), 10))
+
+    assert time.monotonic() - started < 2
+    assert graph.stopped and graph.chunks > 1
+    assert events[-1]["type"] == "deadline_exceeded" and events[-1]["reason"] == "deadline"
+    assert all(event["type"] == "chatbot" for event in events[:-1])
+
+
+def test_client_disconnect_cancels_the_run_and_saves_the_partial_answer(writer):
+    graph = FakeGraph([_answer_event()])
+    aborted = _counter("agent.aborted_runs")
+
+    events = _stream(graph, disconnect_after=0.1)
+
+    assert graph.cancelled
+    assert all(event["type"] == "chatbot" for event in events)
+    assert _counter("agent.aborted_runs") == aborted + 1
+    saved = writer.submitted[0][1][-1]
+    assert saved["role"] == "assistant" and saved["aborted"] is True
+    assert saved["content"] == ANSWER
+
+
+def test_closed_stream_cancels_the_run(writer):
+    graph = FakeGraph([_answer_event()])
+    app_module.app.state.agent = FakeAgent(graph)
+    body = app_module.AgentRequest(input="问题", thread_id="t1", agent_type="fast")
+    aborted = _counter("agent.aborted_runs")
+
+    async def run():
+        # 服务器写入失败时关闭生成器（客户端在两次轮询之间断开）
+        response = await app_module.stream_agent(body, FakeRequest())
+        first = await response.body_iterator.__anext__()
+        await response.body_iterator.aclose()
+        await asyncio.sleep(0.05)
+        return json.loads(first)
+
+    first = asyncio.run(asyncio.wait_for(run(), 10))
+
+    assert first["content"] == ANSWER
+    assert graph.cancelled
+    assert _counter("agent.aborted_runs") == aborted + 1
+    assert writer.submitted[0][1][-1]["aborted"] is True
+
+
+def test_cold_thread_rehydrates_a_turn_still_in_the_write_queue(json_storage, tmp_path, monkeypatch):
+    manager = SessionManager(storage=json_storage, search_index=SearchIndex(tmp_path / "search.db"))
+    monkeypatch.setattr(app_module, "get_session_manager", lambda: manager)
+    session_writer = SessionWriter(manager)
+    monkeypatch.setattr(app_module.app.state, "session_writer", session_writer, raising=False)
+    turn = [{"role": "user", "content": "上一轮问题"}, {"role": "assistant", "content": "上一轮回答"}]
+    asyncio.run(session_writer.submit("t-cold", turn, "标题"))
+
+    # 上一轮仍在队列中时新请求到达冷线程，写入线程稍后才开始工作
+    timer = threading.Timer(0.2, session_writer.start)
+    timer.start()
+    graph = FakeGraph([_answer_event()], error=ValueError("结束"))
+    try:
+        _stream(graph, thread_id="t-cold")
+    finally:
+        timer.join()
+        session_writer.stop()
+
+    contents = [message.content for message in graph.input["messages"]]
+    assert contents[:2] == ["上一轮问题", "上一轮回答"]
+    assert contents[-1] == "问题"
+
+
+def _cached_thread(thread_id: str) -> BoundedMemorySaver:
+    saver = BoundedMemorySaver()
+    saver.put({"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}, empty_checkpoint(), {}, {})
+    return saver
+
+
+def test_unfinished_run_drops_the_cached_thread(writer):
+    saver = _cached_thread("t1")
+
+    _stream(FakeGraph([_answer_event()]), checkpointer=saver, deadline_seconds=0.3)
+
+    # 下一轮从保存的会话（含尽力而为的答案）重建上下文，而不是停在中途的检查点
+    assert not asyncio.run(has_thread_state(saver, "t1"))
+    assert writer.submitted[0][1][-1]["content"] == ANSWER
+
+
+def test_finished_run_keeps_the_cached_thread(writer):
+    saver = _cached_thread("t1")
+
+    events = _stream(FakeGraph([_answer_event()], finish=True), checkpointer=saver)
+
+    assert events[-1]["content"] == ANSWER
+    assert asyncio.run(has_thread_state(saver, "t1"))
@@ -0,0 +1,252 @@
+"""工具输出摘要测试"""
+
+import asyncio
+from typing import List
+
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import Field
+
+from backend import agent
+from backend.cache import TieredCache
+from backend.agent import SUMMARY_FALLBACK_TOKENS, create_async_output_summarizer, create_output_summarizer
+from backend.metrics import get_metrics
+from backend.token_budget import estimate_tokens
+
+
+class RecordingChatModel(FakeListChatModel):
+    """记录提示词的假摘要模型；异步调用可以设置延迟"""
+    responses: List[str] = Field(default_factory=lambda: ["摘要"])
+    delay: float = 0
+    prompts: List[str] = Field(default_factory=list)
+    sync_calls: int = 0
+    started: int = 0
+    cancelled: int = 0
+    active: int = 0
+    peak: int = 0
+    fail_on: str = ""
+
+    def _generate(self, messages, *args, **kwargs) -> ChatResult:
+        self.sync_calls += 1
+        return self._respond(messages)
+
+    async def _agenerate(self, messages, *args, **kwargs) -> ChatResult:
+        self.started += 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.active -= 1
+        return self._respond(messages)
+
+    def _respond(self, messages) -> ChatResult:
+        prompt = messages[-1].content
+        self.prompts.append(prompt)
+        reduce = "分块摘要" in prompt
+        if self.fail_on and self.fail_on in prompt and not reduce:
+            raise RuntimeError("摘要模型出错")
+        content = "合并摘要" if reduce else f"摘要{len(self.prompts)}"
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+
+def _output(*pages: str) -> dict:
+    return {"results": [
+        {"url": f"https://example.com/{index}", "favicon": f"https://example.com/{index}.ico", "raw_content": page}
+        for index, page in enumerate(pages)
+    ]}
+
+
+def _counter(name: str) -> float:
+    return get_metrics().snapshot()["counters"].get(name, 0)
+
+
+def test_async_summary_uses_ainvoke():
+    model = RecordingChatModel()
+    summarize = create_async_output_summarizer(model, timeout=5)
+
+    result = asyncio.run(summarize(_output("异步摘要测试页面，介绍事件循环与并发。"), "什么是事件循环"))
+
+    assert result["summary"] == "摘要1"
+    assert result["urls"] == ["https://example.com/0"]
+    assert result["favicons"] == ["https://example.com/0.ico"]
+    assert model.sync_calls == 0
+    assert "什么是事件循环" in model.prompts[0]
+
+
+def test_async_summary_timeout_falls_back_to_truncated_content():
+    model = RecordingChatModel(delay=5)
+    summarize = create_async_output_summarizer(model, timeout=0.05)
+    page = "超时回退测试 " * 120
+    timeouts = _counter("summarizer.timeouts")
+
+    result = asyncio.run(summarize(_output(page), "超时"))
+
+    assert result["summary"].startswith("超时回退测试")
+    assert estimate_tokens(result["summary"]) <= SUMMARY_FALLBACK_TOKENS + 1
+    assert model.cancelled == 1
+    assert _counter("summarizer.timeouts") == timeouts + 1
+
+
+def test_cancelled_request_cancels_the_summary_call():
+    model = RecordingChatModel(delay=5)
+    summarize = create_async_output_summarizer(model, timeout=10)
+
+    async def run():
+        task = asyncio.create_task(summarize(_output("取消传播测试页面。"), "取消"))
+        while not model.started:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert model.cancelled == 1
+    assert model.prompts == []
+
+
+def _long_pages(count: int = 12) -> List[str]:
+    # 每页约 600 token，远超单个分块；每页带一个唯一标记
+    return [
+        f"第{index}页标记 " + "".join(f"第{index}页第{j}段记录了数值{index * 37 + j * 11}和结论{j * j + index}。" for j in range(40))
+        for index in range(count)
+    ]
+
+
+def test_long_content_is_summarized_in_bounded_parallel_chunks(monkeypatch):
+    monkeypatch.setattr(agent, "SUMMARY_MAX_CONCURRENCY", 2)
+    model = RecordingChatModel(delay=0.05)
+    summarize = create_async_output_summarizer(model, timeout=5)
+    pages = _long_pages()
+
+    result = asyncio.run(summarize(_output(*pages), "分块"))
+
+    chunk_prompts, reduce_prompts = model.prompts[:-1], model.prompts[-1:]
+    assert result["summary"] == "合并摘要"
+    assert len(chunk_prompts) > 1 and "分块摘要" in reduce_prompts[0]
+    assert model.peak == 2
+    # 内容不再截断到前 3000 个字符：最后一页也进入了分块摘要
+    assert any("第11页标记" in prompt for prompt in chunk_prompts)
+
+
+def test_failed_chunk_falls_back_without_sinking_the_summary():
+    model = RecordingChatModel(fail_on="第3页标记")
+    summarize = create_async_output_summarizer(model, timeout=5)
+
+    result = asyncio.run(summarize(_output(*_long_pages(6)), "分块"))
+
+    assert result["summary"] == "合并摘要"
+    # 失败的分块以截断的原文参与合并，其余分块使用摘要
+    reduce_prompt = model.prompts[-1]
+    assert "记录了数值" in reduce_prompt
+    assert "[1] 摘要" in reduce_prompt
+
+
+def test_sync_summary_maps_chunks_with_batch():
+    model = RecordingChatModel()
+    summarize = create_output_summarizer(model)
+
+    result = summarize(_output(*_long_pages(6)), "同步分块")
+
+    assert result["summary"] == "合并摘要"
+    assert model.sync_calls == len(model.prompts) > 2
+    assert any("第5页标记" in prompt for prompt in model.prompts[:-1])
+
+
+def test_summary_cache_skips_the_model_on_repeat(tmp_path):
+    cache = TieredCache("test_summary_cache", max_entries=16, ttl=60, disk_path=tmp_path / "summaries.db")
+    model = RecordingChatModel()
+    summarize = create_async_output_summarizer(model, timeout=5, cache=cache)
+    output = _output("摘要缓存测试页面，介绍内容寻址缓存。")
+
+    first = asyncio.run(summarize(output, "什么是内容寻址缓存？"))
+    # 问题只在大小写、标点和空白上不同时命中同一条摘要
+    second = asyncio.run(summarize(output, "  什么是内容寻址缓存 "))
+    # 同步摘要器共享同一个缓存
+    third = create_output_summarizer(model, cache=cache)(output, "什么是内容寻址缓存?")
+
+    assert first["summary"] == second["summary"] == third["summary"] == "摘要1"
+    assert len(model.prompts) == 1
+    assert cache.stats()["hits"] == 2 and cache.stats()["hit_rate"] == 2 / 3
+
+    asyncio.run(summarize(output, "另一个问题"))
+    assert len(model.prompts) == 2
+
+    # 磁盘层在新的缓存实例（如进程重启后）中仍然有效
+    restarted = TieredCache("test_summary_cache", max_entries=16, ttl=60, disk_path=tmp_path / "summaries.db")
+    result = asyncio.run(create_async_output_summarizer(model, timeout=5, cache=restarted)(output, "什么是内容寻址缓存"))
+    assert result["summary"] == "摘要1"
+    assert len(model.prompts) == 2
+
+
+def test_fallback_summary_is_not_cached():
+    cache = TieredCache("test_summary_cache_fallback", max_entries=16, ttl=60)
+    output = _output("回退摘要不缓存的测试页面。")
+
+    slow = create_async_output_summarizer(RecordingChatModel(delay=5), timeout=0.05, cache=cache)
+    asyncio.run(slow(output, "回退"))
+    assert cache.stats()["memory"]["entries"] == 0
+
+    model = RecordingChatModel()
+    result = asyncio.run(create_async_output_summarizer(model, timeout=5, cache=cache)(output, "回退"))
+    assert result["summary"] == "摘要1"
+    assert len(model.prompts) == 1
+
+
+def test_structured_output_is_read_without_parsing(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("结构化输出不应再被解析")
+
+    monkeypatch.setattr(agent.json, "loads", fail)
+    monkeypatch.setattr(agent.ast, "literal_eval", fail)
+    result, pages = agent._prepare_summary(_output("结构化输出测试页面。"))
+
+    assert result == {"summary": None, "urls": ["https://example.com/0"], "favicons": ["https://example.com/0.ico"]}
+    assert pages == ["结构化输出测试页面。"]
+
+
+def test_string_output_is_parsed_as_a_fallback():
+    output = _output("字符串输出测试页面。")
+    for text in (agent.json.dumps(output, ensure_ascii=False), str(output)):
+        result, pages = agent._prepare_summary(text)
+        assert result["urls"] == ["https://example.com/0"]
+        assert pages == ["字符串输出测试页面。"]
+
+    result, pages = agent._prepare_summary("不是结构化输出")
+    assert result == {"summary": "不是结构化输出", "urls": []} and pages == []
+
+
+def test_unsummarizable_output_stays_serializable():
+    result, pages = agent._prepare_summary({"results": [{"url": "https://example.com"}]})
+    assert pages == []
+    assert isinstance(result["summary"], str)
+    assert agent.json.loads(agent.json.dumps(result))["urls"] == ["https://example.com"]
+
+
+def test_extract_tool_passes_the_result_dict_to_the_summarizer(monkeypatch):
+    output = _output("工具直接传递字典的测试页面。")
+    received = []
+
+    async def asummarize(result, user_message):
+        received.append((result, user_message))
+        return {"summary": "摘要", "urls": []}
+
+    tool = agent.SummarizingTavilyExtract(
+        tavily_api_key="tvly-test", output_summarizer=lambda *_: None, async_output_summarizer=asummarize
+    )
+
+    async def afetch(*args, **kwargs):
+        return output, True
+
+    monkeypatch.setattr(tool, "_afetch", afetch)
+    content, artifact = asyncio.run(tool._arun(urls=["https://example.com/0"], config={
+        "configurable": {"user_message": "问题"}
+    }))
+
+    assert received == [(output, "问题")]
+    assert content == {"summary": "摘要", "urls": []} and artifact == {"cached": True}
@@ -0,0 +1,40 @@
+"""token 估算与截断测试"""
+
+import sys
+
+from backend import token_budget
+from backend.token_budget import estimate_tokens, split_tokens, truncate_tokens
+
+
+def test_estimate_counts_cjk_per_character():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd" * 10) == 10
+    assert estimate_tokens("中文测试") == 4
+    assert estimate_tokens("中文 abcd") == 2 + 2
+
+
+def test_estimate_cache_does_not_hold_the_text(monkeypatch):
+    monkeypatch.setattr(token_budget, "_estimate_cache", token_budget.OrderedDict())
+    monkeypatch.setattr(token_budget, "ESTIMATE_CACHE_SIZE", 3)
+    text = "缓存键测试 " * 1000
+    refs = sys.getrefcount(text)
+
+    assert estimate_tokens(text) == estimate_tokens(text) == token_budget._estimate(text)
+    assert sys.getrefcount(text) == refs
+    assert list(token_budget._estimate_cache) == [(hash(text), len(text))]
+
+    for index in range(5):
+        estimate_tokens(f"text {index}")
+    assert len(token_budget._estimate_cache) == 3
+
+
+def test_truncate_and_split_respect_the_budget():
+    text = "第一段内容。\n" * 50
+    truncated = truncate_tokens(text, 20)
+    assert estimate_tokens(truncated) <= 21 and text.startswith(truncated.rstrip("…"))
+    assert truncate_tokens("short", 20) == "short"
+
+    chunks = split_tokens(text, 60)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 60 for chunk in chunks)
+    assert "".join(chunks).replace("\n", "") == text.replace("\n", "")
@@ -0,0 +1,94 @@
+"""Tavily 工具结果缓存测试"""
+
+import asyncio
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+from pydantic import SecretStr
+
+from backend.tool_cache import CachedToolMixin
+
+
+class FakeTavilyTool:
+    """模拟 Tavily 工具：密钥以 invalid 开头时请求失败"""
+    name = "fake_tavily"
+
+    def __init__(self, api_key: str, calls: list):
+        self.api_wrapper = SimpleNamespace(tavily_api_key=SecretStr(api_key))
+        self.calls = calls
+
+    def _result(self, query: str):
+        key = self.api_wrapper.tavily_api_key.get_secret_value()
+        self.calls.append(key)
+        if key.startswith("invalid"):
+            raise ValueError("Unauthorized: invalid API key")
+        return {"query": query, "results": [{"url": "https://example.com", "content": query}]}
+
+    def _run(self, query: str):
+        time.sleep(0.1)
+        return self._result(query)
+
+    async def _arun(self, query: str):
+        await asyncio.sleep(0.1)
+        return self._result(query)
+
+
+class CachedFakeTool(CachedToolMixin, FakeTavilyTool):
+    cache_ttl = 60
+
+
+def _query() -> str:
+    return f"single-flight {uuid.uuid4()}"
+
+
+def test_same_key_calls_are_coalesced():
+    calls = []
+    tool = CachedFakeTool("tvly-a", calls)
+    query = _query()
+
+    async def run():
+        return await asyncio.gather(*(tool._afetch(query=query) for _ in range(3)))
+
+    results = asyncio.run(run())
+    assert calls == ["tvly-a"]
+    assert all(result == results[0] for result in results)
+
+
+def test_errors_are_not_shared_across_api_keys():
+    calls = []
+    invalid, valid = CachedFakeTool("invalid-key", calls), CachedFakeTool("tvly-b", calls)
+    query = _query()
+
+    async def run():
+        return await asyncio.gather(
+            invalid._afetch(query=query), valid._afetch(query=query), return_exceptions=True
+        )
+
+    failed, (result, cached) = asyncio.run(run())
+    assert isinstance(failed, ValueError)
+    assert result["query"] == query and not cached
+    assert sorted(calls) == ["invalid-key", "tvly-b"]
+
+
+def test_sync_errors_are_not_shared_across_api_keys():
+    calls = []
+    query = _query()
+    outcomes = {}
+
+    def fetch(api_key: str):
+        try:
+            outcomes[api_key] = CachedFakeTool(api_key, calls)._fetch(query=query)[0]
+        except ValueError as e:
+            outcomes[api_key] = e
+
+    threads = [threading.Thread(target=fetch, args=(key,)) for key in ("invalid-key", "tvly-c")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert isinstance(outcomes["invalid-key"], ValueError)
+    assert outcomes["tvly-c"]["query"] == query
+    assert sorted(calls) == ["invalid-key", "tvly-c"]
@@ -0,0 +1,142 @@
+"""并发工具执行测试"""
+
+import asyncio
+import time
+
+from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.tools import tool
+from langgraph.prebuilt import ToolNode, create_react_agent
+
+from backend.metrics import get_metrics
+from backend.tool_node import ConcurrentToolNode
+
+active = {"now": 0, "peak": 0}
+
+
+async def _work(seconds: float) -> str:
+    active["now"] += 1
+    active["peak"] = max(active["peak"], active["now"])
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        active["now"] -= 1
+    return f"slept {seconds}"
+
+
+@tool
+async def tavily_search(seconds: float) -> str:
+    """Search."""
+    return await _work(seconds)
+
+
+@tool
+async def tavily_extract(seconds: float) -> str:
+    """Extract."""
+    return await _work(seconds)
+
+
+def _state(*calls):
+    tool_calls = [
+        {"name": name, "args": {"seconds": seconds}, "id": f"call_{index}", "type": "tool_call"}
+        for index, (name, seconds) in enumerate(calls)
+    ]
+    return {"messages": [HumanMessage(content="问题"), AIMessage(content="", tool_calls=tool_calls)]}
+
+
+def _run(node, state, configurable=None):
+    active.update(now=0, peak=0)
+    started = time.perf_counter()
+    result = asyncio.run(node.ainvoke(state, {"configurable": configurable or {}}))
+    return result["messages"], time.perf_counter() - started
+
+
+def test_tool_calls_run_concurrently_within_the_limit():
+    node = ConcurrentToolNode([tavily_search, tavily_extract], max_concurrency=2, timeouts={})
+    observations = get_metrics().snapshot()["observations"]
+    steps = observations.get("tools.parallel_saved_seconds", {}).get("count", 0)
+
+    messages, elapsed = _run(node, _state(
+        ("tavily_search", 0.2), ("tavily_extract", 0.2), ("tavily_extract", 0.2), ("tavily_extract", 0.2)
+    ))
+
+    assert [message.tool_call_id for message in messages] == ["call_0", "call_1", "call_2", "call_3"]
+    assert active["peak"] == 2
+    assert 0.35 < elapsed < 0.75
+    saved = get_metrics().snapshot()["observations"]["tools.parallel_saved_seconds"]
+    assert saved["count"] == steps + 1 and saved["last"] > 0.3
+
+
+def test_request_can_lower_the_concurrency_limit():
+    node = ConcurrentToolNode([tavily_search, tavily_extract], max_concurrency=4, timeouts={})
+    _run(node, _state(("tavily_search", 0.05), ("tavily_extract", 0.05)), {"max_tool_concurrency": 1})
+    assert active["peak"] == 1
+
+
+def test_slow_tool_times_out_without_failing_the_step():
+    node = ConcurrentToolNode([tavily_search, tavily_extract], timeouts={"tavily_extract": 0.1})
+
+    messages, elapsed = _run(node, _state(("tavily_search", 0.2), ("tavily_extract", 5)))
+
+    assert elapsed < 1
+    assert messages[0].content == "slept 0.2" and messages[0].status == "success"
+    assert messages[1].status == "error" and "超时" in messages[1].content
+
+
+@tool("tavily_search")
+def sync_search(seconds: float) -> str:
+    """Search."""
+    time.sleep(seconds)
+    return f"slept {seconds}"
+
+
+def test_sync_invoke_and_tool_node_error_handling():
+    node = ConcurrentToolNode([sync_search], max_concurrency=2)
+    state = _state(("tavily_search", 0.01))
+    state["messages"][-1].tool_calls.append({"name": "missing_tool", "args": {}, "id": "call_x", "type": "tool_call"})
+
+    messages = node.invoke(state, {"configurable": {}})["messages"]
+
+    assert messages[0].content == "slept 0.01"
+    # 未知工具由 ToolNode 自身处理，返回错误消息
+    assert messages[1].tool_call_id == "call_x" and messages[1].status == "error"
+
+
+def test_only_public_tool_node_api_is_overridden():
+    overridden = [
+        name for name in vars(ConcurrentToolNode)
+        if name.startswith("_") and not name.startswith("__") and callable(getattr(ToolNode, name, None))
+    ]
+    assert overridden == []
+
+
+class _ToolCallingModel(FakeMessagesListChatModel):
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+def test_runs_as_the_tools_node_of_a_react_agent():
+    calls = [
+        {"name": "tavily_search", "args": {"seconds": 0.2}, "id": "call_0", "type": "tool_call"},
+        {"name": "tavily_extract", "args": {"seconds": 0.2}, "id": "call_1", "type": "tool_call"},
+    ]
+    model = _ToolCallingModel(responses=[AIMessage(content="", tool_calls=calls), AIMessage(content="答案")])
+    graph = create_react_agent(
+        model=model, tools=ConcurrentToolNode([tavily_search, tavily_extract], timeouts={}), version="v1"
+    )
+
+    async def run():
+        tool_events = []
+        async for event in graph.astream_events({"messages": [HumanMessage(content="问题")]}, version="v2"):
+            if event["event"] in ("on_tool_start", "on_tool_end"):
+                tool_events.append(event["event"])
+            if event["event"] == "on_chain_end" and event["name"] == "LangGraph":
+                return event["data"]["output"]["messages"], tool_events
+
+    active.update(now=0, peak=0)
+    messages, tool_events = asyncio.run(run())
+
+    assert [m.tool_call_id for m in messages if isinstance(m, ToolMessage)] == ["call_0", "call_1"]
+    assert messages[-1].content == "答案"
+    assert active["peak"] == 2
+    assert sorted(tool_events) == ["on_tool_end"] * 2 + ["on_tool_start"] * 2